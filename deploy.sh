@@ -54,9 +54,10 @@ docker run -d \
 echo "⏳ Ожидание запуска приложения..."
 sleep 5
 
-# Применение миграций
+# Применение миграций (при обновлении - в том числе однократный пересчет агрегатов доступности)
 echo "📊 Применение миграций..."
 docker exec web_dashboard python manage.py migrate --settings=web_dashboard.settings_prod
+docker exec web_dashboard python manage.py createcachetable --database cache --settings=web_dashboard.settings_prod
 
 # Проверка статуса
 if docker ps | grep -q web_dashboard; then
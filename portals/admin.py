@@ -7,7 +7,7 @@
 from django.contrib import admin
 
 # Модели приложения порталов
-from .models import Portal, PortalAvailability
+from .models import Portal, PortalAvailability, PortalJob, DomainFavicon
 
 
 @admin.register(Portal)
@@ -20,7 +20,7 @@ class PortalAdmin(admin.ModelAdmin):
     """
     
     # Колонки в списке порталов
-    list_display = ['title', 'url', 'user', 'position', 'created_at']
+    list_display = ['title', 'url', 'user', 'position', 'check_interval', 'uptime_display', 'created_at']
     
     # Фильтры в боковой панели
     list_filter = ['user', 'created_at']
@@ -30,6 +30,15 @@ class PortalAdmin(admin.ModelAdmin):
     
     # Сортировка по умолчанию
     ordering = ['position', '-created_at']
+    
+    def get_queryset(self, request):
+        """Аннотирует доступность одним запросом вместо запросов на каждую строку."""
+        return super().get_queryset(request).with_uptime()
+    
+    @admin.display(description='Доступность (7 дней)', ordering='uptime')
+    def uptime_display(self, obj):
+        """Процент доступности из аннотации with_uptime."""
+        return f'{obj.uptime_percentage}%' if obj.uptime_percentage is not None else '—'
 
 
 @admin.register(PortalAvailability)
@@ -49,3 +58,37 @@ class PortalAvailabilityAdmin(admin.ModelAdmin):
     
     # Сортировка по времени (новые сверху)
     ordering = ['-timestamp']
+
+
+@admin.register(PortalJob)
+class PortalJobAdmin(admin.ModelAdmin):
+    """
+    Настройка отображения модели PortalJob в админ-панели.
+    
+    Позволяет отслеживать очередь фоновых задач
+    и причины неудачных выполнений.
+    """
+    
+    # Колонки в списке задач
+    list_display = ['portal', 'kind', 'status', 'attempts', 'run_after', 'updated_at']
+    
+    # Фильтры в боковой панели
+    list_filter = ['status', 'kind']
+    
+    # Сортировка по времени запуска
+    ordering = ['run_after']
+
+
+@admin.register(DomainFavicon)
+class DomainFaviconAdmin(admin.ModelAdmin):
+    """
+    Настройка отображения кэша favicon по доменам в админ-панели.
+    
+    Удаление записи заставит заново загрузить иконку домена.
+    """
+    
+    # Колонки в списке доменов
+    list_display = ['domain', 'content_hash', 'path', 'fetched_at']
+    
+    # Поля для поиска
+    search_fields = ['domain']
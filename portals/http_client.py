@@ -0,0 +1,340 @@
+"""
+Модуль общего HTTP-клиента для проверок доступности и загрузки favicon.
+Держит одну сессию requests с пулом keep-alive соединений,
+поэтому повторные запросы к тому же хосту не тратят время
+на новое TCP-соединение и TLS-рукопожатие.
+Новые соединения замеряют длительность фаз DNS, TCP и TLS,
+имена разрешаются через общий кэш DNS процесса.
+"""
+
+# Блокировка для ленивого создания сессии из нескольких потоков
+import threading
+
+# Разрешение имен и замер времени фаз соединения
+import socket
+import time
+
+# Параллельное предварительное разрешение имен
+from concurrent.futures import ThreadPoolExecutor
+
+# Разбор URL для определения хоста и порта
+from urllib.parse import urlparse
+
+# Политика cookie, запрещающая их сохранение
+from http.cookiejar import DefaultCookiePolicy
+
+# Библиотека для выполнения HTTP-запросов и адаптер с пулом соединений
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util import connection as urllib3_connection
+
+# Настройки проекта
+from django.conf import settings
+
+
+_lock = threading.Lock()
+_session = None
+
+
+class DNSCache:
+    """
+    Потокобезопасный кэш разрешения имен в адреса.
+
+    Системный резолвер (getaddrinfo) не сообщает TTL записей, поэтому
+    срок жизни ответа ограничен настройкой PORTALS_DNS_CACHE_TTL.
+    Ответ «имя не существует» кэшируется на PORTALS_DNS_NEGATIVE_TTL.
+    При временной ошибке резолвера (таймаут) возвращается устаревший
+    ответ, если он есть, чтобы сбой DNS не записывался как недоступность.
+    Одновременные запросы одного имени выполняют один lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._host_locks = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Обнуляет счетчики попаданий, промахов и времени запросов."""
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.lookup_time = 0.0
+
+    def stats(self):
+        """Возвращает счетчики кэша: hits, misses, stale, hit_rate, avg_lookup_ms."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'hit_rate': self.hits / total if total else None,
+            'avg_lookup_ms': self.lookup_time / self.misses * 1000 if self.misses else None,
+        }
+
+    def clear(self):
+        """Удаляет все записи кэша."""
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, host, port):
+        return [
+            (family, sockaddr)
+            for family, _, _, _, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        ]
+
+    def resolve(self, host, port):
+        """Возвращает список адресов (family, sockaddr) для хоста и порта."""
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return self._unpack(entry)
+            host_lock = self._host_locks.setdefault(key, threading.Lock())
+
+        with host_lock:
+            # Пока ждали блокировку, имя мог разрешить другой поток
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return self._unpack(entry)
+
+            started = time.perf_counter()
+            try:
+                addresses = self._lookup(host, port)
+            except socket.gaierror as e:
+                with self._lock:
+                    self.misses += 1
+                    self.lookup_time += time.perf_counter() - started
+                    if e.errno == socket.EAI_NONAME:
+                        self._entries[key] = (time.monotonic() + settings.PORTALS_DNS_NEGATIVE_TTL, e)
+                    elif entry is not None and not isinstance(entry[1], Exception):
+                        self.stale += 1
+                        return entry[1]
+                raise
+
+            with self._lock:
+                self.misses += 1
+                self.lookup_time += time.perf_counter() - started
+                self._entries[key] = (time.monotonic() + settings.PORTALS_DNS_CACHE_TTL, addresses)
+            return addresses
+
+    @staticmethod
+    def _unpack(entry):
+        if isinstance(entry[1], Exception):
+            raise entry[1]
+        return entry[1]
+
+    def prefetch(self, hosts, concurrency=20):
+        """
+        Заранее разрешает набор пар (хост, порт) параллельно.
+
+        Вызывается в начале цикла монитора, чтобы проверки
+        не ждали DNS. Ошибки разрешения игнорируются:
+        они повторятся и будут учтены при самой проверке.
+        """
+        def warm(key):
+            try:
+                self.resolve(*key)
+            except OSError:
+                pass
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            list(executor.map(warm, set(hosts)))
+
+
+# Общий кэш DNS процесса
+dns_cache = DNSCache()
+
+
+def resolve(host, port):
+    """Разрешает имя хоста в список адресов (family, sockaddr) через dns_cache."""
+    return dns_cache.resolve(host, port)
+
+
+def url_host_port(url):
+    """Возвращает пару (хост, порт) для URL с учетом порта схемы по умолчанию."""
+    parsed = urlparse(url)
+    return parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80)
+
+
+class TimedConnectionMixin:
+    """
+    Примесь к соединениям urllib3, замеряющая фазы установки соединения.
+
+    Разрешение имени выполняется отдельно от подключения, поэтому
+    время DNS и TCP-подключения известно по отдельности.
+    Результат сохраняется в phase_timings (миллисекунды) и переносится
+    в ответ адаптером (TimedHTTPAdapter.build_response).
+    """
+
+    phase_timings = None
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        try:
+            addresses = resolve(self._dns_host, self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        resolved = time.perf_counter()
+
+        sock = None
+        error = None
+        for family, sockaddr in addresses:
+            try:
+                sock = urllib3_connection.create_connection(
+                    sockaddr[:2],
+                    self.timeout,
+                    source_address=self.source_address,
+                    socket_options=self.socket_options,
+                )
+                break
+            except socket.timeout as e:
+                error = ConnectTimeoutError(
+                    self, f'Connection to {self.host} timed out. (connect timeout={self.timeout})'
+                )
+                error.__cause__ = e
+            except OSError as e:
+                error = NewConnectionError(self, f'Failed to establish a new connection: {e}')
+                error.__cause__ = e
+        if sock is None:
+            raise error or NewConnectionError(self, 'Failed to establish a new connection: no addresses')
+
+        self.phase_timings = {
+            'dns_time': (resolved - started) * 1000,
+            'connect_time': (time.perf_counter() - resolved) * 1000,
+        }
+        return sock
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    """HTTP-соединение с замером фаз DNS и подключения."""
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    """HTTPS-соединение с замером фаз DNS, подключения и TLS."""
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        elapsed = (time.perf_counter() - started) * 1000
+
+        timings = self.phase_timings
+        if timings is not None:
+            timings['tls_time'] = max(0.0, elapsed - timings['dns_time'] - timings['connect_time'])
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Адаптер requests, создающий соединения с замером фаз."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+    def build_response(self, req, resp):
+        """
+        Переносит замеры фаз соединения в ответ (response.phase_timings).
+
+        Замеры снимаются с соединения при каждом ответе, в том числе
+        промежуточных редиректов и запросов без probe_url, поэтому
+        переиспользованное соединение не вернет фазы чужого запроса.
+        """
+        response = super().build_response(req, resp)
+        connection = getattr(resp, 'connection', None)
+        response.phase_timings = getattr(connection, 'phase_timings', None) or {}
+        if connection is not None:
+            connection.phase_timings = None
+        return response
+
+
+def pop_phase_timings(response):
+    """
+    Возвращает замеры фаз соединения, через которое получен ответ.
+
+    Для переиспользованного keep-alive соединения фазы не выполнялись
+    и возвращается пустой словарь.
+    """
+    return getattr(response, 'phase_timings', None) or {}
+
+
+def build_session():
+    """
+    Создает сессию с пулом соединений по настройкам PORTALS_HTTP_*.
+
+    PORTALS_HTTP_POOL_HOSTS — сколько хостов держать в пуле,
+    PORTALS_HTTP_POOL_SIZE — сколько соединений хранить на один хост.
+    Cookie не сохраняются, чтобы проверки разных порталов
+    не влияли друг на друга.
+    """
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    adapter = TimedHTTPAdapter(
+        pool_connections=settings.PORTALS_HTTP_POOL_HOSTS,
+        pool_maxsize=settings.PORTALS_HTTP_POOL_SIZE,
+        max_retries=0,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """Возвращает общую сессию, создавая ее при первом обращении."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = build_session()
+        return _session
+
+
+def reset_session():
+    """
+    Закрывает общую сессию вместе с пулом соединений.
+
+    Следующий запрос создаст новую сессию. Монитор вызывает
+    эту функцию между циклами, чтобы не держать простаивающие
+    соединения к тысячам хостов.
+    """
+    global _session
+    with _lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+
+
+def get_timeout():
+    """Возвращает пару таймаутов (подключение, чтение) в секундах."""
+    return (settings.PORTALS_HTTP_CONNECT_TIMEOUT, settings.PORTALS_HTTP_READ_TIMEOUT)
+
+
+def request(method, url, **kwargs):
+    """
+    Выполняет HTTP-запрос через общую сессию.
+
+    Если таймаут не указан явно, используются раздельные
+    таймауты подключения и чтения из настроек.
+    """
+    kwargs.setdefault('timeout', get_timeout())
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    """Выполняет GET-запрос через общую сессию (см. request)."""
+    return request('GET', url, **kwargs)
@@ -0,0 +1,120 @@
+"""
+Модуль фоновых задач по порталам.
+Очередь задач хранится в таблице PortalJob; задачи ставятся
+из представлений и выполняются командой run_jobs вне веб-воркеров.
+"""
+
+# Работа с датами
+from datetime import timedelta
+
+# Текущее время
+from django.utils import timezone
+
+# Модели порталов и фоновых задач
+from .models import Portal, PortalJob
+
+# Сервисные функции, выполняемые задачами
+from .services import bump_grid_version, update_portal_favicon, check_portal_availability
+
+
+# Максимальное число попыток выполнения задачи
+MAX_ATTEMPTS = 3
+
+# Задачи в статусе running дольше этого срока считаются зависшими
+STALE_AFTER = timedelta(minutes=10)
+
+# Обработчики задач по типам
+HANDLERS = {
+    PortalJob.KIND_FAVICON: update_portal_favicon,
+    PortalJob.KIND_CHECK: check_portal_availability,
+}
+
+
+def enqueue(portal, *kinds):
+    """
+    Ставит задачи указанных типов в очередь для портала.
+
+    Если такая задача уже ожидает выполнения, повторно не создается.
+    """
+    pending = set(
+        PortalJob.objects.filter(
+            portal=portal, kind__in=kinds, status=PortalJob.STATUS_PENDING
+        ).values_list('kind', flat=True)
+    )
+    PortalJob.objects.bulk_create([
+        PortalJob(portal=portal, kind=kind) for kind in kinds if kind not in pending
+    ])
+
+
+def claim_jobs(limit):
+    """
+    Забирает до limit готовых к запуску задач, переводя их в running.
+
+    Перевод выполняется условным UPDATE по статусу, поэтому одну
+    задачу не заберут два обработчика одновременно.
+    """
+    candidates = list(
+        PortalJob.objects.filter(
+            status=PortalJob.STATUS_PENDING, run_after__lte=timezone.now()
+        ).values_list('id', flat=True)[:limit]
+    )
+
+    claimed = []
+    for job_id in candidates:
+        updated = PortalJob.objects.filter(id=job_id, status=PortalJob.STATUS_PENDING).update(
+            status=PortalJob.STATUS_RUNNING, updated_at=timezone.now()
+        )
+        if updated:
+            claimed.append(job_id)
+
+    return list(PortalJob.objects.filter(id__in=claimed).select_related('portal'))
+
+
+def run_job(job):
+    """
+    Выполняет задачу и обновляет ее состояние.
+
+    Успешная задача удаляется. При ошибке задача возвращается
+    в очередь с экспоненциальной задержкой, после MAX_ATTEMPTS
+    попыток помечается как failed. Если портал удален во время
+    выполнения (вместе с ним каскадно удалена и задача), задача
+    считается выполненной. Состояние записывается условным UPDATE
+    по id, поэтому отсутствие строки задачи не приводит к ошибке.
+    Возвращает True при успехе.
+    """
+    try:
+        HANDLERS[job.kind](job.portal)
+    except Exception as e:
+        if not Portal.objects.filter(id=job.portal_id).exists():
+            return True
+
+        job.attempts += 1
+        job.error = str(e)
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = PortalJob.STATUS_FAILED
+        else:
+            job.status = PortalJob.STATUS_PENDING
+            job.run_after = timezone.now() + timedelta(seconds=30 * 2 ** job.attempts)
+        PortalJob.objects.filter(id=job.id).update(
+            attempts=job.attempts, error=job.error, status=job.status,
+            run_after=job.run_after, updated_at=timezone.now(),
+        )
+        return False
+
+    # Новый favicon виден в сетке порталов - сбрасываем ее кэш
+    if job.kind == PortalJob.KIND_FAVICON:
+        bump_grid_version(job.portal.user_id)
+
+    PortalJob.objects.filter(id=job.id).delete()
+    return True
+
+
+def requeue_stale_jobs():
+    """
+    Возвращает в очередь задачи, зависшие в running
+    (например, после аварийной остановки обработчика).
+    """
+    return PortalJob.objects.filter(
+        status=PortalJob.STATUS_RUNNING,
+        updated_at__lt=timezone.now() - STALE_AFTER,
+    ).update(status=PortalJob.STATUS_PENDING, updated_at=timezone.now())
@@ -0,0 +1,279 @@
+"""
+Django management command для замера пропускной способности монитора
+Запускает локальные серверы-заглушки (portals/stub_servers.py),
+создает тысячи порталов с адресами на них и выполняет цикл проверок
+так же, как monitor_portals, без обращения к внешним сайтам:
+python manage.py benchmark_monitor --portals 5000 --servers 16 --latency-ms 80 --error-rate 0.02
+
+Выводит проверок в секунду, время цикла, время CPU и память процесса.
+Серверы работают в отдельном процессе и в замеры CPU и памяти не входят.
+Созданные порталы и их история удаляются после замера.
+"""
+
+import json
+import platform
+import random
+import statistics
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from portals import http_client
+from portals.models import Portal
+from portals.monitor import run_checks, DEFAULT_CONCURRENCY, DEFAULT_PER_HOST
+from portals.services import CheckResultWriter
+from portals.stub_servers import FarmProcess, StubBehaviour, portal_path
+
+
+# Пользователь, которому принадлежат порталы бенчмарка
+BENCH_USERNAME = 'benchmark_monitor'
+
+
+def current_rss_kb():
+    """Текущий RSS процесса в КБ (Linux, иначе None)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize() // 1024 if resource else None
+
+
+def cpu_seconds():
+    """Время CPU процесса (user, system) в секундах."""
+    if resource is None:
+        return time.process_time(), 0.0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime, usage.ru_stime
+
+
+class Command(BaseCommand):
+    help = 'Замеряет пропускную способность цикла проверок на локальных серверах-заглушках'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--portals', type=int, default=2000,
+                            help='Количество порталов (по умолчанию 2000)')
+        parser.add_argument('--servers', type=int, default=8,
+                            help='Количество серверов-заглушек (хостов) (по умолчанию 8)')
+        parser.add_argument('--cycles', type=int, default=1,
+                            help='Количество циклов проверки (по умолчанию 1)')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                            help=f'Количество одновременных проверок (по умолчанию {DEFAULT_CONCURRENCY})')
+        parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                            help=f'Максимум одновременных запросов к одному хосту (по умолчанию {DEFAULT_PER_HOST})')
+        parser.add_argument('--latency-ms', type=float, default=50,
+                            help='Медиана задержки ответа, мс (по умолчанию 50)')
+        parser.add_argument('--latency-sigma', type=float, default=0.5,
+                            help='Разброс задержки (sigma логнормального распределения, 0 - постоянная)')
+        parser.add_argument('--error-rate', type=float, default=0.01,
+                            help='Доля ответов 5xx (по умолчанию 0.01)')
+        parser.add_argument('--reset-rate', type=float, default=0.0,
+                            help='Доля соединений, закрытых без ответа (по умолчанию 0)')
+        parser.add_argument('--timeout-rate', type=float, default=0.0,
+                            help='Доля запросов, ответ на которые не приходит до таймаута (по умолчанию 0)')
+        parser.add_argument('--read-timeout', type=float, default=1,
+                            help='Таймаут чтения клиента на время замера, сек (по умолчанию 1)')
+        parser.add_argument('--redirect-rate', type=float, default=0.1,
+                            help='Доля порталов с цепочкой редиректов (по умолчанию 0.1)')
+        parser.add_argument('--redirect-hops', type=int, default=2,
+                            help='Максимальная длина цепочки редиректов (по умолчанию 2)')
+        parser.add_argument('--body-bytes', type=int, default=2048,
+                            help='Размер тела ответа, байт (по умолчанию 2048)')
+        parser.add_argument('--probe-max-bytes', type=int,
+                            help='Сколько байт тела читать (по умолчанию PORTALS_PROBE_MAX_BYTES)')
+        parser.add_argument('--no-db', action='store_true',
+                            help='Не записывать результаты в БД (замер только сетевой части)')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Начальное значение генератора случайных чисел (по умолчанию 1)')
+        parser.add_argument('--output', help='Путь к JSON-отчету')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username=BENCH_USERNAME).exists():
+            raise CommandError(
+                f'Пользователь {BENCH_USERNAME} уже существует - удалите его '
+                f'(вместе с порталами) или проверьте, не запущен ли другой замер'
+            )
+
+        behaviour = StubBehaviour(
+            latency_ms=options['latency_ms'],
+            latency_sigma=options['latency_sigma'],
+            error_rate=options['error_rate'],
+            reset_rate=options['reset_rate'],
+            timeout_rate=options['timeout_rate'],
+            hang_seconds=options['read_timeout'] + 1,
+            body_bytes=options['body_bytes'],
+            seed=options['seed'],
+        )
+        overrides = {'PORTALS_HTTP_READ_TIMEOUT': options['read_timeout']}
+        if options['probe_max_bytes'] is not None:
+            overrides['PORTALS_PROBE_MAX_BYTES'] = options['probe_max_bytes']
+
+        farm = FarmProcess(options['servers'], behaviour)
+        user = None
+        try:
+            started = time.monotonic()
+            if options['no_db']:
+                portals = self.build_portals(farm.urls, options)
+            else:
+                user = User.objects.create(username=BENCH_USERNAME)
+                portals = self.create_portals(user, farm.urls, options)
+            self.stdout.write(
+                f'Порталов: {len(portals)} на {len(farm.urls)} серверах '
+                f'(подготовка {time.monotonic() - started:.1f} с)'
+            )
+
+            cycles = []
+            with override_settings(**overrides):
+                for number in range(1, options['cycles'] + 1):
+                    cycle = self.run_cycle(portals, options, write=not options['no_db'])
+                    cycles.append(cycle)
+                    self.stdout.write(
+                        f"Цикл {number}: {cycle['wall_seconds']:.2f} с, "
+                        f"{cycle['checks_per_second']:.0f} проверок/с, "
+                        f"CPU {cycle['cpu_user_seconds'] + cycle['cpu_system_seconds']:.2f} с, "
+                        f"доступно {cycle['available']}, недоступно {cycle['unavailable']}"
+                    )
+        finally:
+            server_stats = farm.stop()
+            if user is not None:
+                # Вместе с пользователем удаляются порталы, проверки и агрегаты
+                user.delete()
+
+        self.print_summary(cycles, server_stats)
+        if options['output']:
+            report = {
+                'meta': self.meta(options, behaviour),
+                'cycles': cycles,
+                'servers': server_stats,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Отчет записан в {options['output']}"))
+
+    def portal_urls(self, urls, options):
+        """
+        Генерирует адреса порталов, равномерно распределенные по серверам.
+
+        Пути уникальны, поэтому объединение одинаковых адресов
+        (monitor.group_by_url) не сокращает число проверок.
+        """
+        rng = random.Random(options['seed'])
+        for index in range(options['portals']):
+            redirects = 0
+            if options['redirect_hops'] > 0 and rng.random() < options['redirect_rate']:
+                redirects = rng.randint(1, options['redirect_hops'])
+            yield index, urls[index % len(urls)] + portal_path(index, redirects)
+
+    def build_portals(self, urls, options):
+        """Порталы в памяти, без записи в БД (режим --no-db)."""
+        return [
+            Portal(id=index + 1, title=f'bench {index}', url=url)
+            for index, url in self.portal_urls(urls, options)
+        ]
+
+    def create_portals(self, user, urls, options):
+        """Создает порталы пользователя бенчмарка одним bulk_create."""
+        portals = [
+            Portal(user=user, title=f'bench {index}', url=url, position=index * Portal.POSITION_STEP)
+            for index, url in self.portal_urls(urls, options)
+        ]
+        Portal.objects.bulk_create(portals, batch_size=1000)
+        return list(Portal.objects.filter(user=user).order_by('id'))
+
+    def run_cycle(self, portals, options, write):
+        """
+        Выполняет один цикл проверок как monitor_portals (без вывода
+        по каждому порталу) и возвращает метрики цикла.
+        """
+        http_client.reset_session()
+        http_client.dns_cache.reset_stats()
+
+        cpu_before = cpu_seconds()
+        started = time.perf_counter()
+        available = unavailable = 0
+        statuses = {}
+        total_times = []
+
+        writer = CheckResultWriter() if write else None
+        checks = run_checks(portals, concurrency=options['concurrency'], per_host=options['per_host'])
+        for portal, result in checks:
+            if writer is not None:
+                writer.add(portal, result)
+            if result['is_available']:
+                available += 1
+            else:
+                unavailable += 1
+            key = str(result.get('status_code') or 'error')
+            statuses[key] = statuses.get(key, 0) + 1
+            if result.get('total_time') is not None:
+                total_times.append(result['total_time'])
+
+        if writer is not None:
+            writer.flush()
+        http_client.reset_session()
+
+        wall = time.perf_counter() - started
+        cpu_after = cpu_seconds()
+        total_times.sort()
+        count = available + unavailable
+        return {
+            'checks': count,
+            'available': available,
+            'unavailable': unavailable,
+            'statuses': statuses,
+            'wall_seconds': round(wall, 3),
+            'checks_per_second': round(count / wall, 1) if wall else None,
+            'cpu_user_seconds': round(cpu_after[0] - cpu_before[0], 3),
+            'cpu_system_seconds': round(cpu_after[1] - cpu_before[1], 3),
+            'check_p50_ms': round(statistics.median(total_times), 1) if total_times else None,
+            'check_max_ms': round(total_times[-1], 1) if total_times else None,
+            'rss_kb': current_rss_kb(),
+            # ru_maxrss в Linux - в КБ
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        }
+
+    def print_summary(self, cycles, server_stats):
+        """Выводит итог по всем циклам."""
+        if not cycles:
+            return
+        rates = [cycle['checks_per_second'] for cycle in cycles]
+        cpu = sum(cycle['cpu_user_seconds'] + cycle['cpu_system_seconds'] for cycle in cycles)
+        checks = sum(cycle['checks'] for cycle in cycles)
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS('Итог:'))
+        self.stdout.write(f'  Проверок/с (медиана по циклам): {statistics.median(rates):.0f}')
+        self.stdout.write(f"  Время цикла (медиана): {statistics.median(c['wall_seconds'] for c in cycles):.2f} с")
+        self.stdout.write(f'  CPU на проверку: {cpu / checks * 1000:.2f} мс' if checks else '  CPU на проверку: -')
+        if cycles[-1]['max_rss_kb']:
+            self.stdout.write(
+                f"  Память (RSS): {(cycles[-1]['rss_kb'] or 0) / 1024:.1f} МБ, "
+                f"пик {cycles[-1]['max_rss_kb'] / 1024:.1f} МБ"
+            )
+        if server_stats.get('requests') is not None:
+            self.stdout.write(f"  Запросов к серверам: {server_stats['requests']}")
+
+    def meta(self, options, behaviour):
+        """Параметры замера и окружения для сравнения отчетов."""
+        return {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'portals': options['portals'],
+            'servers': options['servers'],
+            'concurrency': options['concurrency'],
+            'per_host': options['per_host'],
+            'read_timeout': options['read_timeout'],
+            'redirect_rate': options['redirect_rate'],
+            'redirect_hops': options['redirect_hops'],
+            'write': not options['no_db'],
+            'behaviour': behaviour.as_dict(),
+        }
@@ -0,0 +1,277 @@
+"""
+Django management command для замера производительности
+Замеряет сервисные функции статистики, представления дашборда
+и списки админки на данных из seed_availability:
+python manage.py benchmark_portals --iterations 20 --output report.json
+
+Для каждого сценария выводятся перцентили времени выполнения,
+число SQL-запросов и пиковое выделение памяти (tracemalloc).
+Отчет в JSON удобно сравнивать между версиями.
+Служебный суперпользователь для замеров админки удаляется после замера,
+если не указан существующий (--admin-username).
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from portals.models import Portal, PortalAvailability
+from portals.services import get_availability_stats, get_availability_summary
+
+
+# Служебный суперпользователь для замеров админки
+BENCH_ADMIN_USERNAME = 'bench_admin'
+
+
+def percentile(values, point):
+    """Возвращает перцентиль point (0..100) упорядоченного списка."""
+    if not values:
+        return None
+    index = (len(values) - 1) * point / 100
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время, число запросов и память основных представлений и сервисов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='Количество замеров каждого сценария (по умолчанию 20)',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=2,
+            help='Количество прогревочных запусков без замера (по умолчанию 2)',
+        )
+        parser.add_argument(
+            '--username',
+            help='Пользователь, от имени которого выполняются замеры '
+                 '(по умолчанию владелец наибольшего числа порталов)',
+        )
+        parser.add_argument(
+            '--admin-username',
+            help='Суперпользователь для замеров админки '
+                 '(по умолчанию создается служебный и удаляется после замера)',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            nargs='+',
+            default=[7, 30],
+            help='Периоды статистики в днях (по умолчанию 7 30)',
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            help='Запустить только сценарии, имя которых начинается с указанных',
+        )
+        parser.add_argument(
+            '--output',
+            help='Путь к JSON-отчету',
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['username'])
+        portal = Portal.objects.filter(user=user).order_by('id').first()
+        if portal is None:
+            raise CommandError(f'У пользователя {user.username} нет порталов, запустите seed_availability')
+
+        admin, created = self.get_admin(options['admin_username'])
+        try:
+            results = self.run_scenarios(user, portal, admin, options)
+        finally:
+            if created:
+                # Вместе с пользователем удаляются его сессии и записи журнала админки
+                admin.delete()
+
+        report = {'meta': self.meta(user, portal, options), 'results': results}
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Отчет записан в {options['output']}"))
+
+    def get_user(self, username):
+        """Возвращает пользователя для замеров."""
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {username} не найден')
+
+        from django.db.models import Count
+        user = User.objects.annotate(portals_count=Count('portals')).order_by('-portals_count').first()
+        if user is None:
+            raise CommandError('В БД нет пользователей, запустите seed_availability')
+        return user
+
+    def get_admin(self, username):
+        """
+        Возвращает (суперпользователь для замеров админки, создан ли он).
+
+        Без username создается служебный пользователь BENCH_ADMIN_USERNAME
+        с неиспользуемым паролем, который удаляется после замера.
+        """
+        if username:
+            try:
+                return User.objects.get(username=username, is_superuser=True), False
+            except User.DoesNotExist:
+                raise CommandError(f'Суперпользователь {username} не найден')
+
+        if User.objects.filter(username=BENCH_ADMIN_USERNAME).exists():
+            raise CommandError(
+                f'Пользователь {BENCH_ADMIN_USERNAME} уже существует - удалите его, '
+                f'укажите --admin-username или проверьте, не запущен ли другой замер'
+            )
+        admin = User(username=BENCH_ADMIN_USERNAME, is_staff=True, is_superuser=True)
+        admin.set_unusable_password()
+        admin.save()
+        return admin, True
+
+    def run_scenarios(self, user, portal, admin, options):
+        """Выполняет сценарии, выводит таблицу и возвращает метрики по сценариям."""
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        admin_client = Client(HTTP_HOST='localhost')
+        admin_client.force_login(admin)
+
+        scenarios = self.build_scenarios(user, portal, client, admin_client, options['days'])
+        if options['only']:
+            scenarios = [s for s in scenarios if s[0].startswith(tuple(options['only']))]
+
+        self.stdout.write(
+            f'Пользователь {user.username}, портал {portal.id}, '
+            f'проверок в БД: {PortalAvailability.objects.count()}'
+        )
+        self.stdout.write(f"{'сценарий':<40} {'p50':>9} {'p90':>9} {'p99':>9} {'запросов':>9} {'память':>10}")
+
+        results = {}
+        for name, func, cold in scenarios:
+            result = self.measure(func, options['iterations'], options['warmup'], cold)
+            results[name] = result
+            self.stdout.write(
+                f"{name:<40} {result['p50_ms']:>7.1f}ms {result['p90_ms']:>7.1f}ms "
+                f"{result['p99_ms']:>7.1f}ms {result['queries']:>9} {result['peak_memory_kb']:>8.0f}KB"
+            )
+        return results
+
+    def build_scenarios(self, user, portal, client, admin_client, periods):
+        """
+        Возвращает список сценариев (имя, функция, холодный кэш).
+
+        Для сценариев с холодным кэшем перед каждым запуском
+        очищается кэш Django, чтобы замерить полный расчет.
+        """
+        def get(test_client, url, params=None):
+            def run():
+                response = test_client.get(url, params or {})
+                if response.status_code != 200:
+                    raise CommandError(f'{url}: HTTP {response.status_code}')
+                return response
+            return run
+
+        availability_url = reverse('portals:portal_availability', args=[portal.id])
+        scenarios = []
+        for days in periods:
+            scenarios += [
+                (f'service:get_availability_stats:{days}d',
+                 lambda days=days: get_availability_stats(portal, days=days), False),
+                (f'view:portal_availability:{days}d',
+                 get(client, availability_url, {'days': days}), True),
+            ]
+        scenarios += [
+            ('service:get_availability_summary',
+             lambda: get_availability_summary(user), False),
+            ('view:portal_availability_batch',
+             get(client, reverse('portals:portal_availability_batch')), False),
+            ('view:dashboard:cold', get(client, reverse('portals:dashboard')), True),
+            ('view:dashboard:cached', get(client, reverse('portals:dashboard')), False),
+            ('admin:portal_changelist',
+             get(admin_client, reverse('admin:portals_portal_changelist')), False),
+            ('admin:portalavailability_changelist',
+             get(admin_client, reverse('admin:portals_portalavailability_changelist')), False),
+        ]
+        return scenarios
+
+    def measure(self, func, iterations, warmup, cold):
+        """
+        Выполняет сценарий и возвращает метрики.
+
+        Время замеряется без tracemalloc, который замедляет выполнение;
+        число запросов и пиковая память - отдельным последним запуском.
+        """
+        for _ in range(warmup):
+            if cold:
+                cache.clear()
+            func()
+
+        timings = []
+        for _ in range(iterations):
+            if cold:
+                cache.clear()
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        if cold:
+            cache.clear()
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as context:
+                func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'iterations': iterations,
+            'min_ms': round(timings[0], 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p90_ms': round(percentile(timings, 90), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'max_ms': round(timings[-1], 3),
+            'queries': len(context.captured_queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def meta(self, user, portal, options):
+        """Сведения об окружении и объеме данных для сравнения отчетов."""
+        try:
+            revision = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            revision = None
+
+        return {
+            'created_at': timezone.now().isoformat(),
+            'revision': revision,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'users': User.objects.count(),
+            'portals': Portal.objects.count(),
+            'checks': PortalAvailability.objects.count(),
+            'user': user.username,
+            'portal_id': portal.id,
+            'iterations': options['iterations'],
+        }
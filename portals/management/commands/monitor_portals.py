@@ -2,12 +2,32 @@
 Django management command для мониторинга доступности порталов
 Запускать через cron каждые 5-15 минут:
 */5 * * * * cd /path/to/project && ./venv/bin/python manage.py monitor_portals
+
+Или как постоянно работающий процесс (например, программа supervisord):
+python manage.py monitor_portals --daemon
+
+Порталы проверяются параллельно (см. portals/monitor.py),
+поэтому длительность цикла определяется самыми медленными хостами,
+а не общим количеством порталов. Порталы с одинаковым адресом
+проверяются одним запросом.
 """
 
+import signal
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
 from django.utils import timezone
+from portals import http_client
 from portals.models import Portal
-from portals.services import check_portal_availability
+from portals.monitor import (
+    run_checks, group_by_url, normalize_url, CheckEngine, CheckScheduler,
+    DEFAULT_CONCURRENCY, DEFAULT_PER_HOST,
+)
+from portals.retention import prune_history, incremental_vacuum, incremental_vacuum_enabled
+from portals.services import CheckResultWriter
 
 
 class Command(BaseCommand):
@@ -19,42 +39,326 @@ class Command(BaseCommand):
             type=int,
             help='ID пользователя для проверки только его порталов',
         )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help=f'Количество одновременных проверок (по умолчанию {DEFAULT_CONCURRENCY})',
+        )
+        parser.add_argument(
+            '--per-host',
+            type=int,
+            default=DEFAULT_PER_HOST,
+            help=f'Максимум одновременных запросов к одному хосту (по умолчанию {DEFAULT_PER_HOST})',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Размер пачки результатов для записи в БД (по умолчанию PORTALS_WRITE_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--flush-interval',
+            type=float,
+            help='Максимальная задержка записи результатов, сек (по умолчанию PORTALS_WRITE_FLUSH_INTERVAL)',
+        )
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            help='Работать постоянно, проверяя каждый портал по его интервалу check_interval',
+        )
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=0.1,
+            help='Случайный разброс интервала в режиме демона, доля интервала (по умолчанию 0.1)',
+        )
+        parser.add_argument(
+            '--refresh-interval',
+            type=float,
+            default=60,
+            help='Как часто перечитывать список порталов в режиме демона, сек (по умолчанию 60)',
+        )
+        parser.add_argument(
+            '--prune-interval',
+            type=float,
+            default=600,
+            help='Как часто удалять устаревшую историю в режиме демона, сек (0 - не удалять)',
+        )
+        parser.add_argument(
+            '--prune-budget',
+            type=float,
+            default=5,
+            help='Максимальное время одной очистки истории в режиме демона, сек (по умолчанию 5)',
+        )
+        parser.add_argument(
+            '--dns-prefetch',
+            action='store_true',
+            help='Заранее разрешать имена всех хостов в начале цикла',
+        )
 
-    def handle(self, *args, **options):
-        user_id = options.get('user_id')
-        
-        # Получаем порталы для проверки
+    def get_portals(self, options):
+        """Возвращает queryset порталов для проверки с учетом --user-id."""
         portals = Portal.objects.all()
-        if user_id:
-            portals = portals.filter(user_id=user_id)
-        
-        total = portals.count()
-        self.stdout.write(f'Начинаю проверку {total} порталов...')
-        
+        if options.get('user_id'):
+            portals = portals.filter(user_id=options['user_id'])
+        return portals
+
+    def report(self, portal, result):
+        """Выводит результат проверки, возвращает True если портал доступен."""
+        if result['is_available']:
+            status = (
+                f"✓ {portal.title}: ДОСТУПЕН "
+                f"(TTFB {result['ttfb']:.0f}ms, всего {result['total_time']:.0f}ms)"
+            )
+            self.stdout.write(self.style.SUCCESS(status))
+            return True
+
+        status = f"✗ {portal.title}: НЕДОСТУПЕН"
+        self.stdout.write(self.style.WARNING(status))
+        return False
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['daemon']:
+            self.run_daemon(options)
+        else:
+            self.run_once(options)
+
+    def run_once(self, options):
+        """Однократная проверка всех порталов (режим запуска из cron)."""
+        portals = list(self.get_portals(options))
+        total = len(portals)
+        unique = len(group_by_url(portals))
+        self.stdout.write(f'Начинаю проверку {total} порталов ({unique} уникальных адресов)...')
+
         success_count = 0
         fail_count = 0
-        
-        for portal in portals:
+        body_bytes = 0
+        started = time.monotonic()
+
+        # Каждый цикл начинается с нового пула соединений
+        http_client.reset_session()
+        http_client.dns_cache.reset_stats()
+        if options['dns_prefetch']:
+            count, elapsed = self.prefetch_dns(portals, options['concurrency'])
+            self.stdout.write(f'Разрешено имен хостов: {count} за {elapsed:.1f} с')
+
+        writer = CheckResultWriter(
+            batch_size=options['batch_size'],
+            flush_interval=options['flush_interval'],
+        )
+        checks = run_checks(
+            portals,
+            concurrency=options['concurrency'],
+            per_host=options['per_host'],
+        )
+        for portal, result in checks:
             try:
-                result = check_portal_availability(portal)
-                
-                if result['is_available']:
-                    status = f"✓ {portal.title}: ДОСТУПЕН ({result.get('response_time', 'N/A')}ms)"
-                    self.stdout.write(self.style.SUCCESS(status))
+                writer.add(portal, result, flush=False)
+                body_bytes += result.get('body_bytes', 0)
+
+                if self.report(portal, result):
                     success_count += 1
                 else:
-                    status = f"✗ {portal.title}: НЕДОСТУПЕН"
-                    self.stdout.write(self.style.WARNING(status))
                     fail_count += 1
-                    
+
             except Exception as e:
                 self.stdout.write(
                     self.style.ERROR(f'Ошибка при проверке {portal.title}: {str(e)}')
                 )
                 fail_count += 1
-        
+
+            self.flush(writer, force=False)
+
+        # Записываем оставшиеся результаты и закрываем соединения цикла
+        self.flush(writer)
+        http_client.reset_session()
+
         self.stdout.write('')
         self.stdout.write(self.style.SUCCESS(f'Проверка завершена:'))
         self.stdout.write(f'  Доступно: {success_count}')
         self.stdout.write(f'  Недоступно: {fail_count}')
         self.stdout.write(f'  Всего: {total}')
+        self.stdout.write(f'  Время цикла: {time.monotonic() - started:.1f} с')
+        self.stdout.write(f'  Прочитано тел ответов: {body_bytes / 1024:.1f} КБ')
+        self.stdout.write(f'  {self.format_dns_stats()}')
+        if hasattr(connection, 'lock_stats'):
+            stats = connection.lock_stats()
+            self.stdout.write(
+                f"  Блокировки БД: {stats['lock_errors']}, повторов {stats['retries']} "
+                f"({stats['retry_wait']:.1f} с), неудачных {stats['failures']}"
+            )
+
+    def prefetch_dns(self, portals, concurrency):
+        """
+        Разрешает имена всех уникальных хостов до начала проверок.
+        Возвращает количество хостов и затраченное время в секундах.
+        """
+        started = time.monotonic()
+        hosts = {http_client.url_host_port(portal.url) for portal in portals}
+        hosts.discard((None, 80))
+        hosts.discard((None, 443))
+        http_client.dns_cache.prefetch(hosts, concurrency=concurrency)
+        return len(hosts), time.monotonic() - started
+
+    def format_dns_stats(self):
+        """Возвращает строку со статистикой кэша DNS."""
+        stats = http_client.dns_cache.stats()
+        if stats['hit_rate'] is None:
+            return 'DNS: запросов не было'
+        line = (
+            f"DNS: попаданий в кэш {stats['hits']} из {stats['hits'] + stats['misses']} "
+            f"({stats['hit_rate'] * 100:.0f}%)"
+        )
+        if stats['avg_lookup_ms'] is not None:
+            line += f", среднее время разрешения {stats['avg_lookup_ms']:.1f} мс"
+        if stats['stale']:
+            line += f", устаревших ответов {stats['stale']}"
+        return line
+
+    def run_daemon(self, options):
+        """
+        Постоянная работа по расписанию.
+
+        Каждый портал проверяется со своим интервалом check_interval,
+        список порталов периодически перечитывается из БД.
+        По SIGTERM/SIGINT новые проверки перестают запускаться,
+        выполняемые дожидаются завершения, результаты записываются в БД.
+        """
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            self.stdout.write(f'Получен сигнал {signum}, завершаю работу...')
+            stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        scheduler = CheckScheduler(jitter=options['jitter'])
+        writer = CheckResultWriter(
+            batch_size=options['batch_size'],
+            flush_interval=options['flush_interval'],
+        )
+        in_flight = {}
+        by_url = {}
+        last_refresh = None
+        last_prune = time.monotonic()
+
+        self.stdout.write(self.style.SUCCESS(f'Демон мониторинга запущен ({timezone.now():%Y-%m-%d %H:%M:%S})'))
+        if options['prune_interval'] and incremental_vacuum_enabled() is False:
+            self.stdout.write(self.style.WARNING(
+                'Режим auto_vacuum=INCREMENTAL не включен: место после очистки истории '
+                'не возвращается. Один раз выполните prune_history --enable-incremental-vacuum '
+                '(полный VACUUM, блокирует БД на время перестройки файла)'
+            ))
+
+        with CheckEngine(options['concurrency'], options['per_host']) as engine:
+            while not stop.is_set():
+                # Периодически перечитываем список порталов
+                if last_refresh is None or time.monotonic() - last_refresh >= options['refresh_interval']:
+                    close_old_connections()
+                    http_client.reset_session()
+                    if self.verbosity >= 2 and last_refresh is not None:
+                        self.stdout.write(self.format_dns_stats())
+                    http_client.dns_cache.reset_stats()
+                    portals = list(self.get_portals(options))
+                    scheduler.sync(portals)
+                    if options['dns_prefetch']:
+                        self.prefetch_dns(portals, options['concurrency'])
+                    last_refresh = time.monotonic()
+
+                # Запускаем проверки, время которых наступило; портал с тем же
+                # адресом, что и выполняемая проверка, получит ее результат
+                busy = {portal.id for group in in_flight.values() for portal in group}
+                for portal in scheduler.pop_due():
+                    if portal.id in busy:
+                        continue
+                    url = normalize_url(portal.url)
+                    future = by_url.get(url)
+                    if future is None or future.done():
+                        future = engine.submit(portal)
+                        by_url[url] = future
+                        in_flight[future] = []
+                    in_flight[future].append(portal)
+                    busy.add(portal.id)
+
+                # Ждем завершения проверок или наступления следующей
+                timeout = scheduler.seconds_until_next()
+                timeout = 1.0 if timeout is None else min(timeout, 1.0)
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = ()
+                    stop.wait(timeout)
+
+                self.collect(done, in_flight, writer, by_url)
+                self.flush(writer, force=False)
+
+                # Понемногу удаляем устаревшую историю (ограничено по времени)
+                if options['prune_interval'] and time.monotonic() - last_prune >= options['prune_interval']:
+                    self.prune(options['prune_budget'])
+                    last_prune = time.monotonic()
+
+            # Дожидаемся уже запущенных проверок
+            done, _ = wait(in_flight)
+            self.collect(done, in_flight, writer, by_url)
+
+        if not self.flush(writer) and writer.pending:
+            self.stdout.write(self.style.ERROR(f'Не записано проверок: {len(writer.pending)}'))
+        self.stdout.write(self.style.SUCCESS(f'Демон остановлен, записано проверок: {writer.written}'))
+
+    def flush(self, writer, force=True):
+        """
+        Записывает накопленные результаты (при force=False - только
+        если набралась пачка или истекло окно записи).
+
+        Ошибка записи не останавливает монитор: пачка остается
+        в очереди writer и записывается при следующем сбросе.
+        Возвращает False, если запись не удалась.
+        """
+        try:
+            if force:
+                writer.flush()
+            else:
+                writer.flush_if_due()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(
+                f'Ошибка при записи результатов: {str(e)} (в очереди {len(writer.pending)})'
+            ))
+            return False
+        return True
+
+    def prune(self, budget):
+        """Удаляет порцию устаревшей истории и возвращает место в SQLite."""
+        try:
+            deleted = prune_history(time_budget=budget)
+            incremental_vacuum()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Ошибка при очистке истории: {str(e)}'))
+            return
+
+        if any(deleted.values()):
+            summary = ', '.join(f'{name}: {count}' for name, count in deleted.items())
+            self.stdout.write(f'Очистка истории: {summary}')
+
+    def collect(self, done, in_flight, writer, by_url):
+        """
+        Передает завершенные проверки в writer для всех порталов
+        с этим адресом и убирает их из in_flight.
+        """
+        for future in done:
+            portals = in_flight.pop(future)
+            url = normalize_url(portals[0].url)
+            if by_url.get(url) is future:
+                del by_url[url]
+            for portal in portals:
+                try:
+                    result = future.result()
+                    writer.add(portal, result, flush=False)
+                    # В режиме демона построчный вывод только при -v 2
+                    if self.verbosity >= 2:
+                        self.report(portal, result)
+                except Exception as e:
+                    self.stdout.write(
+                        self.style.ERROR(f'Ошибка при проверке {portal.title}: {str(e)}')
+                    )
@@ -0,0 +1,78 @@
+"""
+Django management command для очистки истории проверок
+Удаляет проверки и агрегаты старше сроков хранения порциями
+и возвращает освободившееся место в SQLite, удаляет общие файлы
+favicon, на которые больше никто не ссылается:
+python manage.py prune_history [--raw-days 30] [--enable-incremental-vacuum]
+"""
+
+from django.core.management.base import BaseCommand
+from portals.retention import prune_history, incremental_vacuum, enable_incremental_vacuum
+from portals.services import prune_shared_favicons
+
+
+class Command(BaseCommand):
+    help = 'Удаляет устаревшую историю проверок и агрегатов порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--raw-days',
+            type=int,
+            help='Срок хранения сырых проверок в днях (по умолчанию PORTALS_RAW_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--hourly-days',
+            type=int,
+            help='Срок хранения почасовых агрегатов (по умолчанию PORTALS_HOURLY_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--daily-days',
+            type=int,
+            help='Срок хранения суточных агрегатов (по умолчанию PORTALS_DAILY_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Количество строк, удаляемых одной транзакцией (по умолчанию PORTALS_PRUNE_CHUNK_SIZE)',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            help='Пауза между порциями в секундах (по умолчанию PORTALS_PRUNE_CHUNK_PAUSE)',
+        )
+        parser.add_argument(
+            '--vacuum-pages',
+            type=int,
+            help='Сколько свободных страниц вернуть через incremental_vacuum (по умолчанию PORTALS_VACUUM_PAGES)',
+        )
+        parser.add_argument(
+            '--enable-incremental-vacuum',
+            action='store_true',
+            help='Однократно перевести SQLite в режим auto_vacuum=INCREMENTAL (выполняет полный VACUUM)',
+        )
+
+    def handle(self, *args, **options):
+        if options['enable_incremental_vacuum']:
+            if enable_incremental_vacuum():
+                self.stdout.write(self.style.SUCCESS('Режим auto_vacuum=INCREMENTAL включен'))
+            else:
+                self.stdout.write('Режим auto_vacuum=INCREMENTAL уже включен или БД не SQLite')
+
+        deleted = prune_history(
+            raw_days=options['raw_days'],
+            hourly_days=options['hourly_days'],
+            daily_days=options['daily_days'],
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+        )
+        for model_name, count in deleted.items():
+            self.stdout.write(f'  {model_name}: удалено {count}')
+
+        favicons = prune_shared_favicons()
+        self.stdout.write(f'  Общих файлов favicon удалено: {favicons}')
+
+        free_pages = incremental_vacuum(options['vacuum_pages'])
+        if free_pages is not None:
+            self.stdout.write(f'  Свободных страниц после incremental_vacuum: {free_pages}')
+
+        self.stdout.write(self.style.SUCCESS('Очистка истории завершена'))
@@ -0,0 +1,33 @@
+"""
+Django management command для пересчета агрегатов доступности
+Пересчитывает почасовую и суточную статистику по сырым проверкам:
+python manage.py rebuild_rollups [--portal-id ID]
+"""
+
+from django.core.management.base import BaseCommand
+from portals.models import Portal
+from portals.rollups import rebuild_portal_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает почасовые и суточные агрегаты проверок доступности'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--portal-id',
+            type=int,
+            help='ID портала для пересчета только его агрегатов',
+        )
+
+    def handle(self, *args, **options):
+        portal_ids = Portal.objects.order_by('id').values_list('id', flat=True)
+        if options.get('portal_id'):
+            portal_ids = portal_ids.filter(id=options['portal_id'])
+
+        total = 0
+        for portal_id in portal_ids:
+            created = rebuild_portal_rollups(portal_id)
+            total += created
+            self.stdout.write(f'  Портал {portal_id}: агрегатов {created}')
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчет завершен, создано агрегатов: {total}'))
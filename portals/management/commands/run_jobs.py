@@ -0,0 +1,97 @@
+"""
+Django management command для обработки фоновых задач порталов
+Загружает favicon и выполняет первые проверки вне веб-воркеров.
+Запускается как отдельный постоянный процесс (программа supervisord):
+python manage.py run_jobs
+"""
+
+import signal
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from portals.jobs import claim_jobs, run_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь фоновых задач (favicon, первая проверка)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Количество задач, выполняемых одновременно (по умолчанию 4)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Пауза между опросами пустой очереди, сек (по умолчанию 1)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать готовые задачи и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь зависших задач: {requeued}')
+
+        # Задачи отправляются в пул по одной: на место завершенной
+        # сразу забирается следующая, медленная загрузка favicon
+        # не задерживает остальные задачи
+        concurrency = max(1, options['concurrency'])
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while not stop.is_set():
+                close_old_connections()
+                if len(in_flight) < concurrency:
+                    for job in claim_jobs(concurrency - len(in_flight)):
+                        in_flight[executor.submit(self.process, job)] = job
+
+                if not in_flight:
+                    if options['once']:
+                        break
+                    stop.wait(options['poll_interval'])
+                    continue
+
+                done, _ = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                self.report(done, in_flight)
+
+            # Дожидаемся уже запущенных задач
+            done, _ = wait(in_flight)
+            self.report(done, in_flight)
+
+    def report(self, done, in_flight):
+        """Выводит результаты завершенных задач и убирает их из in_flight."""
+        for future in done:
+            job = in_flight.pop(future)
+            title = f'{job.portal.title}: {job.get_kind_display()}'
+            try:
+                success = future.result()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'✗ {title} ({str(e)})'))
+                continue
+            if success:
+                self.stdout.write(self.style.SUCCESS(f'✓ {title}'))
+            else:
+                self.stdout.write(self.style.WARNING(f'✗ {title} ({job.error})'))
+
+    def process(self, job):
+        """Выполняет задачу в рабочем потоке и закрывает его соединение с БД."""
+        try:
+            return run_job(job)
+        finally:
+            connection.close()
@@ -0,0 +1,174 @@
+"""
+Django management command для заполнения БД тестовой историей проверок
+Создает N пользователей × M порталов × K дней правдоподобной истории
+(базовое время ответа портала, редкие сбои сериями, фазы запроса)
+и пересчитывает агрегаты. Используется для бенчмарков (benchmark_portals):
+python manage.py seed_availability --users 10 --portals 50 --days 30
+
+Повторный запуск с --clear удаляет ранее созданных пользователей
+с тем же префиксом вместе с их порталами и историей.
+"""
+
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from portals.models import Portal, PortalAvailability
+from portals.rollups import rebuild_portal_rollups
+
+
+class Command(BaseCommand):
+    help = 'Создает пользователей, порталы и историю проверок для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=10,
+            help='Количество пользователей (по умолчанию 10)',
+        )
+        parser.add_argument(
+            '--portals',
+            type=int,
+            default=20,
+            help='Количество порталов у каждого пользователя (по умолчанию 20)',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Глубина истории в днях (по умолчанию 7)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=300,
+            help='Интервал между проверками портала, сек (по умолчанию 300)',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='bench',
+            help='Префикс имен создаваемых пользователей (по умолчанию bench)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Размер пачки bulk_create (по умолчанию 5000)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Начальное значение генератора случайных чисел (по умолчанию 1)',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Удалить ранее созданных пользователей с этим префиксом',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        if options['clear']:
+            deleted, _ = User.objects.filter(username__startswith=f'{prefix}_user_').delete()
+            self.stdout.write(f'Удалено объектов: {deleted}')
+
+        started = time.monotonic()
+        total = 0
+        portal_count = 0
+
+        for user_index in range(options['users']):
+            user, created = User.objects.get_or_create(username=f'{prefix}_user_{user_index}')
+            if created:
+                user.set_unusable_password()
+                user.save(update_fields=['password'])
+
+            offset = Portal.objects.filter(user=user).count()
+            for portal_index in range(offset, offset + options['portals']):
+                portal = Portal.objects.create(
+                    user=user,
+                    title=f'{prefix} {user_index}-{portal_index}',
+                    url=f'https://{prefix}-{user_index}-{portal_index}.example.com/',
+                    position=portal_index * Portal.POSITION_STEP,
+                    check_interval=options['interval'],
+                )
+                total += self.seed_portal(portal, rng, options)
+                portal_count += 1
+
+            self.stdout.write(f'  Пользователь {user.username}: проверок всего {total}')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано порталов: {portal_count}, проверок: {total} '
+            f'за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} строк/с)'
+        ))
+
+    def seed_portal(self, portal, rng, options):
+        """
+        Создает историю одного портала и пересчитывает его агрегаты.
+
+        Время ответа - логнормальное вокруг базового значения портала,
+        сбои идут сериями: небольшая вероятность начала сбоя и
+        вероятность восстановления на каждой следующей проверке.
+        Новое соединение (с фазами DNS/TCP/TLS) - примерно каждая
+        пятая проверка, остальные идут по keep-alive. Ожидание первого
+        байта - остаток времени ответа после фаз установки соединения,
+        как в probe_url.
+        """
+        interval = options['interval']
+        batch_size = options['batch_size']
+        now = timezone.now()
+        count = options['days'] * 86400 // interval
+        moment = now - timedelta(seconds=count * interval)
+
+        base = rng.uniform(40, 600)
+        failure_rate = rng.choice((0.0005, 0.002, 0.01))
+        down = False
+        batch = []
+        written = 0
+
+        with transaction.atomic():
+            for _ in range(count):
+                moment += timedelta(seconds=interval + rng.uniform(-0.1, 0.1) * interval)
+                if moment >= now:
+                    break
+                down = rng.random() < (0.7 if down else failure_rate)
+
+                if down:
+                    check = PortalAvailability(
+                        portal=portal, timestamp=moment, is_available=False,
+                        status_code=rng.choice((None, None, 500, 502, 503)),
+                    )
+                else:
+                    response_time = round(base * rng.lognormvariate(0, 0.35), 2)
+                    check = PortalAvailability(
+                        portal=portal, timestamp=moment, is_available=True,
+                        response_time=response_time, status_code=200,
+                        total_time=round(response_time * 1.1, 2),
+                    )
+                    setup_time = 0
+                    if rng.random() < 0.2:
+                        check.dns_time = round(min(rng.uniform(1, 30), response_time * 0.2), 2)
+                        check.connect_time = round(response_time * 0.1, 2)
+                        check.tls_time = round(response_time * 0.2, 2)
+                        setup_time = check.dns_time + check.connect_time + check.tls_time
+                    check.ttfb = round(response_time - setup_time, 2)
+                batch.append(check)
+
+                if len(batch) >= batch_size:
+                    PortalAvailability.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+
+            PortalAvailability.objects.bulk_create(batch)
+            written += len(batch)
+
+        rebuild_portal_rollups(portal.id)
+        return written
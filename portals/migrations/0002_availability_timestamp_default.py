@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portals', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='portalavailability',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время проверки'),
+        ),
+    ]
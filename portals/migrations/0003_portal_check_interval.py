@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:28
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portals', '0002_availability_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portal',
+            name='check_interval',
+            field=models.PositiveIntegerField(default=300, validators=[django.core.validators.MinValueValidator(30)], verbose_name='Интервал проверки (сек)'),
+        ),
+    ]
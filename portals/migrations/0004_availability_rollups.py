@@ -0,0 +1,62 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portals', '0003_portal_check_interval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortalAvailabilityDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(verbose_name='Начало интервала')),
+                ('checks_count', models.PositiveIntegerField(default=0, verbose_name='Проверок')),
+                ('available_count', models.PositiveIntegerField(default=0, verbose_name='Доступен')),
+                ('response_time_count', models.PositiveIntegerField(default=0, verbose_name='Проверок с временем ответа')),
+                ('response_time_sum', models.FloatField(default=0, verbose_name='Сумма времени ответа (мс)')),
+                ('response_time_min', models.FloatField(blank=True, null=True, verbose_name='Мин. время ответа (мс)')),
+                ('response_time_max', models.FloatField(blank=True, null=True, verbose_name='Макс. время ответа (мс)')),
+                ('portal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='portals.portal', verbose_name='Портал')),
+            ],
+            options={
+                'verbose_name': 'Суточная статистика',
+                'verbose_name_plural': 'Суточная статистика',
+                'ordering': ['-bucket'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='PortalAvailabilityHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(verbose_name='Начало интервала')),
+                ('checks_count', models.PositiveIntegerField(default=0, verbose_name='Проверок')),
+                ('available_count', models.PositiveIntegerField(default=0, verbose_name='Доступен')),
+                ('response_time_count', models.PositiveIntegerField(default=0, verbose_name='Проверок с временем ответа')),
+                ('response_time_sum', models.FloatField(default=0, verbose_name='Сумма времени ответа (мс)')),
+                ('response_time_min', models.FloatField(blank=True, null=True, verbose_name='Мин. время ответа (мс)')),
+                ('response_time_max', models.FloatField(blank=True, null=True, verbose_name='Макс. время ответа (мс)')),
+                ('portal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_rollups', to='portals.portal', verbose_name='Портал')),
+            ],
+            options={
+                'verbose_name': 'Почасовая статистика',
+                'verbose_name_plural': 'Почасовая статистика',
+                'ordering': ['-bucket'],
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='portalavailabilitydaily',
+            constraint=models.UniqueConstraint(fields=('portal', 'bucket'), name='portals_daily_portal_bucket_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='portalavailabilityhourly',
+            constraint=models.UniqueConstraint(fields=('portal', 'bucket'), name='portals_hourly_portal_bucket_uniq'),
+        ),
+    ]
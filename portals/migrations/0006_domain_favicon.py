@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portals', '0005_portal_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainFavicon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=255, unique=True, verbose_name='Домен')),
+                ('content_hash', models.CharField(blank=True, max_length=64, verbose_name='Хэш содержимого')),
+                ('path', models.CharField(blank=True, max_length=255, verbose_name='Файл')),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Загружено')),
+            ],
+            options={
+                'verbose_name': 'Favicon домена',
+                'verbose_name_plural': 'Favicon доменов',
+            },
+        ),
+    ]
@@ -0,0 +1,138 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portals', '0006_domain_favicon'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portalavailability',
+            name='connect_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='TCP-подключение (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailability',
+            name='dns_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='DNS (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailability',
+            name='tls_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='TLS-рукопожатие (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailability',
+            name='total_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='Полное время (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailability',
+            name='ttfb',
+            field=models.FloatField(blank=True, null=True, verbose_name='Ожидание первого байта (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='connect_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров подключения'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='connect_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма подключения (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='dns_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров DNS'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='dns_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма DNS (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='tls_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров TLS'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='tls_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма TLS (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='total_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров полного времени'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='total_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма полного времени (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='ttfb_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров ожидания первого байта'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='ttfb_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма ожидания первого байта (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='connect_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров подключения'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='connect_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма подключения (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='dns_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров DNS'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='dns_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма DNS (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='tls_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров TLS'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='tls_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма TLS (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='total_time_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров полного времени'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='total_time_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма полного времени (мс)'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='ttfb_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Замеров ожидания первого байта'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='ttfb_sum',
+            field=models.FloatField(default=0, verbose_name='Сумма ожидания первого байта (мс)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portals', '0007_check_phase_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portalavailabilitydaily',
+            name='response_time_sketch',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Распределение времени ответа'),
+        ),
+        migrations.AddField(
+            model_name='portalavailabilityhourly',
+            name='response_time_sketch',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Распределение времени ответа'),
+        ),
+    ]
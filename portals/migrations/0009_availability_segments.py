@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portals', '0008_rollup_response_time_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortalAvailabilitySegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(verbose_name='Начало')),
+                ('end', models.DateTimeField(verbose_name='Конец')),
+                ('checks_count', models.PositiveIntegerField(default=0, verbose_name='Проверок')),
+                ('data', models.BinaryField(verbose_name='Данные')),
+                ('portal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='portals.portal', verbose_name='Портал')),
+            ],
+            options={
+                'verbose_name': 'Сегмент истории',
+                'verbose_name_plural': 'Сегменты истории',
+                'ordering': ['-start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='portalavailabilitysegment',
+            constraint=models.UniqueConstraint(fields=('portal', 'start'), name='portals_segment_portal_start_uniq'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+"""
+Заполнение агрегатов доступности по уже сохраненным проверкам.
+
+Статистика читается только из агрегатов (0004), а скетчи времени
+ответа (0008) у существующих агрегатов пусты, поэтому после обновления
+агрегаты всех порталов пересчитываются один раз так же, как командой
+rebuild_rollups. Миграция неатомарна: каждый портал пересчитывается
+своей транзакцией и не держит блокировку записи SQLite на весь проход.
+"""
+
+from django.db import migrations
+
+
+def backfill_rollups(apps, schema_editor):
+    # Пересчет использует текущие модели: на новой базе порталов нет,
+    # и функция не вызывается
+    from portals.rollups import rebuild_portal_rollups
+
+    Portal = apps.get_model('portals', 'Portal')
+    for portal_id in Portal.objects.order_by('id').values_list('id', flat=True):
+        rebuild_portal_rollups(portal_id)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('portals', '0009_availability_segments'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
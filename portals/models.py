@@ -10,7 +10,72 @@ from django.db import models
 from django.contrib.auth.models import User
 
 # Валидатор для проверки корректности URL
-from django.core.validators import URLValidator
+from django.core.validators import URLValidator, MinValueValidator
+
+# Текущее время с учетом часового пояса
+from django.utils import timezone
+
+# Скетчи распределения времени ответа для перцентилей
+from .sketches import add_value
+
+
+# Фазы запроса, сохраняемые для каждой проверки (поля PortalAvailability)
+PHASE_FIELDS = ['dns_time', 'connect_time', 'tls_time', 'ttfb', 'total_time']
+
+
+class PortalQuerySet(models.QuerySet):
+    """
+    QuerySet порталов с аннотациями статистики доступности.
+    """
+    
+    def with_uptime(self, days=7):
+        """
+        Добавляет к каждому порталу статистику одним SQL-запросом.
+        
+        Аннотации:
+        - uptime: процент доступности за days дней (None если проверок не было)
+        - checks_count: количество проверок за период
+        - last_is_available: результат последней проверки
+        - last_response_time: время ответа последней проверки
+        - last_status_code: HTTP код последней проверки
+        - last_checked_at: время последней проверки
+        
+        Статистика за период собирается из агрегатов (см. portals/rollups.py),
+        поэтому списки порталов не выполняют запросы на каждую строку.
+        """
+        from datetime import timedelta
+        from django.db.models import FloatField, OuterRef, Subquery, Value
+        from django.db.models.functions import Cast, Coalesce, NullIf, Round
+        from .rollups import window_annotations
+        
+        now = timezone.now()
+        tiers = window_annotations(
+            now - timedelta(days=days), now, fields={'checks_count', 'available_count'}
+        )
+        
+        def total(name):
+            """Сумма значений поля по всем уровням хранения."""
+            parts = [Coalesce(tiers[key], Value(0)) for key in tiers if key.endswith(name)]
+            expression = Value(0)
+            for part in parts:
+                expression = expression + part
+            return expression
+        
+        latest = PortalAvailability.objects.filter(portal=OuterRef('pk')).order_by('-timestamp')
+        
+        return self.annotate(
+            checks_count=total('checks_count'),
+            available_count=total('available_count'),
+        ).annotate(
+            uptime=Round(
+                Cast('available_count', FloatField()) * 100 / NullIf('checks_count', 0),
+                1
+            ),
+            last_is_available=Subquery(latest.values('is_available')[:1]),
+            last_response_time=Subquery(latest.values('response_time')[:1]),
+            last_status_code=Subquery(latest.values('status_code')[:1]),
+            last_checked_at=Subquery(latest.values('timestamp')[:1]),
+        )
 
 
 class Portal(models.Model):
@@ -41,15 +106,29 @@ class Portal(models.Model):
     # Favicon портала, загружается автоматически
     favicon = models.ImageField(upload_to='favicons/', blank=True, null=True, verbose_name='Иконка')
     
+    # Шаг между позициями соседних порталов: перемещение карточки
+    # между двумя другими занимает свободное значение в промежутке
+    POSITION_STEP = 1024
+    
     # Позиция для сортировки (drag-and-drop)
     position = models.IntegerField(default=0, verbose_name='Позиция')
     
+    # Интервал между проверками доступности в режиме демона (секунды)
+    check_interval = models.PositiveIntegerField(
+        default=300,
+        validators=[MinValueValidator(30)],
+        verbose_name='Интервал проверки (сек)'
+    )
+    
     # Дата создания записи
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     
     # Дата последнего обновления
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
     
+    # Менеджер с поддержкой with_uptime()
+    objects = PortalQuerySet.as_manager()
+    
     class Meta:
         ordering = ['position', '-created_at']
         verbose_name = 'Портал'
@@ -66,20 +145,23 @@ class Portal(models.Model):
         
         Возвращает None если проверок не было,
         иначе возвращает число от 0 до 100.
+        Если портал получен через Portal.objects.with_uptime(),
+        используется готовая аннотация без обращения к БД.
         """
-        from django.utils import timezone
+        if 'uptime' in self.__dict__:
+            return self.uptime
+        
         from datetime import timedelta
+        from .rollups import aggregate_window
         
-        week_ago = timezone.now() - timedelta(days=7)
-        checks = self.availability_checks.filter(timestamp__gte=week_ago)
+        now = timezone.now()
+        totals = aggregate_window(self.id, now - timedelta(days=7), now)
+        total_count = totals['checks_count']
         
-        if not checks.exists():
+        if not total_count:
             return None
         
-        available_count = checks.filter(is_available=True).count()
-        total_count = checks.count()
-        
-        return round((available_count / total_count) * 100, 1) if total_count > 0 else 0
+        return round((totals['available_count'] / total_count) * 100, 1)
 
 
 class PortalAvailability(models.Model):
@@ -98,8 +180,8 @@ class PortalAvailability(models.Model):
         verbose_name='Портал'
     )
     
-    # Время выполнения проверки
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name='Время проверки')
+    # Время выполнения проверки (задается явно при пакетной записи)
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name='Время проверки')
     
     # Был ли портал доступен при проверке
     is_available = models.BooleanField(verbose_name='Доступен')
@@ -110,6 +192,16 @@ class PortalAvailability(models.Model):
     # HTTP статус-код ответа
     status_code = models.IntegerField(null=True, blank=True, verbose_name='HTTP код')
     
+    # Длительность фаз запроса в миллисекундах. Фазы не пересекаются:
+    # DNS + подключение + TLS + ожидание первого байта ≈ response_time.
+    # Для переиспользованного keep-alive соединения фазы DNS,
+    # подключения и TLS не выполняются и остаются пустыми.
+    dns_time = models.FloatField(null=True, blank=True, verbose_name='DNS (мс)')
+    connect_time = models.FloatField(null=True, blank=True, verbose_name='TCP-подключение (мс)')
+    tls_time = models.FloatField(null=True, blank=True, verbose_name='TLS-рукопожатие (мс)')
+    ttfb = models.FloatField(null=True, blank=True, verbose_name='Ожидание первого байта (мс)')
+    total_time = models.FloatField(null=True, blank=True, verbose_name='Полное время (мс)')
+    
     class Meta:
         ordering = ['-timestamp']
         verbose_name = 'Проверка доступности'
@@ -122,3 +214,266 @@ class PortalAvailability(models.Model):
     def __str__(self):
         """Возвращает строковое представление для админки."""
         return f"{self.portal.title} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class AvailabilityRollup(models.Model):
+    """
+    Базовая модель предагрегированной статистики проверок за интервал.
+    
+    Хранит счетчики и сумму/минимум/максимум времени ответа,
+    по которым считаются доступность и среднее время ответа
+    без чтения отдельных записей PortalAvailability.
+    Начало интервала (bucket) хранится в UTC.
+    """
+    
+    # Начало интервала агрегации
+    bucket = models.DateTimeField(verbose_name='Начало интервала')
+    
+    # Общее количество проверок за интервал
+    checks_count = models.PositiveIntegerField(default=0, verbose_name='Проверок')
+    
+    # Количество успешных проверок за интервал
+    available_count = models.PositiveIntegerField(default=0, verbose_name='Доступен')
+    
+    # Количество проверок с известным временем ответа
+    response_time_count = models.PositiveIntegerField(default=0, verbose_name='Проверок с временем ответа')
+    
+    # Сумма времени ответа в миллисекундах (для среднего)
+    response_time_sum = models.FloatField(default=0, verbose_name='Сумма времени ответа (мс)')
+    
+    # Минимальное время ответа за интервал
+    response_time_min = models.FloatField(null=True, blank=True, verbose_name='Мин. время ответа (мс)')
+    
+    # Максимальное время ответа за интервал
+    response_time_max = models.FloatField(null=True, blank=True, verbose_name='Макс. время ответа (мс)')
+    
+    # Суммы и количества значений фаз запроса (для средних по фазам)
+    dns_time_sum = models.FloatField(default=0, verbose_name='Сумма DNS (мс)')
+    dns_time_count = models.PositiveIntegerField(default=0, verbose_name='Замеров DNS')
+    connect_time_sum = models.FloatField(default=0, verbose_name='Сумма подключения (мс)')
+    connect_time_count = models.PositiveIntegerField(default=0, verbose_name='Замеров подключения')
+    tls_time_sum = models.FloatField(default=0, verbose_name='Сумма TLS (мс)')
+    tls_time_count = models.PositiveIntegerField(default=0, verbose_name='Замеров TLS')
+    ttfb_sum = models.FloatField(default=0, verbose_name='Сумма ожидания первого байта (мс)')
+    ttfb_count = models.PositiveIntegerField(default=0, verbose_name='Замеров ожидания первого байта')
+    total_time_sum = models.FloatField(default=0, verbose_name='Сумма полного времени (мс)')
+    total_time_count = models.PositiveIntegerField(default=0, verbose_name='Замеров полного времени')
+    
+    # Скетч распределения времени ответа для перцентилей (см. portals/sketches.py)
+    response_time_sketch = models.JSONField(default=dict, blank=True, verbose_name='Распределение времени ответа')
+    
+    class Meta:
+        abstract = True
+        ordering = ['-bucket']
+    
+    def __str__(self):
+        """Возвращает строковое представление для админки."""
+        return f"{self.portal.title} - {self.bucket.strftime('%Y-%m-%d %H:%M')}"
+    
+    def add_check(self, check):
+        """Учитывает одну проверку PortalAvailability в агрегате."""
+        self.checks_count += 1
+        if check.is_available:
+            self.available_count += 1
+        
+        response_time = check.response_time
+        if response_time is not None:
+            self.response_time_count += 1
+            self.response_time_sum += response_time
+            if self.response_time_min is None or response_time < self.response_time_min:
+                self.response_time_min = response_time
+            if self.response_time_max is None or response_time > self.response_time_max:
+                self.response_time_max = response_time
+            add_value(self.response_time_sketch, response_time)
+        
+        for phase in PHASE_FIELDS:
+            value = getattr(check, phase)
+            if value is not None:
+                setattr(self, f'{phase}_sum', getattr(self, f'{phase}_sum') + value)
+                setattr(self, f'{phase}_count', getattr(self, f'{phase}_count') + 1)
+
+
+class PortalAvailabilityHourly(AvailabilityRollup):
+    """Почасовая статистика проверок доступности портала."""
+    
+    # Связь с проверяемым порталом
+    portal = models.ForeignKey(
+        Portal,
+        on_delete=models.CASCADE,
+        related_name='hourly_rollups',
+        verbose_name='Портал'
+    )
+    
+    class Meta(AvailabilityRollup.Meta):
+        verbose_name = 'Почасовая статистика'
+        verbose_name_plural = 'Почасовая статистика'
+        constraints = [
+            models.UniqueConstraint(fields=['portal', 'bucket'], name='portals_hourly_portal_bucket_uniq'),
+        ]
+
+
+class PortalAvailabilityDaily(AvailabilityRollup):
+    """Суточная статистика проверок доступности портала."""
+    
+    # Связь с проверяемым порталом
+    portal = models.ForeignKey(
+        Portal,
+        on_delete=models.CASCADE,
+        related_name='daily_rollups',
+        verbose_name='Портал'
+    )
+    
+    class Meta(AvailabilityRollup.Meta):
+        verbose_name = 'Суточная статистика'
+        verbose_name_plural = 'Суточная статистика'
+        constraints = [
+            models.UniqueConstraint(fields=['portal', 'bucket'], name='portals_daily_portal_bucket_uniq'),
+        ]
+
+
+class PortalAvailabilitySegment(models.Model):
+    """
+    Сжатый сегмент истории проверок портала за сутки (UTC).
+    
+    Используется при PORTALS_SEGMENT_STORAGE = True: проверки
+    завершенных суток переносятся из PortalAvailability в один блок
+    с колонками времени, доступности, времени ответа и HTTP-кода
+    (формат описан в portals/segments.py). Фазы запроса в сегмент
+    не входят - их средние остаются в агрегатах.
+    """
+    
+    # Связь с проверяемым порталом
+    portal = models.ForeignKey(
+        Portal,
+        on_delete=models.CASCADE,
+        related_name='segments',
+        verbose_name='Портал'
+    )
+    
+    # Границы сегмента [start, end)
+    start = models.DateTimeField(verbose_name='Начало')
+    end = models.DateTimeField(verbose_name='Конец')
+    
+    # Количество проверок в сегменте
+    checks_count = models.PositiveIntegerField(default=0, verbose_name='Проверок')
+    
+    # Сжатые колонки проверок
+    data = models.BinaryField(verbose_name='Данные')
+    
+    class Meta:
+        ordering = ['-start']
+        verbose_name = 'Сегмент истории'
+        verbose_name_plural = 'Сегменты истории'
+        constraints = [
+            models.UniqueConstraint(fields=['portal', 'start'], name='portals_segment_portal_start_uniq'),
+        ]
+    
+    def __str__(self):
+        """Возвращает строковое представление для админки."""
+        return f"{self.portal.title} - {self.start.strftime('%Y-%m-%d')}"
+
+
+class DomainFavicon(models.Model):
+    """
+    Модель общего кэша favicon по доменам.
+    
+    Для каждого домена хранится путь к файлу иконки, имя которого
+    образовано хэшем содержимого, поэтому одинаковые иконки хранятся
+    на диске один раз, а порталы одного домена ссылаются на общий файл.
+    Пустой content_hash означает, что иконку загрузить не удалось
+    (отрицательный кэш, чтобы не повторять сетевые запросы).
+    """
+    
+    # Домен (netloc в нижнем регистре)
+    domain = models.CharField(max_length=255, unique=True, verbose_name='Домен')
+    
+    # SHA-256 содержимого иконки
+    content_hash = models.CharField(max_length=64, blank=True, verbose_name='Хэш содержимого')
+    
+    # Путь к общему файлу иконки в хранилище медиа
+    path = models.CharField(max_length=255, blank=True, verbose_name='Файл')
+    
+    # Время последней загрузки
+    fetched_at = models.DateTimeField(default=timezone.now, verbose_name='Загружено')
+    
+    class Meta:
+        verbose_name = 'Favicon домена'
+        verbose_name_plural = 'Favicon доменов'
+    
+    def __str__(self):
+        """Возвращает домен для отображения в админке."""
+        return self.domain
+
+
+class PortalJob(models.Model):
+    """
+    Модель фоновой задачи по порталу.
+    
+    Очередь хранится в БД и обрабатывается командой run_jobs,
+    поэтому медленные сетевые операции (загрузка favicon, первая
+    проверка доступности) не занимают воркеры веб-сервера.
+    Успешно выполненные задачи удаляются, неудачные остаются
+    со статусом failed и текстом ошибки.
+    """
+    
+    # Типы задач
+    KIND_FAVICON = 'favicon'
+    KIND_CHECK = 'check'
+    KIND_CHOICES = [
+        (KIND_FAVICON, 'Загрузка favicon'),
+        (KIND_CHECK, 'Проверка доступности'),
+    ]
+    
+    # Статусы задач
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+    
+    # Портал, к которому относится задача
+    portal = models.ForeignKey(
+        Portal,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        verbose_name='Портал'
+    )
+    
+    # Тип задачи
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип')
+    
+    # Текущий статус задачи
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Статус'
+    )
+    
+    # Количество выполненных попыток
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    
+    # Не запускать раньше этого времени (для повторов с задержкой)
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Запустить после')
+    
+    # Текст последней ошибки
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    
+    # Дата создания задачи
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    
+    # Дата последнего изменения статуса
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+    
+    class Meta:
+        ordering = ['run_after', 'id']
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            # Индекс для выборки готовых к запуску задач
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    def __str__(self):
+        """Возвращает строковое представление для админки."""
+        return f"{self.portal.title} - {self.get_kind_display()} ({self.get_status_display()})"
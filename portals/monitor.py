@@ -0,0 +1,265 @@
+"""
+Модуль движка мониторинга порталов.
+Выполняет проверки доступности параллельно в пуле потоков
+с ограничением общего числа запросов и числа соединений на один хост,
+а также планирует проверки для долгоживущего режима демона.
+"""
+
+# Примитивы синхронизации для ограничения соединений на хост
+import threading
+
+# Очередь с приоритетом для расписания проверок
+import heapq
+
+# Случайный разброс времени проверок (jitter)
+import random
+
+# Пул потоков для параллельных HTTP-запросов
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Структуры для группировки порталов по хостам
+from collections import OrderedDict, deque
+
+# Монотонные часы для расписания
+import time
+
+# Функции для разбора и сборки URL
+from urllib.parse import urlparse, urlunparse
+
+# Сервисные функции проверки доступности
+from .services import probe_url
+
+
+# Значения по умолчанию для параллельного движка
+DEFAULT_CONCURRENCY = 20
+DEFAULT_PER_HOST = 4
+
+
+class HostLimiter:
+    """
+    Ограничитель числа одновременных запросов к одному хосту.
+
+    Для каждого хоста лениво создается семафор, поэтому
+    медленный хост не может занять весь пул потоков.
+    """
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def get(self, host):
+        """Возвращает семафор для указанного хоста."""
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+
+def get_host(url):
+    """Возвращает хост (netloc в нижнем регистре) для группировки запросов."""
+    return urlparse(url).netloc.lower()
+
+
+# Порты по умолчанию, которые не влияют на адрес проверки
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """
+    Приводит URL к виду для сравнения адресов проверки.
+
+    Схема и хост переводятся в нижний регистр, порт по умолчанию
+    и фрагмент (#...) отбрасываются, пустой путь заменяется на '/'.
+    Регистр пути и строка запроса сохраняются — они могут
+    менять ответ сервера.
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parsed.port
+    except ValueError:
+        return url
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f'{host}:{port}'
+    if parsed.username or parsed.password:
+        netloc = f'{parsed.netloc.rsplit("@", 1)[0]}@{netloc}'
+    return urlunparse((scheme, netloc, parsed.path or '/', parsed.params, parsed.query, ''))
+
+
+def group_by_url(portals):
+    """
+    Группирует порталы по нормализованному URL.
+
+    Возвращает упорядоченный словарь {URL: [порталы]}; проверка
+    выполняется один раз на группу, результат записывается всем ее порталам.
+    """
+    groups = OrderedDict()
+    for portal in portals:
+        groups.setdefault(normalize_url(portal.url), []).append(portal)
+    return groups
+
+
+def interleave_by_host(portals):
+    """
+    Переупорядочивает порталы так, чтобы соседние задачи
+    по возможности относились к разным хостам.
+
+    Так потоки пула не простаивают в ожидании семафора
+    одного популярного хоста, пока остальные хосты свободны.
+    """
+    groups = OrderedDict()
+    for portal in portals:
+        groups.setdefault(get_host(portal.url), deque()).append(portal)
+
+    queues = list(groups.values())
+    ordered = []
+    while queues:
+        remaining = []
+        for queue in queues:
+            ordered.append(queue.popleft())
+            if queue:
+                remaining.append(queue)
+        queues = remaining
+    return ordered
+
+
+class CheckEngine:
+    """
+    Пул потоков для HTTP-проверок с ограничением соединений на хост.
+
+    Выполняет только сетевую часть проверки (probe_url),
+    запись результатов остается за вызывающим кодом.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST):
+        self.limiter = HostLimiter(per_host)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def _probe(self, url):
+        with self.limiter.get(get_host(url)):
+            return probe_url(url)
+
+    def submit(self, portal):
+        """Ставит проверку портала в очередь пула, возвращает Future."""
+        return self.executor.submit(self._probe, portal.url)
+
+    def shutdown(self, wait=True):
+        """Останавливает пул; незапущенные проверки отменяются."""
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def run_checks(portals, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST):
+    """
+    Проверяет порталы параллельно и отдает результаты по мере готовности.
+
+    HTTP-запросы выполняются в пуле из concurrency потоков,
+    к одному хосту одновременно идет не более per_host запросов.
+    Порталы с одинаковым адресом (см. normalize_url) проверяются
+    одним запросом, результат отдается для каждого из них.
+    Генератор возвращает пары (portal, result) в вызывающем потоке,
+    поэтому запись в БД остается в основном потоке команды.
+    """
+    groups = group_by_url(portals)
+    leaders = interleave_by_host(group[0] for group in groups.values())
+    with CheckEngine(concurrency, per_host) as engine:
+        futures = {
+            engine.submit(leader): groups[normalize_url(leader.url)]
+            for leader in leaders
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            for portal in futures[future]:
+                yield portal, result
+
+
+class CheckScheduler:
+    """
+    Расписание проверок для режима демона.
+
+    Хранит очередь с приоритетом (heapq) из пар
+    (время следующей проверки, id портала). Первая проверка нового
+    портала равномерно распределяется по его интервалу, а каждая
+    следующая сдвигается на интервал со случайным разбросом jitter,
+    чтобы проверки не собирались в пики в начале каждой минуты.
+    """
+
+    def __init__(self, jitter=0.1, clock=time.monotonic):
+        self.jitter = jitter
+        self.clock = clock
+        self.portals = {}
+        self._heap = []
+        self._due = {}
+
+    def __len__(self):
+        return len(self.portals)
+
+    def sync(self, portals):
+        """
+        Синхронизирует расписание с актуальным списком порталов.
+
+        Новые порталы получают случайное время первой проверки,
+        удаленные исключаются; у существующих обновляются URL и интервал.
+        """
+        now = self.clock()
+        fresh = {portal.id: portal for portal in portals}
+
+        for portal_id in list(self.portals):
+            if portal_id not in fresh:
+                del self.portals[portal_id]
+                self._due.pop(portal_id, None)
+
+        for portal_id, portal in fresh.items():
+            if portal_id not in self.portals:
+                self._schedule(portal_id, now + random.uniform(0, portal.check_interval))
+            self.portals[portal_id] = portal
+
+    def _schedule(self, portal_id, due):
+        self._due[portal_id] = due
+        heapq.heappush(self._heap, (due, portal_id))
+
+    def pop_due(self):
+        """
+        Возвращает порталы, время проверки которых наступило,
+        и сразу планирует для них следующую проверку.
+        """
+        now = self.clock()
+        due_portals = []
+
+        while self._heap and self._heap[0][0] <= now:
+            due, portal_id = heapq.heappop(self._heap)
+
+            # Пропускаем устаревшие записи удаленных или перепланированных порталов
+            if self._due.get(portal_id) != due:
+                continue
+
+            portal = self.portals[portal_id]
+            due_portals.append(portal)
+
+            interval = portal.check_interval
+            next_due = due + interval * (1 + random.uniform(-self.jitter, self.jitter))
+            if next_due <= now:
+                # После долгого простоя не наверстываем пропущенные проверки
+                # пачкой, а заново распределяем их по интервалу
+                next_due = now + random.uniform(1, interval)
+            self._schedule(portal_id, next_due)
+
+        return due_portals
+
+    def seconds_until_next(self):
+        """Возвращает время до ближайшей запланированной проверки."""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self.clock())
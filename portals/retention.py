@@ -0,0 +1,273 @@
+"""
+Модуль хранения истории проверок.
+Удаляет устаревшие сырые проверки и агрегаты небольшими порциями,
+чтобы не блокировать надолго запись в БД, и постепенно возвращает
+освободившееся место через incremental vacuum в SQLite.
+При PORTALS_SEGMENT_STORAGE проверки завершенных суток переносятся
+в сжатые сегменты (см. portals/segments.py).
+"""
+
+# Пауза между порциями удаления и ограничение по времени
+import time
+
+# Работа с датами
+from datetime import timedelta
+
+# Настройки проекта, соединение с БД и текущее время
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+# Модели проверок, агрегатов и сегментов
+from .models import (
+    PortalAvailability, PortalAvailabilityDaily, PortalAvailabilityHourly, PortalAvailabilitySegment,
+)
+
+# Границы суток и упаковка сегментов
+from .rollups import day_start
+from .segments import decode_segment, encode_segment, iter_rows
+
+
+def retention_policy(raw_days=None, hourly_days=None, daily_days=None):
+    """
+    Возвращает список (модель, поле времени, срок хранения в днях).
+
+    Значения по умолчанию берутся из настроек PORTALS_*_RETENTION_DAYS;
+    срок 0 или None означает бессрочное хранение.
+    """
+    return [
+        (PortalAvailability, 'timestamp',
+         raw_days if raw_days is not None else settings.PORTALS_RAW_RETENTION_DAYS),
+        (PortalAvailabilitySegment, 'end', settings.PORTALS_SEGMENT_RETENTION_DAYS),
+        (PortalAvailabilityHourly, 'bucket',
+         hourly_days if hourly_days is not None else settings.PORTALS_HOURLY_RETENTION_DAYS),
+        (PortalAvailabilityDaily, 'bucket',
+         daily_days if daily_days is not None else settings.PORTALS_DAILY_RETENTION_DAYS),
+    ]
+
+
+def prune_history(raw_days=None, hourly_days=None, daily_days=None,
+                  chunk_size=None, pause=None, time_budget=None):
+    """
+    Удаляет записи старше сроков хранения порциями по chunk_size строк.
+
+    Каждая порция - самые старые (по id) устаревшие строки всех
+    порталов - удаляется в отдельной короткой транзакции, между
+    порциями делается пауза pause секунд, чтобы писатели монитора
+    и веб-воркеры не ждали блокировку. Модели обрабатываются по
+    очереди, по одной порции за ход, поэтому при ограничении
+    time_budget (секунды) каждая получает свою долю времени,
+    а оставшееся удалится при следующем вызове.
+
+    При PORTALS_SEGMENT_STORAGE проверки сначала переносятся в сегменты
+    (по одним суткам портала за ход), сырые проверки удаляются только
+    после переноса; количество перенесенных возвращается под ключом
+    'compacted'.
+
+    Возвращает словарь {имя модели: удалено строк}.
+    """
+    chunk_size = chunk_size or settings.PORTALS_PRUNE_CHUNK_SIZE
+    pause = settings.PORTALS_PRUNE_CHUNK_PAUSE if pause is None else pause
+    deadline = time.monotonic() + time_budget if time_budget else None
+
+    now = timezone.now()
+    deleted = {}
+    steps = {}
+
+    if settings.PORTALS_SEGMENT_STORAGE:
+        deleted['compacted'] = 0
+        boundary = segment_boundary()
+        steps['compacted'] = lambda: compact_next(boundary)
+
+    for model, field, days in retention_policy(raw_days, hourly_days, daily_days):
+        deleted[model.__name__] = 0
+        if days:
+            cutoff = now - timedelta(days=days)
+            steps[model.__name__] = (
+                lambda model=model, field=field, cutoff=cutoff: delete_chunk(model, field, cutoff, chunk_size)
+            )
+
+    while steps:
+        for name in list(steps):
+            if deadline and time.monotonic() >= deadline:
+                return deleted
+            # Сырые проверки удаляются только после переноса в сегменты
+            if name == PortalAvailability.__name__ and 'compacted' in steps:
+                continue
+
+            count = steps[name]()
+            if count is None:
+                del steps[name]
+                continue
+            deleted[name] += count
+            if name != 'compacted' and count < chunk_size:
+                del steps[name]
+            if pause:
+                time.sleep(pause)
+
+    return deleted
+
+
+def delete_chunk(model, field, cutoff, chunk_size):
+    """
+    Удаляет до chunk_size самых старых (по id) строк модели
+    со значением field раньше cutoff. Возвращает число удаленных
+    строк или None, если удалять нечего.
+    """
+    ids = list(
+        model.objects
+        .filter(**{f'{field}__lt': cutoff})
+        .order_by('id')
+        .values_list('id', flat=True)[:chunk_size]
+    )
+    if not ids:
+        return None
+
+    with transaction.atomic():
+        count, _ = model.objects.filter(id__in=ids).delete()
+    return count
+
+
+def compact_segment(portal_id, start):
+    """
+    Переносит проверки портала за сутки, начинающиеся в start,
+    в сегмент PortalAvailabilitySegment.
+
+    Если сегмент уже есть (проверки дописаны задним числом),
+    он распаковывается и упаковывается заново вместе с новыми.
+    Перенос выполняется одной транзакцией. Возвращает число
+    перенесенных проверок.
+    """
+    end = start + timedelta(days=1)
+    checks = PortalAvailability.objects.filter(portal_id=portal_id, timestamp__gte=start, timestamp__lt=end)
+
+    with transaction.atomic():
+        rows = list(
+            checks.order_by('timestamp')
+            .values_list('id', 'timestamp', 'is_available', 'response_time', 'status_code')
+        )
+        if not rows:
+            return 0
+
+        segment = PortalAvailabilitySegment.objects.select_for_update().filter(
+            portal_id=portal_id, start=start
+        ).first()
+        merged = [row[1:] for row in rows]
+        if segment is not None:
+            merged = sorted(list(iter_rows(decode_segment(segment.data))) + merged, key=lambda row: row[0])
+        else:
+            segment = PortalAvailabilitySegment(portal_id=portal_id, start=start, end=end)
+
+        segment.checks_count = len(merged)
+        segment.data = encode_segment(merged)
+        segment.save()
+
+        # Проверки, записанные после чтения, получили больший id и останутся
+        checks.filter(id__lte=max(row[0] for row in rows)).delete()
+
+    return len(rows)
+
+
+def segment_boundary():
+    """Начало суток, проверки до которого переносятся в сегменты."""
+    return day_start(timezone.now() - timedelta(hours=settings.PORTALS_SEGMENT_DELAY_HOURS))
+
+
+def compact_next(boundary, portal_ids=None):
+    """
+    Переносит в сегмент сутки самой старой (по id) проверки раньше
+    boundary. Возвращает число перенесенных проверок или None,
+    если переносить нечего.
+    """
+    checks = PortalAvailability.objects.filter(timestamp__lt=boundary)
+    if portal_ids is not None:
+        checks = checks.filter(portal_id__in=portal_ids)
+    first = checks.order_by('id').values_list('portal_id', 'timestamp').first()
+    if first is None:
+        return None
+    return compact_segment(first[0], day_start(first[1]))
+
+
+def compact_segments(portal_ids=None, pause=0, deadline=None):
+    """
+    Переносит проверки завершенных суток в сжатые сегменты.
+
+    Обрабатываются сутки (UTC), закончившиеся раньше чем
+    PORTALS_SEGMENT_DELAY_HOURS часов назад, начиная с самых старых
+    проверок всех порталов (или только portal_ids), по одним суткам
+    портала за транзакцию. Работа прекращается при достижении
+    deadline (time.monotonic()). Возвращает число перенесенных проверок.
+    """
+    boundary = segment_boundary()
+    compacted = 0
+    while not (deadline and time.monotonic() >= deadline):
+        count = compact_next(boundary, portal_ids)
+        if count is None:
+            break
+        compacted += count
+        if pause:
+            time.sleep(pause)
+
+    return compacted
+
+
+def is_sqlite():
+    """Проверяет, что используется SQLite."""
+    return connection.vendor == 'sqlite'
+
+
+def incremental_vacuum_enabled():
+    """
+    Проверяет, включен ли режим auto_vacuum=INCREMENTAL
+    (None, если БД не SQLite).
+    """
+    if not is_sqlite():
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        return cursor.fetchone()[0] == 2
+
+
+def enable_incremental_vacuum():
+    """
+    Включает режим auto_vacuum=INCREMENTAL для файла SQLite.
+
+    Смена режима требует однократного полного VACUUM, который
+    блокирует БД на время перестройки файла. Выполняется один раз,
+    дальше место возвращается через incremental_vacuum.
+    """
+    if not is_sqlite():
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] == 2:
+            return False
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+    return True
+
+
+def incremental_vacuum(pages=None):
+    """
+    Возвращает операционной системе до pages свободных страниц SQLite.
+
+    Работает только в режиме auto_vacuum=INCREMENTAL (см.
+    enable_incremental_vacuum), иначе место не возвращается и файл
+    не уменьшается; в отличие от VACUUM не перестраивает
+    файл целиком и не держит долгую блокировку.
+    Возвращает количество оставшихся свободных страниц или None.
+    """
+    if not is_sqlite():
+        return None
+
+    pages = pages or settings.PORTALS_VACUUM_PAGES
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] == 2:
+            # Модуль sqlite3 выполняет через execute() только первый шаг
+            # этой прагмы (одну страницу), executescript доводит ее до конца
+            connection.connection.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        cursor.execute('PRAGMA freelist_count')
+        return cursor.fetchone()[0]
@@ -0,0 +1,411 @@
+"""
+Модуль предагрегированной статистики доступности.
+Поддерживает почасовые и суточные агрегаты проверок в актуальном
+состоянии и собирает статистику за произвольный период из агрегатов,
+дочитывая сырые проверки только на неполных часах по краям периода.
+"""
+
+# Работа с датами и UTC
+from datetime import timedelta, timezone as dt_timezone
+
+# Настройки проекта, транзакции и агрегатные функции ORM
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, FloatField, JSONField, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import TruncDay, TruncHour
+
+# Модели проверок и агрегатов
+from .models import PHASE_FIELDS, PortalAvailability, PortalAvailabilityDaily, PortalAvailabilityHourly
+
+# Скетчи распределения времени ответа
+from .sketches import add_value, empty_sketch, merge_sketches
+
+# Проверки, перенесенные в сжатые сегменты
+from .segments import segment_rows
+
+
+def hour_start(value):
+    """Возвращает начало часа (UTC) для указанного момента."""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(value):
+    """Возвращает начало суток (UTC) для указанного момента."""
+    return hour_start(value).replace(hour=0)
+
+
+# Уровни агрегации: модель, функция округления и функция усечения в SQL
+ROLLUP_LEVELS = (
+    (PortalAvailabilityHourly, hour_start, TruncHour),
+    (PortalAvailabilityDaily, day_start, TruncDay),
+)
+
+# Длительность интервала агрегата каждого уровня
+BUCKET_SIZES = {
+    PortalAvailabilityHourly: timedelta(hours=1),
+    PortalAvailabilityDaily: timedelta(days=1),
+}
+
+
+
+def _raw_expressions():
+    """Агрегатные выражения по сырым проверкам для каждого поля агрегата."""
+    expressions = {
+        'checks_count': Count('id'),
+        'available_count': Count('id', filter=Q(is_available=True)),
+        'response_time_count': Count('response_time'),
+        'response_time_sum': Sum('response_time'),
+        'response_time_min': Min('response_time'),
+        'response_time_max': Max('response_time'),
+    }
+    for phase in PHASE_FIELDS:
+        expressions[f'{phase}_sum'] = Sum(phase)
+        expressions[f'{phase}_count'] = Count(phase)
+    return expressions
+
+
+# Выражения по сырым проверкам; ключи совпадают с полями агрегата
+RAW_EXPRESSIONS = _raw_expressions()
+
+# Поля агрегата, считаемые SQL-агрегатами по сырым проверкам
+ROLLUP_FIELDS = list(RAW_EXPRESSIONS)
+
+# Скетч распределения времени ответа: складывается в Python
+SKETCH_FIELD = 'response_time_sketch'
+
+# Выражения для объединения нескольких агрегатов в один
+ROLLUP_EXPRESSIONS = {
+    name: (
+        Min(name) if name.endswith('_min')
+        else Max(name) if name.endswith('_max')
+        else Sum(name)
+    )
+    for name in ROLLUP_FIELDS
+}
+
+
+def prefixed(expressions):
+    """
+    Переименовывает выражения с префиксом w_, чтобы имена аннотаций
+    не совпадали с полями моделей агрегатов.
+    """
+    return {f'w_{name}': expression for name, expression in expressions.items()}
+
+
+def unprefixed(row):
+    """Убирает префикс w_ из ключей строки результата."""
+    return {name[2:]: value for name, value in row.items() if name.startswith('w_')}
+
+
+def apply_checks(checks):
+    """
+    Добавляет сохраненные проверки в почасовые и суточные агрегаты.
+
+    Проверки группируются по (портал, интервал), существующие агрегаты
+    читаются одним запросом, затем обновляются через bulk_update,
+    а отсутствующие создаются через bulk_create. Вызывать нужно
+    в той же транзакции, в которой записаны сами проверки.
+    """
+    if not checks:
+        return
+
+    for model, floor, _ in ROLLUP_LEVELS:
+        groups = {}
+        for check in checks:
+            groups.setdefault((check.portal_id, floor(check.timestamp)), []).append(check)
+
+        existing = {
+            (row.portal_id, row.bucket): row
+            for row in model.objects.select_for_update().filter(
+                portal_id__in={key[0] for key in groups},
+                bucket__in={key[1] for key in groups},
+            )
+        }
+
+        to_create = []
+        to_update = []
+        for (portal_id, bucket), group in groups.items():
+            row = existing.get((portal_id, bucket))
+            if row is None:
+                row = model(portal_id=portal_id, bucket=bucket, **{SKETCH_FIELD: empty_sketch()})
+                to_create.append(row)
+            else:
+                to_update.append(row)
+
+            for check in group:
+                row.add_check(check)
+
+        if to_update:
+            model.objects.bulk_update(to_update, ROLLUP_FIELDS + [SKETCH_FIELD])
+        if to_create:
+            model.objects.bulk_create(to_create)
+
+
+def rebuild_portal_rollups(portal_id):
+    """
+    Пересчитывает агрегаты портала по сырым проверкам.
+
+    Затрагиваются только интервалы начиная с самой ранней сохраненной
+    проверки, поэтому агрегаты за период, сырые данные которого
+    уже удалены, сохраняются. Интервал, в который попадает самая
+    ранняя проверка, мог быть удален очисткой истории частично:
+    его агрегат пересчитывается, только если сохраненных проверок
+    в нем не меньше, чем уже учтено. Возвращает число созданных агрегатов.
+    """
+    checks = PortalAvailability.objects.filter(portal_id=portal_id)
+    first = checks.order_by('timestamp').values_list('timestamp', flat=True).first()
+    if first is None:
+        return 0
+
+    # Скетчи времени ответа строятся одним потоковым проходом
+    # по сырым проверкам сразу для всех уровней
+    sketches = {model: {} for model, _, _ in ROLLUP_LEVELS}
+    times = (
+        checks.filter(timestamp__gte=day_start(first), response_time__isnull=False)
+        .order_by()
+        .values_list('timestamp', 'response_time')
+    )
+    for timestamp, response_time in times.iterator(chunk_size=2000):
+        for model, floor, _ in ROLLUP_LEVELS:
+            add_value(sketches[model].setdefault(floor(timestamp), empty_sketch()), response_time)
+
+    created = 0
+    with transaction.atomic():
+        for model, floor, trunc in ROLLUP_LEVELS:
+            since = floor(first)
+            counted = (
+                model.objects.filter(portal_id=portal_id, bucket=since)
+                .values_list('checks_count', flat=True).first()
+            )
+            if counted is not None:
+                boundary = checks.filter(timestamp__gte=since, timestamp__lt=since + BUCKET_SIZES[model])
+                if boundary.count() < counted:
+                    since += BUCKET_SIZES[model]
+            model.objects.filter(portal_id=portal_id, bucket__gte=since).delete()
+
+            rows = (
+                checks.filter(timestamp__gte=since)
+                .annotate(period=trunc('timestamp', tzinfo=dt_timezone.utc))
+                .values('period')
+                .annotate(**prefixed(RAW_EXPRESSIONS))
+                .order_by('period')
+            )
+            objs = []
+            for row in rows:
+                values = unprefixed(row)
+                for name in ROLLUP_FIELDS:
+                    if name.endswith('_sum') and values[name] is None:
+                        values[name] = 0
+                values[SKETCH_FIELD] = sketches[model].get(row['period'], empty_sketch())
+                objs.append(model(portal_id=portal_id, bucket=row['period'], **values))
+            model.objects.bulk_create(objs, batch_size=500)
+            created += len(objs)
+
+    return created
+
+
+def split_window(start, end):
+    """
+    Делит период [start, end) на части для разных уровней хранения.
+
+    Возвращает словарь со списками интервалов:
+    - raw: неполные часы по краям периода (читаются из сырых проверок)
+    - hourly: полные часы вне полных суток
+    - daily: полные сутки (UTC)
+    Так количество читаемых строк почти не зависит от длины периода.
+    """
+    parts = {'raw': [], 'hourly': [], 'daily': []}
+
+    first_hour = hour_start(start)
+    if first_hour < start:
+        first_hour += timedelta(hours=1)
+    last_hour = hour_start(end)
+
+    if first_hour >= last_hour:
+        parts['raw'].append((start, end))
+        return parts
+
+    first_day = day_start(first_hour)
+    if first_day < first_hour:
+        first_day += timedelta(days=1)
+    last_day = day_start(last_hour)
+
+    parts['raw'] = [(lo, hi) for lo, hi in ((start, first_hour), (last_hour, end)) if lo < hi]
+
+    if first_day >= last_day:
+        parts['hourly'].append((first_hour, last_hour))
+    else:
+        parts['hourly'] = [
+            (lo, hi) for lo, hi in ((first_hour, first_day), (last_day, last_hour)) if lo < hi
+        ]
+        parts['daily'].append((first_day, last_day))
+
+    return parts
+
+
+def ranges_q(field, ranges):
+    """Строит Q-условие «поле попадает в один из интервалов [lo, hi)»."""
+    condition = Q()
+    for lo, hi in ranges:
+        condition |= Q(**{f'{field}__gte': lo, f'{field}__lt': hi})
+    return condition
+
+
+# Агрегатные выражения для каждого уровня хранения: сырые проверки
+# считаются напрямую, агрегаты суммируются
+WINDOW_FIELDS = {
+    'raw': (PortalAvailability, 'timestamp', RAW_EXPRESSIONS),
+    'hourly': (PortalAvailabilityHourly, 'bucket', ROLLUP_EXPRESSIONS),
+    'daily': (PortalAvailabilityDaily, 'bucket', ROLLUP_EXPRESSIONS),
+}
+
+
+def window_annotations(start, end, fields=None, portal_ref='pk'):
+    """
+    Строит подзапросы статистики за период для аннотации queryset порталов.
+
+    Для каждого уровня хранения (raw/hourly/daily), попадающего в период,
+    и каждого поля из fields возвращается коррелированный подзапрос
+    с именем вида '<уровень>_<поле>'. Так статистика за любой период
+    получается одним SQL-запросом к таблице порталов.
+    """
+    parts = split_window(start, end)
+    annotations = {}
+
+    for level, (model, field, expressions) in WINDOW_FIELDS.items():
+        if not parts[level]:
+            continue
+        for name, expression in expressions.items():
+            if fields is not None and name not in fields:
+                continue
+            annotations[f'{level}_{name}'] = Subquery(
+                model.objects
+                .filter(ranges_q(field, parts[level]), portal_id=OuterRef(portal_ref))
+                .order_by()
+                .values('portal_id')
+                .annotate(value=expression)
+                .values('value')
+            )
+
+    return annotations
+
+
+def empty_totals():
+    """Возвращает статистику без проверок (нули и пустые min/max)."""
+    return {
+        name: None if name.endswith(('_min', '_max')) else 0
+        for name in ROLLUP_FIELDS
+    }
+
+
+def merge_totals(totals, row):
+    """Добавляет к totals значения row: суммы складываются, min/max сравниваются."""
+    for name in ROLLUP_FIELDS:
+        value = row.get(name)
+        if value is None:
+            continue
+        if name.endswith('_min'):
+            totals[name] = value if totals[name] is None else min(totals[name], value)
+        elif name.endswith('_max'):
+            totals[name] = value if totals[name] is None else max(totals[name], value)
+        else:
+            totals[name] += value
+    return totals
+
+
+def merge_window_row(row):
+    """
+    Сводит значения подзапросов window_annotations по уровням
+    в итоговую статистику.
+    """
+    totals = empty_totals()
+    for level in WINDOW_FIELDS:
+        merge_totals(totals, {
+            name[len(level) + 1:]: value
+            for name, value in row.items() if name.startswith(f'{level}_')
+        })
+    return totals
+
+
+def aggregate_window(portal_id, start, end):
+    """
+    Возвращает суммарную статистику портала за период [start, end).
+
+    Результат — словарь с полями агрегата (ROLLUP_FIELDS): количество
+    проверок, доступных проверок, сумма/min/max времени ответа,
+    суммы и количества замеров по фазам запроса.
+    Агрегаты каждого уровня хранения объединяются через UNION ALL,
+    поэтому выполняется один SQL-запрос независимо от длины периода.
+    """
+    parts = split_window(start, end)
+    queries = [
+        model.objects
+        .filter(ranges_q(field, parts[level]), portal_id=portal_id)
+        .order_by()
+        .values('portal_id')
+        .annotate(**prefixed(expressions))
+        .values(*prefixed(expressions))
+        for level, (model, field, expressions) in WINDOW_FIELDS.items()
+        if parts[level]
+    ]
+
+    totals = empty_totals()
+    for row in queries[0].union(*queries[1:], all=True) if queries else ():
+        merge_totals(totals, unprefixed(row))
+
+    # Неполные часы по краям периода могли уже перейти в сегменты
+    if settings.PORTALS_SEGMENT_STORAGE and parts['raw']:
+        for _, is_available, response_time, _ in segment_rows(portal_id, parts['raw']):
+            merge_totals(totals, {
+                'checks_count': 1,
+                'available_count': int(is_available),
+                'response_time_count': int(response_time is not None),
+                'response_time_sum': response_time,
+                'response_time_min': response_time,
+                'response_time_max': response_time,
+            })
+    return totals
+
+
+def window_sketch(portal_id, start, end):
+    """
+    Возвращает скетч времени ответа портала за период [start, end).
+
+    Скетчи почасовых и суточных агрегатов и значения сырых проверок
+    на неполных часах по краям периода читаются одним запросом
+    (UNION ALL) и складываются; оба столбца заданы аннотациями,
+    чтобы их порядок в частях объединения совпадал. Поэтому перцентили за любой период
+    строятся из нескольких десятков строк.
+    """
+    parts = split_window(start, end)
+    queries = [
+        model.objects
+        .filter(ranges_q(field, parts[level]), portal_id=portal_id)
+        .order_by()
+        .annotate(value=Value(None, output_field=FloatField()), sketch=F(SKETCH_FIELD))
+        .values_list('value', 'sketch')
+        for level, (model, field, _) in WINDOW_FIELDS.items()
+        if level != 'raw' and parts[level]
+    ]
+    if parts['raw']:
+        queries.append(
+            PortalAvailability.objects
+            .filter(ranges_q('timestamp', parts['raw']), portal_id=portal_id, response_time__isnull=False)
+            .order_by()
+            .annotate(value=F('response_time'), sketch=Value(None, output_field=JSONField()))
+            .values_list('value', 'sketch')
+        )
+
+    sketch = empty_sketch()
+    sketches = []
+    for value, row_sketch in queries[0].union(*queries[1:], all=True) if queries else ():
+        if value is not None:
+            add_value(sketch, value)
+        elif row_sketch:
+            sketches.append(row_sketch)
+
+    if settings.PORTALS_SEGMENT_STORAGE and parts['raw']:
+        for _, _, response_time, _ in segment_rows(portal_id, parts['raw']):
+            if response_time is not None:
+                add_value(sketch, response_time)
+    return merge_sketches([sketch, *sketches])
@@ -0,0 +1,197 @@
+"""
+Модуль колоночного хранения истории проверок сегментами.
+Проверки портала за сутки (UTC) упаковываются в один сжатый блок:
+- время: миллисекунды первой проверки и разности между соседними (uint32)
+- доступность: битовый массив, 1 бит на проверку
+- время ответа: float32, NaN для неизвестного значения
+- HTTP-код: uint16, 0 для отсутствующего ответа
+Блок сжимается zlib. Вместо строки таблицы с индексами на каждую
+проверку получается несколько байт, а чтение суток истории -
+одна строка и распаковка массивов.
+
+Если установлен NumPy, массивы распаковываются векторно,
+иначе используется стандартный модуль array.
+"""
+
+# Упаковка заголовка и сжатие блока
+import struct
+import zlib
+
+# Порядок байт платформы
+import sys
+
+# Типизированные массивы стандартной библиотеки
+from array import array
+
+# Работа с датами и UTC
+from datetime import datetime, timezone as dt_timezone
+
+# NumPy необязателен: ускоряет распаковку длинных периодов
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Заголовок: сигнатура, версия формата, число проверок, время первой (мс)
+HEADER = struct.Struct('<4sBIq')
+MAGIC = b'PAS1'
+VERSION = 1
+
+
+def to_millis(value):
+    """Переводит datetime в миллисекунды от начала эпохи."""
+    return round(value.timestamp() * 1000)
+
+
+def from_millis(value):
+    """Переводит миллисекунды от начала эпохи в datetime (UTC)."""
+    return datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+
+
+def _little_endian(values):
+    """Приводит массив array к порядку байт little-endian."""
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def encode_segment(rows):
+    """
+    Упаковывает проверки в сжатый блок.
+
+    rows - последовательность (timestamp, is_available, response_time,
+    status_code), упорядоченная по времени.
+    """
+    rows = list(rows)
+    count = len(rows)
+    millis = [to_millis(row[0]) for row in rows]
+    first = millis[0] if rows else 0
+
+    deltas = array('I', (b - a for a, b in zip(millis, millis[1:])))
+    bits = bytearray((count + 7) // 8)
+    for i, row in enumerate(rows):
+        if row[1]:
+            bits[i >> 3] |= 1 << (i & 7)
+    times = array('f', (float('nan') if row[2] is None else row[2] for row in rows))
+    codes = array('H', (row[3] or 0 for row in rows))
+
+    payload = b''.join((
+        HEADER.pack(MAGIC, VERSION, count, first),
+        _little_endian(deltas).tobytes(),
+        bytes(bits),
+        _little_endian(times).tobytes(),
+        _little_endian(codes).tobytes(),
+    ))
+    return zlib.compress(payload, 6)
+
+
+def decode_segment(data):
+    """
+    Распаковывает блок в колонки.
+
+    Возвращает словарь массивов одинаковой длины: 'timestamp'
+    (миллисекунды), 'is_available' (0/1), 'response_time' (NaN - нет
+    значения), 'status_code' (0 - нет ответа). С NumPy значения -
+    массивы numpy, без него - списки.
+    """
+    payload = zlib.decompress(bytes(data))
+    magic, version, count, first = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Неизвестный формат сегмента')
+
+    offset = HEADER.size
+    sizes = {
+        'deltas': 4 * max(count - 1, 0),
+        'bits': (count + 7) // 8,
+        'times': 4 * count,
+        'codes': 2 * count,
+    }
+    chunks = {}
+    for name, size in sizes.items():
+        chunks[name] = payload[offset:offset + size]
+        offset += size
+
+    if np is not None:
+        timestamps = np.empty(count, dtype=np.int64)
+        if count:
+            timestamps[0] = first
+            timestamps[1:] = first + np.cumsum(np.frombuffer(chunks['deltas'], dtype='<u4'), dtype=np.int64)
+        return {
+            'timestamp': timestamps,
+            'is_available': np.unpackbits(
+                np.frombuffer(chunks['bits'], dtype=np.uint8), bitorder='little'
+            )[:count],
+            'response_time': np.frombuffer(chunks['times'], dtype='<f4').astype(np.float64),
+            'status_code': np.frombuffer(chunks['codes'], dtype='<u2').astype(np.int64),
+        }
+
+    deltas = _little_endian(array('I', chunks['deltas']))
+    timestamps = [first] * count
+    for i, delta in enumerate(deltas, start=1):
+        timestamps[i] = timestamps[i - 1] + delta
+    bits = chunks['bits']
+    return {
+        'timestamp': timestamps,
+        'is_available': [(bits[i >> 3] >> (i & 7)) & 1 for i in range(count)],
+        'response_time': list(_little_endian(array('f', chunks['times']))),
+        'status_code': list(_little_endian(array('H', chunks['codes']))),
+    }
+
+
+def iter_rows(columns):
+    """
+    Возвращает проверки сегмента как кортежи (timestamp, is_available,
+    response_time, status_code) с пустыми значениями вместо NaN и 0.
+    """
+    for millis, available, response_time, status_code in zip(
+        columns['timestamp'], columns['is_available'], columns['response_time'], columns['status_code']
+    ):
+        yield (
+            from_millis(int(millis)),
+            bool(available),
+            None if response_time != response_time else round(float(response_time), 2),
+            int(status_code) or None,
+        )
+
+
+def segment_rows(portal_id, ranges):
+    """
+    Возвращает проверки из сегментов портала, попадающие в интервалы
+    ranges [(lo, hi), ...], упорядоченные по времени.
+
+    Сегменты, пересекающие интервалы, читаются одним запросом;
+    значения фильтруются по времени на распакованных массивах.
+    """
+    from django.db.models import Q
+    from .models import PortalAvailabilitySegment
+
+    if not ranges:
+        return []
+
+    condition = Q()
+    for lo, hi in ranges:
+        condition |= Q(start__lt=hi, end__gt=lo)
+    segments = (
+        PortalAvailabilitySegment.objects
+        .filter(condition, portal_id=portal_id)
+        .order_by('start')
+        .values_list('data', flat=True)
+    )
+
+    bounds = [(to_millis(lo), to_millis(hi)) for lo, hi in ranges]
+    rows = []
+    for data in segments:
+        columns = decode_segment(data)
+        if np is not None:
+            mask = np.zeros(len(columns['timestamp']), dtype=bool)
+            for lo, hi in bounds:
+                mask |= (columns['timestamp'] >= lo) & (columns['timestamp'] < hi)
+            columns = {name: values[mask] for name, values in columns.items()}
+            rows.extend(iter_rows(columns))
+        else:
+            rows.extend(
+                row for row, millis in zip(iter_rows(columns), columns['timestamp'])
+                if any(lo <= millis < hi for lo, hi in bounds)
+            )
+    return rows
@@ -4,8 +4,14 @@
 и получения статистики.
 """
 
-# Библиотека для выполнения HTTP-запросов
-import requests
+# Общий HTTP-клиент с пулом keep-alive соединений
+from . import http_client
+
+# Монотонные часы для окон пакетной записи
+import time
+
+# Хэширование содержимого favicon для дедупликации
+import hashlib
 
 # Функция для разбора URL на компоненты
 from urllib.parse import urlparse
@@ -70,9 +76,8 @@ def fetch_favicon(url):
     
     for favicon_url in favicon_urls:
         try:
-            response = requests.get(
-                favicon_url, 
-                timeout=10, 
+            response = http_client.get(
+                favicon_url,
                 headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
                 allow_redirects=True
             )
@@ -94,63 +99,572 @@ def fetch_favicon(url):
     return None
 
 
-def check_portal_availability(portal):
+def get_favicon_domain(url):
+    """Возвращает ключ кэша favicon: домен (netloc) в нижнем регистре."""
+    return urlparse(url).netloc.lower()
+
+
+# Каталог общих файлов favicon, именованных хэшем содержимого
+SHARED_FAVICON_DIR = 'favicons/shared'
+
+# Сколько секунд новый общий файл не удаляется очисткой: он мог быть
+# только что сохранен, а ссылка на него еще не записана в БД
+SHARED_FAVICON_GRACE = 3600
+
+
+def store_favicon(content):
     """
-    Проверяет доступность портала выполнением HTTP-запроса.
+    Сохраняет байты иконки в общее хранилище с дедупликацией.
     
-    Сохраняет результат проверки в БД и возвращает словарь:
+    Имя файла — SHA-256 содержимого, поэтому одинаковые иконки
+    разных доменов записываются на диск один раз.
+    Возвращает (хэш, путь в хранилище).
+    """
+    from django.core.files.storage import default_storage
+    
+    content_hash = hashlib.sha256(content).hexdigest()
+    path = f'{SHARED_FAVICON_DIR}/{content_hash[:2]}/{content_hash}.png'
+    
+    if not default_storage.exists(path):
+        path = default_storage.save(path, ContentFile(content))
+    
+    return content_hash, path
+
+
+def update_portal_favicon(portal):
+    """
+    Назначает порталу favicon из общего кэша по домену.
+    
+    При попадании в кэш (в том числе отрицательном) сетевые запросы
+    не выполняются; иначе иконка загружается через fetch_favicon,
+    сохраняется с дедупликацией по хэшу и запоминается для домена.
+    Возвращает True если у портала есть иконка.
+    """
+    from django.conf import settings
+    from django.utils import timezone
+    from datetime import timedelta
+    from .models import DomainFavicon
+    
+    domain = get_favicon_domain(portal.url)
+    entry = DomainFavicon.objects.filter(domain=domain).first()
+    now = timezone.now()
+    # Общие файлы, на которые могли перестать ссылаться домен и портал
+    replaced = set()
+    
+    if entry is not None:
+        max_age = (
+            timedelta(days=settings.PORTALS_FAVICON_MAX_AGE_DAYS) if entry.path
+            else timedelta(hours=settings.PORTALS_FAVICON_MISS_TTL_HOURS)
+        )
+        if entry.fetched_at < now - max_age:
+            replaced.add(entry.path)
+            entry = None
+    
+    if entry is None:
+        favicon_file = fetch_favicon(portal.url)
+        content_hash, path = store_favicon(favicon_file.read()) if favicon_file else ('', '')
+        entry, _ = DomainFavicon.objects.update_or_create(
+            domain=domain,
+            defaults={'content_hash': content_hash, 'path': path, 'fetched_at': now}
+        )
+    
+    if (portal.favicon.name or '') != entry.path:
+        replaced.add(portal.favicon.name)
+        release_favicon(portal)
+        portal.favicon.name = entry.path or None
+        portal.save(update_fields=['favicon'])
+    
+    for path in replaced - {entry.path}:
+        release_shared_favicon(path)
+    
+    return bool(entry.path)
+
+
+def release_shared_favicon(path):
+    """
+    Удаляет общий файл favicon, если на него больше не ссылаются
+    ни кэш доменов, ни порталы.
+    
+    Возвращает True если файл удален.
+    """
+    from django.core.files.storage import default_storage
+    from .models import DomainFavicon, Portal
+    
+    if not path or not path.startswith(f'{SHARED_FAVICON_DIR}/'):
+        return False
+    if DomainFavicon.objects.filter(path=path).exists() or Portal.objects.filter(favicon=path).exists():
+        return False
+    
+    try:
+        default_storage.delete(path)
+    except Exception:
+        return False  # Файл удалит следующая очистка prune_shared_favicons
+    return True
+
+
+def prune_shared_favicons(grace=SHARED_FAVICON_GRACE):
+    """
+    Удаляет общие файлы favicon, на которые не ссылаются
+    ни кэш доменов, ни порталы.
+    
+    Подбирает файлы, оставшиеся после удаления записей DomainFavicon
+    и неудачных release_shared_favicon. Файлы моложе grace секунд
+    пропускаются. Возвращает количество удаленных файлов.
+    """
+    from django.core.files.storage import default_storage
+    from django.utils import timezone
+    from datetime import timedelta
+    from .models import DomainFavicon, Portal
+    
+    referenced = set(DomainFavicon.objects.exclude(path='').values_list('path', flat=True))
+    referenced.update(
+        Portal.objects.filter(favicon__startswith=f'{SHARED_FAVICON_DIR}/').values_list('favicon', flat=True)
+    )
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    
+    try:
+        directories, _ = default_storage.listdir(SHARED_FAVICON_DIR)
+    except FileNotFoundError:
+        return 0
+    
+    deleted = 0
+    for directory in directories:
+        _, files = default_storage.listdir(f'{SHARED_FAVICON_DIR}/{directory}')
+        for name in files:
+            path = f'{SHARED_FAVICON_DIR}/{directory}/{name}'
+            if path in referenced or default_storage.get_modified_time(path) > cutoff:
+                continue
+            default_storage.delete(path)
+            deleted += 1
+    return deleted
+
+
+def release_favicon(portal):
+    """
+    Удаляет собственный файл favicon портала.
+    
+    Общие файлы из SHARED_FAVICON_DIR не удаляются:
+    на них могут ссылаться другие порталы и кэш доменов
+    (см. release_shared_favicon и prune_shared_favicons).
+    """
+    name = portal.favicon.name
+    if not name or name.startswith(f'{SHARED_FAVICON_DIR}/'):
+        return
+    
+    try:
+        portal.favicon.delete(save=False)
+    except Exception:
+        pass  # Игнорируем ошибки удаления файла
+
+
+# Коды ответа на HEAD, после которых проверка повторяется через GET
+HEAD_FALLBACK_STATUSES = {405, 501}
+
+
+def read_limited(response, max_bytes, drain_bytes=None):
+    """
+    Читает не более max_bytes байт тела ответа в потоковом режиме.
+    
+    Остаток тела не длиннее drain_bytes (PORTALS_PROBE_DRAIN_BYTES)
+    дочитывается и отбрасывается, чтобы соединение вернулось в пул
+    keep-alive. Если остаток больше (по Content-Length или по факту
+    чтения), соединение закрывается, чтобы не скачивать его.
+    Возвращает количество прочитанных байт в пределах max_bytes.
+    """
+    if drain_bytes is None:
+        from django.conf import settings
+        drain_bytes = settings.PORTALS_PROBE_DRAIN_BYTES
+    
+    # Ответ на HEAD не имеет тела независимо от Content-Length
+    if response.request is not None and response.request.method == 'HEAD':
+        length = 0
+    else:
+        try:
+            length = int(response.headers['Content-Length'])
+        except (KeyError, ValueError):
+            length = None  # chunked или до закрытия соединения
+    
+    draining = length is None or length - max_bytes <= drain_bytes
+    limit = max_bytes + drain_bytes if draining else max_bytes
+    
+    read = 0
+    if limit > 0 or draining:
+        for chunk in response.iter_content(chunk_size=min(max(limit, 1), 16384)):
+            read += len(chunk)
+            if read > limit or (read >= limit and not draining):
+                break
+    # Полностью прочитанный ответ возвращает соединение в пул, иначе оно закрывается
+    response.close()
+    return min(read, max_bytes)
+
+
+def probe_url(url, max_bytes=None, head_first=None):
+    """
+    Выполняет HTTP-запрос к URL и возвращает результат проверки.
+    
+    Ответ читается потоково: после заголовков загружается не более
+    max_bytes байт тела (PORTALS_PROBE_MAX_BYTES, 0 - только заголовки);
+    небольшой остаток дочитывается, чтобы сохранить keep-alive соединение.
+    При head_first (PORTALS_PROBE_HEAD_FIRST) сначала отправляется HEAD,
+    а GET - только если сервер не поддерживает HEAD или вернул 5xx.
+    
+    В отличие от check_portal_availability ничего не пишет в БД,
+    поэтому безопасна для вызова из рабочих потоков монитора.
+    Возвращает словарь:
     - is_available: доступен ли портал
-    - response_time: время ответа в мс
+    - response_time: время до получения заголовков в мс
+    - dns_time, connect_time, tls_time: фазы установки соединения в мс
+      (None, если использовано keep-alive соединение из пула)
+    - ttfb: ожидание первого байта после установки соединения в мс
+    - total_time: полное время проверки в мс (редиректы и чтение тела)
+    - body_bytes: сколько байт тела прочитано
     - status_code: HTTP код ответа
     """
-    # Импортируем модель здесь для избежания циклических импортов
-    from .models import PortalAvailability
+    from django.conf import settings
+    
+    if max_bytes is None:
+        max_bytes = settings.PORTALS_PROBE_MAX_BYTES
+    if head_first is None:
+        head_first = settings.PORTALS_PROBE_HEAD_FIRST
+    
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    started = time.perf_counter()
     
     try:
-        response = requests.get(
-            portal.url,
-            timeout=10,
-            allow_redirects=True,
-            headers={'User-Agent': 'Mozilla/5.0'}
-        )
+        response = None
+        if head_first:
+            response = http_client.request(
+                'HEAD', url, allow_redirects=True, stream=True, headers=headers
+            )
+            if response.status_code in HEAD_FALLBACK_STATUSES or response.status_code >= 500:
+                response.close()
+                response = None
         
-        # Считаем доступным если статус меньше 500 (серверных ошибок)
-        is_available = response.status_code < 500
+        if response is None:
+            response = http_client.get(url, allow_redirects=True, stream=True, headers=headers)
+        
+        # elapsed в потоковом режиме - время до получения заголовков
         response_time = response.elapsed.total_seconds() * 1000  # в миллисекундах
         
-        # Сохраняем результат проверки в БД
-        PortalAvailability.objects.create(
-            portal=portal,
-            is_available=is_available,
-            response_time=round(response_time, 2),
-            status_code=response.status_code
-        )
+        # Фазы установки соединения (пусто для keep-alive соединения)
+        phases = http_client.pop_phase_timings(response)
+        setup_time = sum(phases.values())
+        
+        body_bytes = read_limited(response, max_bytes)
+        total_time = (time.perf_counter() - started) * 1000
+        
+        # Считаем доступным если статус меньше 500 (серверных ошибок)
+        is_available = response.status_code < 500
         
         return {
             'success': True,
             'is_available': is_available,
             'response_time': response_time,
+            'dns_time': phases.get('dns_time'),
+            'connect_time': phases.get('connect_time'),
+            'tls_time': phases.get('tls_time'),
+            'ttfb': max(0.0, response_time - setup_time),
+            'total_time': total_time,
+            'body_bytes': body_bytes,
             'status_code': response.status_code
         }
     except Exception as e:
         # Портал недоступен (таймаут, ошибка DNS и т.д.)
-        PortalAvailability.objects.create(
-            portal=portal,
-            is_available=False,
-            response_time=None,
-            status_code=None
-        )
-        
         return {
             'success': True,
             'is_available': False,
             'response_time': None,
+            'dns_time': None,
+            'connect_time': None,
+            'tls_time': None,
+            'ttfb': None,
+            'total_time': (time.perf_counter() - started) * 1000,
+            'body_bytes': 0,
             'status_code': None,
             'error': str(e)
         }
 
 
-def get_availability_stats(portal, days=7):
+def build_check(portal, result):
+    """
+    Создает несохраненную запись PortalAvailability по результату probe_url.
+    
+    Время проверки фиксируется в момент вызова, а не в момент
+    записи в БД, поэтому отложенная пакетная запись его не искажает.
+    """
+    # Импортируем модель здесь для избежания циклических импортов
+    from .models import PortalAvailability, PHASE_FIELDS
+    from django.utils import timezone
+    
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+    
+    return PortalAvailability(
+        portal=portal,
+        timestamp=timezone.now(),
+        is_available=result['is_available'],
+        response_time=rounded(result.get('response_time')),
+        status_code=result.get('status_code'),
+        **{phase: rounded(result.get(phase)) for phase in PHASE_FIELDS}
+    )
+
+
+def save_check_result(portal, result):
+    """
+    Сохраняет результат проверки, полученный от probe_url, в БД.
+    
+    Возвращает созданную запись PortalAvailability.
+    """
+    from django.db import transaction
+    from .rollups import apply_checks
+    
+    check = build_check(portal, result)
+    with transaction.atomic():
+        check.save()
+        apply_checks([check])
+        transaction.on_commit(lambda: publish_checks_written([portal.user_id]))
+    return check
+
+
+def checks_written_key(user_id):
+    """Ключ кэша с меткой последней записи проверок пользователя (см. portals/stream.py)."""
+    return f'portals:checks_written:{user_id}'
+
+
+def publish_checks_written(user_ids):
+    """
+    Обновляет в кэше метки последней записи проверок пользователей.
+
+    Поток SSE сравнивает метку своего пользователя с прочитанной
+    ранее и обращается к БД только после ее изменения, поэтому
+    вкладки пользователей, чьи порталы не проверялись, не создают
+    запросов к БД.
+    """
+    from django.core.cache import cache
+    
+    marker = time.time()
+    cache.set_many({checks_written_key(user_id): marker for user_id in user_ids}, None)
+
+
+class CheckResultWriter:
+    """
+    Пакетная запись результатов проверок в БД.
+    
+    Накапливает записи PortalAvailability и сбрасывает их через
+    bulk_create одной транзакцией вместе с обновлением агрегатов, когда набирается batch_size записей
+    или с момента предыдущего сброса прошло flush_interval секунд.
+    Вместо тысяч отдельных INSERT (и fsync в SQLite) за цикл
+    монитора выполняется несколько коротких транзакций.
+    
+    Используется как контекстный менеджер: при выходе
+    оставшиеся записи сбрасываются автоматически.
+    """
+    
+    # Сколько пачек хранить в очереди, пока запись в БД не удается
+    MAX_PENDING_BATCHES = 10
+    
+    def __init__(self, batch_size=None, flush_interval=None):
+        from django.conf import settings
+        
+        self.batch_size = batch_size or settings.PORTALS_WRITE_BATCH_SIZE
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else settings.PORTALS_WRITE_FLUSH_INTERVAL
+        )
+        self.pending = []
+        self.written = 0
+        self._last_flush = time.monotonic()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+    
+    def add(self, portal, result, flush=True):
+        """
+        Добавляет результат проверки в очередь на запись.
+        
+        При flush=False очередь не сбрасывается: вызывающий код
+        сам вызывает flush_if_due и отдельно обрабатывает ошибки записи.
+        """
+        self.pending.append(build_check(portal, result))
+        
+        if flush:
+            self.flush_if_due()
+    
+    def flush_if_due(self):
+        """Сбрасывает очередь, если набралась пачка или истекло окно flush_interval."""
+        if len(self.pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            return self.flush()
+        return 0
+    
+    def flush(self):
+        """
+        Записывает накопленные результаты одной транзакцией.
+        
+        Результаты порталов, удаленных после проверки, отбрасываются,
+        чтобы одна запись не откатывала всю пачку. Если транзакция
+        все же не удалась, пачка возвращается в очередь (не более
+        MAX_PENDING_BATCHES пачек, старые записи отбрасываются),
+        а исключение передается вызывающему коду.
+        """
+        from django.db import transaction
+        from .models import Portal, PortalAvailability
+        from .rollups import apply_checks
+        
+        self._last_flush = time.monotonic()
+        if not self.pending:
+            return 0
+        
+        checks, self.pending = self.pending, []
+        try:
+            with transaction.atomic():
+                existing = set(
+                    Portal.objects
+                    .filter(id__in={check.portal_id for check in checks})
+                    .values_list('id', flat=True)
+                )
+                saved = [check for check in checks if check.portal_id in existing]
+                PortalAvailability.objects.bulk_create(saved, batch_size=self.batch_size)
+                apply_checks(saved)
+                user_ids = {check.portal.user_id for check in saved}
+                transaction.on_commit(lambda: publish_checks_written(user_ids))
+        except Exception:
+            for check in checks:
+                check.pk = None
+                check._state.adding = True
+            limit = self.batch_size * self.MAX_PENDING_BATCHES
+            self.pending = (checks + self.pending)[-limit:]
+            raise
+        
+        self.written += len(saved)
+        return len(saved)
+
+
+def check_portal_availability(portal):
+    """
+    Проверяет доступность портала выполнением HTTP-запроса.
+    
+    Сохраняет результат проверки в БД и возвращает словарь:
+    - is_available: доступен ли портал
+    - response_time: время ответа в мс
+    - status_code: HTTP код ответа
+    """
+    result = probe_url(portal.url)
+    save_check_result(portal, result)
+    return result
+
+
+# Детализация графика от подробной к грубой
+CHART_RESOLUTIONS = ('raw', 'hour', 'day')
+
+
+def merge_chart_points(points, max_points):
+    """
+    Объединяет соседние интервалы графика, пока их не станет
+    не больше max_points. Нужно только для очень длинных периодов,
+    когда даже суточных интервалов больше max_points.
+    """
+    if len(points) <= max_points:
+        return points
+
+    size = -(-len(points) // max_points)
+    merged = []
+    for i in range(0, len(points), size):
+        group = points[i:i + size]
+        rt_count = sum(point[3] for point in group)
+        mins = [point[5] for point in group if point[5] is not None]
+        maxs = [point[6] for point in group if point[6] is not None]
+        merged.append((
+            group[0][0],
+            sum(point[1] for point in group),
+            sum(point[2] for point in group),
+            rt_count,
+            sum(point[4] or 0 for point in group),
+            min(mins) if mins else None,
+            max(maxs) if maxs else None,
+        ))
+    return merged
+
+
+def get_chart_data(portal, start_date, end_date, checks_count, resolution=None, max_points=None):
+    """
+    Возвращает пару (детализация, точки графика) за период.
+
+    resolution — самая подробная допустимая детализация: 'raw'
+    (каждая проверка), 'hour' или 'day'; None означает 'raw'.
+    Если при ней точек было бы больше max_points
+    (по умолчанию и не более PORTALS_CHART_MAX_POINTS), выбирается более грубая.
+    Интервалы читаются из почасовых и суточных агрегатов одним запросом
+    и содержат процент доступности, min/среднее/max времени ответа,
+    поэтому размер ответа ограничен при любой длине периода.
+    """
+    from django.conf import settings
+    from .models import PortalAvailabilityDaily, PortalAvailabilityHourly
+    from .rollups import day_start, hour_start
+
+    max_points = min(max_points or settings.PORTALS_CHART_MAX_POINTS, settings.PORTALS_CHART_MAX_POINTS)
+    hours = (end_date - start_date).total_seconds() / 3600
+    estimates = {'raw': checks_count, 'hour': hours + 1, 'day': hours / 24 + 1}
+
+    levels = CHART_RESOLUTIONS[CHART_RESOLUTIONS.index(resolution or 'raw'):]
+    resolution = next((level for level in levels if estimates[level] <= max_points), 'day')
+
+    if resolution == 'raw':
+        # Один потоковый проход по нужным колонкам без создания экземпляров моделей
+        points = portal.availability_checks.filter(
+            timestamp__gte=start_date,
+            timestamp__lte=end_date
+        ).order_by('timestamp').values_list('timestamp', 'is_available', 'response_time')
+        
+        points = points.iterator(chunk_size=2000)
+        
+        # Проверки завершенных суток могли быть перенесены в сегменты
+        if settings.PORTALS_SEGMENT_STORAGE:
+            from .segments import segment_rows
+            
+            stored = [row[:3] for row in segment_rows(portal.id, [(start_date, end_date)])]
+            points = sorted([*stored, *points], key=lambda point: point[0])
+        
+        return resolution, [
+            {
+                'timestamp': timestamp.isoformat(),
+                'is_available': is_available,
+                'response_time': response_time
+            }
+            for timestamp, is_available, response_time in points
+        ]
+
+    model, floor = (
+        (PortalAvailabilityHourly, hour_start) if resolution == 'hour'
+        else (PortalAvailabilityDaily, day_start)
+    )
+    rows = model.objects.filter(
+        portal=portal,
+        bucket__gte=floor(start_date),
+        bucket__lte=end_date
+    ).order_by('bucket').values_list(
+        'bucket', 'checks_count', 'available_count', 'response_time_count',
+        'response_time_sum', 'response_time_min', 'response_time_max',
+    )
+
+    return resolution, [
+        {
+            'timestamp': bucket.isoformat(),
+            'is_available': available == checks,
+            'uptime_percentage': round(available / checks * 100, 1) if checks else None,
+            'checks_count': checks,
+            'response_time': round(rt_sum / rt_count, 2) if rt_count else None,
+            'response_time_min': rt_min,
+            'response_time_max': rt_max,
+        }
+        for bucket, checks, available, rt_count, rt_sum, rt_min, rt_max
+        in merge_chart_points(list(rows), max_points)
+    ]
+
+
+def get_availability_stats(portal, days=7, resolution=None, max_points=None):
     """
     Получает статистику доступности портала за указанный период.
     
@@ -158,49 +672,60 @@ def get_availability_stats(portal, days=7):
     - uptime_percentage: процент времени доступности
     - avg_response_time: среднее время ответа
     - checks_count: общее количество проверок
-    - chart_data: данные для построения графика
+    - phase_averages: среднее время фаз запроса (DNS, подключение, TLS,
+      ожидание первого байта, полное время)
+    - response_time_percentiles: p50/p90/p95/p99 времени ответа
+      по скетчам агрегатов (погрешность около 1%)
+    - resolution: детализация графика ('raw', 'hour' или 'day')
+    - chart_data: данные для построения графика, не более max_points
+      точек (см. get_chart_data)
     """
     # Импорты для работы с датами
     from django.utils import timezone
     from datetime import timedelta
+    from .models import PHASE_FIELDS
+    from .rollups import aggregate_window, window_sketch
+    from .sketches import PERCENTILES, percentiles
     
     end_date = timezone.now()
     start_date = end_date - timedelta(days=days)
     
-    # Получаем все проверки за период
-    checks = portal.availability_checks.filter(
-        timestamp__gte=start_date,
-        timestamp__lte=end_date
-    ).order_by('timestamp')
+    # Суммарные показатели берем из агрегатов (см. portals/rollups.py)
+    totals = aggregate_window(portal.id, start_date, end_date)
     
     # Если проверок нет - возвращаем пустую статистику
-    if not checks.exists():
+    if not totals['checks_count']:
         return {
             'uptime_percentage': None,
             'avg_response_time': None,
             'checks_count': 0,
             'available_count': 0,
             'unavailable_count': 0,
+            'phase_averages': {phase: None for phase in PHASE_FIELDS},
+            'response_time_percentiles': {f'p{point}': None for point in PERCENTILES},
+            'resolution': resolution or 'raw',
             'chart_data': []
         }
     
     # Подсчет успешных и неуспешных проверок
-    available_count = checks.filter(is_available=True).count()
-    unavailable_count = checks.filter(is_available=False).count()
-    total_count = checks.count()
-    
-    # Вычисляем среднее время ответа (только для успешных проверок)
-    response_times = [c.response_time for c in checks if c.response_time is not None]
-    avg_response_time = sum(response_times) / len(response_times) if response_times else None
-    
-    # Данные для графика
-    chart_data = []
-    for check in checks:
-        chart_data.append({
-            'timestamp': check.timestamp.isoformat(),
-            'is_available': check.is_available,
-            'response_time': check.response_time
-        })
+    available_count = totals['available_count']
+    total_count = totals['checks_count']
+    unavailable_count = total_count - available_count
+    
+    # Среднее время ответа (только для проверок с известным временем)
+    avg_response_time = (
+        totals['response_time_sum'] / totals['response_time_count']
+        if totals['response_time_count'] else None
+    )
+    
+    # Перцентили времени ответа из скетчей агрегатов
+    response_time_percentiles = percentiles(window_sketch(portal.id, start_date, end_date))
+    
+    # Данные для графика: сырые проверки или интервалы из агрегатов
+    resolution, chart_data = get_chart_data(
+        portal, start_date, end_date, total_count,
+        resolution=resolution, max_points=max_points,
+    )
     
     return {
         'uptime_percentage': round((available_count / total_count) * 100, 1) if total_count > 0 else 0,
@@ -208,5 +733,223 @@ def get_availability_stats(portal, days=7):
         'checks_count': total_count,
         'available_count': available_count,
         'unavailable_count': unavailable_count,
+        'phase_averages': {
+            phase: (
+                round(totals[f'{phase}_sum'] / totals[f'{phase}_count'], 2)
+                if totals[f'{phase}_count'] else None
+            )
+            for phase in PHASE_FIELDS
+        },
+        'response_time_percentiles': response_time_percentiles,
+        'resolution': resolution,
         'chart_data': chart_data
     }
+
+
+def next_position(user):
+    """Возвращает позицию для нового портала пользователя (в конце списка)."""
+    from django.db.models import Max
+    from .models import Portal
+    
+    last = Portal.objects.filter(user=user).aggregate(last=Max('position'))['last']
+    return 0 if last is None else last + Portal.POSITION_STEP
+
+
+def reorder_portals(user, portal_ids):
+    """
+    Расставляет порталы пользователя в порядке portal_ids.
+    
+    Владение проверяется одним запросом: если среди id есть чужие
+    или несуществующие, вызывается Portal.DoesNotExist и ничего
+    не меняется. Позиции назначаются с шагом Portal.POSITION_STEP
+    и записываются одним UPDATE (CASE) в одной транзакции;
+    порталы, позиция которых не изменилась, не обновляются.
+    Возвращает количество обновленных порталов.
+    """
+    from django.db import transaction
+    from .models import Portal
+    
+    portal_ids = [int(portal_id) for portal_id in portal_ids]
+    with transaction.atomic():
+        current = dict(
+            Portal.objects.filter(user=user, id__in=portal_ids).values_list('id', 'position')
+        )
+        if len(current) != len(set(portal_ids)):
+            raise Portal.DoesNotExist('Портал не найден')
+        
+        changed = [
+            Portal(id=portal_id, position=index * Portal.POSITION_STEP)
+            for index, portal_id in enumerate(portal_ids)
+            if current[portal_id] != index * Portal.POSITION_STEP
+        ]
+        Portal.objects.bulk_update(changed, ['position'], batch_size=500)
+    return len(changed)
+
+
+def move_portal(user, portal_id, after_id=None, before_id=None):
+    """
+    Перемещает портал между соседями after_id и before_id.
+    
+    Место определяется по текущему порядку порталов в БД: сразу
+    после after_id и/или сразу перед before_id. Если указаны оба
+    соседа, они должны идти в списке подряд и в этом порядке, иначе
+    вызывается ValueError. Новая позиция берется из промежутка между
+    позициями соседей (или на шаг Portal.POSITION_STEP за крайним),
+    поэтому перетаскивание одной карточки обновляет одну строку.
+    Если свободного значения в промежутке нет, порталы пользователя
+    перенумеровываются с исходным шагом одним UPDATE (reorder_portals).
+    Возвращает количество обновленных порталов.
+    """
+    from django.db import transaction
+    from .models import Portal
+    
+    portal_id = int(portal_id)
+    after_id = int(after_id) if after_id is not None else None
+    before_id = int(before_id) if before_id is not None else None
+    if portal_id in (after_id, before_id):
+        raise ValueError('Портал не может быть своим соседом')
+    
+    with transaction.atomic():
+        order = list(
+            Portal.objects.filter(user=user).order_by('position', '-created_at').values_list('id', 'position')
+        )
+        ids = [row[0] for row in order]
+        if any(i is not None and i not in ids for i in (portal_id, after_id, before_id)):
+            raise Portal.DoesNotExist('Портал не найден')
+        
+        current = dict(order)[portal_id]
+        order = [row for row in order if row[0] != portal_id]
+        ids.remove(portal_id)
+        
+        if after_id is None and before_id is None:
+            return 0
+        index = ids.index(after_id) + 1 if after_id is not None else ids.index(before_id)
+        if before_id is not None and ids.index(before_id) != index:
+            raise ValueError('Соседи портала должны идти подряд: after_id, затем before_id')
+        
+        low = order[index - 1][1] if index > 0 else None
+        high = order[index][1] if index < len(order) else None
+        if low is None:
+            position = high - Portal.POSITION_STEP
+        elif high is None:
+            position = low + Portal.POSITION_STEP
+        elif high - low > 1:
+            position = (low + high) // 2
+        else:
+            # Промежуток исчерпан - перенумеровываем все порталы пользователя
+            ids.insert(index, portal_id)
+            return reorder_portals(user, ids)
+        
+        if position == current:
+            return 0
+        return Portal.objects.filter(id=portal_id).update(position=position)
+
+
+def grid_version_key(user_id):
+    """Ключ кэша с версией сетки порталов пользователя."""
+    return f'portals:grid_version:{user_id}'
+
+
+def get_grid_version(user_id):
+    """
+    Возвращает версию сетки порталов пользователя для {% cache %}.
+
+    Версия входит в ключ кэшированного фрагмента dashboard.html:
+    пока она не меняется, страница отдается без запроса порталов
+    и без рендеринга карточек.
+    """
+    from django.core.cache import cache
+    
+    return cache.get_or_set(grid_version_key(user_id), time.time_ns, None)
+
+
+def bump_grid_version(user_id):
+    """
+    Меняет версию сетки порталов пользователя.
+
+    Вызывается при создании, изменении, удалении и перестановке
+    порталов и после загрузки favicon. Версия - время в наносекундах,
+    поэтому даже после вытеснения ключа из кэша она не повторится.
+    """
+    from django.core.cache import cache
+    
+    cache.set(grid_version_key(user_id), time.time_ns(), None)
+
+
+def get_stats_version(portal):
+    """
+    Возвращает (id, время) последней записанной проверки портала
+    или (None, None), если проверок нет.
+
+    Используется как версия статистики: любая новая проверка
+    получает больший id, поэтому меняет ETag и ключ кэша.
+    """
+    latest = portal.availability_checks.order_by('-id').values_list('id', 'timestamp').first()
+    return latest or (None, None)
+
+
+def get_cached_availability_stats(portal, version, days=7, resolution=None, max_points=None):
+    """
+    Возвращает get_availability_stats через кэш Django.
+
+    Ключ включает портал, параметры запроса и id последней проверки
+    (version), поэтому запись новой проверки делает старую запись
+    недостижимой; она удаляется по истечении PORTALS_STATS_CACHE_TTL.
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+    
+    key = f'portals:stats:{portal.id}:{days}:{resolution}:{max_points}:{version[0]}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = get_availability_stats(portal, days=days, resolution=resolution, max_points=max_points)
+        cache.set(key, stats, settings.PORTALS_STATS_CACHE_TTL)
+    return stats
+
+
+def get_availability_summary(user, portal_ids=None, days=7):
+    """
+    Получает краткую сводку доступности для всех порталов пользователя.
+    
+    Вместо отдельного запроса статистики на каждую карточку дашборда
+    все значения вычисляются одним SQL-запросом (Portal.objects.with_uptime).
+    
+    Возвращает словарь {portal_id: {...}} с полями:
+    - is_available: результат последней проверки (None если проверок нет)
+    - uptime_percentage: процент доступности за период
+    - response_time: время ответа последней проверки
+    - status_code: HTTP код последней проверки
+    - checked_at: время последней проверки
+    - favicon_url: URL иконки портала
+    - pending_jobs: есть ли невыполненные фоновые задачи
+    """
+    from django.core.files.storage import default_storage
+    from django.db.models import Exists, OuterRef
+    from .models import Portal, PortalJob
+    
+    portals = Portal.objects.filter(user=user)
+    if portal_ids is not None:
+        portals = portals.filter(id__in=portal_ids)
+    
+    pending_jobs = PortalJob.objects.filter(
+        portal=OuterRef('pk'),
+        status__in=[PortalJob.STATUS_PENDING, PortalJob.STATUS_RUNNING]
+    )
+    
+    rows = portals.with_uptime(days=days).order_by().values(
+        'id', 'favicon', 'uptime', 'last_is_available', 'last_response_time',
+        'last_status_code', 'last_checked_at', pending_jobs=Exists(pending_jobs)
+    )
+    
+    return {
+        row['id']: {
+            'is_available': row['last_is_available'],
+            'uptime_percentage': row['uptime'],
+            'response_time': row['last_response_time'],
+            'status_code': row['last_status_code'],
+            'checked_at': row['last_checked_at'].isoformat() if row['last_checked_at'] else None,
+            'favicon_url': default_storage.url(row['favicon']) if row['favicon'] else None,
+            'pending_jobs': row['pending_jobs'],
+        }
+        for row in rows
+    }
@@ -0,0 +1,119 @@
+"""
+Модуль компактных скетчей распределения времени ответа.
+Реализует логарифмические гистограммы в духе DDSketch: значение
+попадает в корзину с номером ceil(log_gamma(v)), поэтому любой
+квантиль восстанавливается с относительной погрешностью не более
+RELATIVE_ACCURACY. Скетчи разных интервалов складываются
+покорзинно, так что перцентили за период строятся из нескольких
+агрегатов без чтения сырых проверок.
+
+Скетч хранится в JSON как {'zero': n, 'bins': {'индекс': n}}.
+"""
+
+# Логарифм для вычисления номера корзины
+import math
+
+
+# Относительная погрешность квантилей (1%)
+RELATIVE_ACCURACY = 0.01
+
+# Основание логарифмической шкалы корзин
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Значения меньше этого (мс) учитываются в нулевой корзине
+MIN_VALUE = 0.01
+
+# Максимум корзин в скетче; при превышении объединяются младшие
+MAX_BINS = 1024
+
+# Перцентили, которые отдает API статистики
+PERCENTILES = (50, 90, 95, 99)
+
+
+def empty_sketch():
+    """Возвращает пустой скетч."""
+    return {'zero': 0, 'bins': {}}
+
+
+def bin_index(value):
+    """Возвращает номер корзины для положительного значения."""
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+
+def bin_value(index):
+    """Возвращает представительное значение корзины (середина по погрешности)."""
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def sketch_count(sketch):
+    """Возвращает количество значений в скетче."""
+    if not sketch:
+        return 0
+    return sketch.get('zero', 0) + sum(sketch.get('bins', {}).values())
+
+
+def collapse(sketch):
+    """Объединяет младшие корзины, пока их не станет не больше MAX_BINS."""
+    bins = sketch['bins']
+    if len(bins) <= MAX_BINS:
+        return sketch
+
+    indexes = sorted(bins, key=int)
+    cut = len(indexes) - MAX_BINS
+    target = indexes[cut]
+    for index in indexes[:cut]:
+        bins[target] += bins.pop(index)
+    return sketch
+
+
+def add_value(sketch, value):
+    """Добавляет значение в скетч (изменяет его на месте)."""
+    if value < MIN_VALUE:
+        sketch['zero'] = sketch.get('zero', 0) + 1
+        return sketch
+
+    bins = sketch.setdefault('bins', {})
+    index = str(bin_index(value))
+    bins[index] = bins.get(index, 0) + 1
+    return collapse(sketch)
+
+
+def merge_sketches(sketches):
+    """Складывает несколько скетчей в новый."""
+    merged = empty_sketch()
+    bins = merged['bins']
+    for sketch in sketches:
+        if not sketch:
+            continue
+        merged['zero'] += sketch.get('zero', 0)
+        for index, count in sketch.get('bins', {}).items():
+            bins[index] = bins.get(index, 0) + count
+    return collapse(merged)
+
+
+def quantile(sketch, q):
+    """Возвращает оценку квантиля q (0..1) или None для пустого скетча."""
+    total = sketch_count(sketch)
+    if not total:
+        return None
+
+    rank = q * (total - 1)
+    seen = sketch.get('zero', 0)
+    if rank < seen:
+        return 0.0
+
+    for index in sorted(sketch.get('bins', {}), key=int):
+        seen += sketch['bins'][index]
+        if rank < seen:
+            return bin_value(int(index))
+    return bin_value(int(max(sketch['bins'], key=int)))
+
+
+def percentiles(sketch, points=PERCENTILES):
+    """Возвращает словарь {'p50': значение, ...}, значения округлены до 0.01 мс."""
+    result = {}
+    for point in points:
+        value = quantile(sketch, point / 100)
+        result[f'p{point}'] = round(value, 2) if value is not None else None
+    return result
@@ -0,0 +1,202 @@
+"""
+Модуль потоковой передачи результатов проверок (Server-Sent Events).
+Открытая вкладка дашборда держит одно соединение с ASGI-сервером
+и получает сводку по порталам сразу после записи новых проверок
+вместо периодических запросов portal_availability_batch.
+
+Пока новых проверок пользователя нет, поток проверяет только его метку
+в кэше (см. services.publish_checks_written) и не обращается к БД.
+Периодический опрос БД без изменения метки включается, только если кэш
+локален для процесса (LocMemCache, DummyCache) и метки от монитора
+и фоновых задач до потока не доходят.
+"""
+
+# Асинхронное ожидание между опросами метки
+import asyncio
+
+# Сериализация событий
+import json
+
+# Монотонные часы для интервалов и времени жизни потока
+import time
+
+# Работа с датами
+from datetime import timedelta
+
+# Вызов синхронных сервисов из асинхронного кода
+from asgiref.sync import sync_to_async
+
+# Настройки проекта, кэш, соединения с БД и сериализация дат
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+# Модель проверок и сводка доступности
+from .models import PortalAvailability
+from .services import checks_written_key, get_availability_summary
+
+
+def format_event(data, event=None, event_id=None):
+    """Форматирует событие SSE с JSON-данными."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def latest_check_id():
+    """
+    Возвращает id последней проверки (любого пользователя, или 0).
+
+    id общий для всех порталов, поэтому годится как курсор потока:
+    дальше выбираются проверки пользователя с большим id.
+    """
+    return PortalAvailability.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def is_stale(user, last_id):
+    """
+    Проверяет, что курсор last_id (из Last-Event-ID) нельзя продолжить:
+    такой проверки пользователя нет (удалена, чужая или выдумана)
+    или она старше двух PORTALS_STREAM_MAX_AGE.
+    """
+    timestamp = (
+        PortalAvailability.objects
+        .filter(id=last_id, portal__user=user)
+        .values_list('timestamp', flat=True)
+        .first()
+    )
+    window = timedelta(seconds=2 * settings.PORTALS_STREAM_MAX_AGE)
+    return timestamp is None or timestamp < timezone.now() - window
+
+
+def cache_is_shared():
+    """
+    Проверяет, что кэш общий для процессов: метки записи проверок
+    из монитора и фоновых задач видны потоку SSE.
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def release_connection():
+    """
+    Закрывает соединение с БД текущего потока пула, чтобы простаивающий
+    поток SSE не держал его (внутри транзакции, например в тестах, - нет).
+    """
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def read_changes(user, last_id):
+    """
+    Возвращает (новый курсор, сводка или None) по проверкам
+    пользователя с id больше last_id.
+
+    Из БД читается по одной строке на портал (последний id),
+    а не каждая проверка. Устаревший курсор (см. is_stale)
+    заменяется последним id, а клиент получает сводку по всем
+    порталам. Выполняется в общем пуле потоков, соединение с БД
+    закрывается сразу, чтобы открытый поток не держал его.
+    """
+    try:
+        if is_stale(user, last_id):
+            return latest_check_id(), get_availability_summary(user) or None
+
+        rows = (
+            PortalAvailability.objects
+            .filter(portal__user=user, id__gt=last_id)
+            .order_by()
+            .values('portal_id')
+            .annotate(last_id=Max('id'))
+        )
+        changed = {row['portal_id']: row['last_id'] for row in rows}
+        if not changed:
+            return last_id, None
+        summary = get_availability_summary(user, portal_ids=sorted(changed))
+        return max(changed.values()), summary
+    finally:
+        release_connection()
+
+
+def read_cursor(last_id):
+    """Возвращает начальный курсор потока (см. latest_check_id)."""
+    try:
+        latest = latest_check_id()
+    finally:
+        release_connection()
+    # Курсор из будущего (выдуманный Last-Event-ID) ограничиваем текущим
+    if last_id is None or last_id > latest:
+        return latest
+    return last_id
+
+
+async def stream_checks(user, last_id=None):
+    """
+    Асинхронный генератор событий SSE для порталов пользователя.
+
+    Каждые PORTALS_STREAM_POLL_INTERVAL секунд читает из кэша метку
+    записи проверок этого пользователя и только при ее изменении
+    выбирает из БД изменившиеся порталы и отправляет событие
+    'checks' со сводкой в формате portal_availability_batch.
+    С локальным для процесса кэшем (см. cache_is_shared) метка может
+    не меняться, и БД дополнительно опрашивается раз
+    в PORTALS_STREAM_DB_POLL_INTERVAL секунд.
+    id события - id последней проверки: после переподключения браузер
+    присылает его в Last-Event-ID и пропущенные проверки не теряются.
+    Через PORTALS_STREAM_MAX_AGE секунд поток завершается, и
+    EventSource переподключается сам.
+    """
+    poll_interval = settings.PORTALS_STREAM_POLL_INTERVAL
+    db_poll_interval = None if cache_is_shared() else settings.PORTALS_STREAM_DB_POLL_INTERVAL
+    heartbeat = settings.PORTALS_STREAM_HEARTBEAT
+    deadline = time.monotonic() + settings.PORTALS_STREAM_MAX_AGE
+    marker_key = checks_written_key(user.id)
+
+    # Запросы к БД и чтение метки (кэш в продакшене - таблица SQLite)
+    # идут в общем пуле потоков, а не в отдельном потоке каждого
+    # соединения (thread_sensitive=False): число потоков и соединений
+    # ограничено размером пула, а не числом открытых вкладок
+    initial = last_id
+    last_id = await sync_to_async(read_cursor, thread_sensitive=False)(last_id)
+    read_marker = sync_to_async(cache.get, thread_sensitive=False)
+    marker = await read_marker(marker_key)
+    last_db_poll = last_sent = time.monotonic()
+    # Переданный клиентом курсор проверяем сразу, не дожидаясь метки
+    pending = initial is not None and initial == last_id
+
+    yield f'retry: {settings.PORTALS_STREAM_RETRY_MS}\n\n'
+
+    while time.monotonic() < deadline:
+        if not pending:
+            await asyncio.sleep(poll_interval)
+        now = time.monotonic()
+
+        current = await read_marker(marker_key)
+        db_due = db_poll_interval is not None and now - last_db_poll >= db_poll_interval
+        if pending or current != marker or db_due:
+            pending = False
+            marker = current
+            last_db_poll = now
+
+            last_id, summary = await sync_to_async(read_changes, thread_sensitive=False)(user, last_id)
+            if summary:
+                yield format_event(
+                    {'portals': {str(portal_id): data for portal_id, data in summary.items()}},
+                    event='checks',
+                    event_id=last_id,
+                )
+                last_sent = now
+                continue
+
+        # Комментарий SSE не дает прокси закрыть простаивающее соединение
+        if now - last_sent >= heartbeat:
+            yield ': ping\n\n'
+            last_sent = now
@@ -0,0 +1,287 @@
+"""
+Модуль локальных HTTP-серверов-заглушек для бенчмарка монитора.
+Набор серверов (StubServerFarm) слушает 127.0.0.1 на свободных портах
+и отвечает с заданным поведением (StubBehaviour): распределением
+задержки, долей ошибок 5xx, обрывов соединения и зависаний дольше
+таймаута клиента, цепочками редиректов и размером тела ответа.
+
+Цепочка редиректов задается в пути: /r3/... отвечает 302 на /r2/...
+и так далее до /r0/..., поэтому у каждого портала своя длина цепочки.
+Серверы можно запустить в отдельном процессе (FarmProcess),
+чтобы время CPU и память монитора замерялись без них.
+"""
+
+# HTTP-сервер с потоком на соединение и обработчик запросов
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Отдельный процесс для серверов
+import multiprocessing
+
+# Генератор задержек и ошибок
+import random
+
+# Потоки для serve_forever и блокировка генератора
+import threading
+
+# Задержка ответа
+import time
+
+# Разбор цепочки редиректов в пути
+import re
+
+# Время CPU процесса серверов (только Unix)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Путь с оставшимся числом редиректов: /r<N>/<остаток>
+REDIRECT_PATH = re.compile(r'^/r(\d+)(/.*)?$')
+
+# Коды ответов для имитации ошибок сервера
+ERROR_STATUSES = (500, 502, 503)
+
+
+class StubBehaviour:
+    """
+    Поведение серверов-заглушек.
+
+    - latency_ms, latency_sigma: задержка ответа - логнормальное
+      распределение с медианой latency_ms (sigma 0 - постоянная)
+    - error_rate: доля ответов 500/502/503
+    - reset_rate: доля соединений, закрытых без ответа
+    - timeout_rate: доля запросов, на которые сервер отвечает
+      только через hang_seconds (дольше таймаута чтения клиента)
+    - body_bytes: размер тела ответа 200
+    """
+
+    def __init__(self, latency_ms=50, latency_sigma=0.5, error_rate=0.0, reset_rate=0.0,
+                 timeout_rate=0.0, hang_seconds=5, body_bytes=2048, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.body_bytes = body_bytes
+        self.seed = seed
+
+    def as_dict(self):
+        """Возвращает параметры поведения (для отчета и передачи в процесс)."""
+        return dict(vars(self))
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов сервера-заглушки (поведение - server.behaviour)."""
+
+    # HTTP/1.1 с Content-Length - клиент переиспользует соединения
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond(with_body=True)
+
+    def do_HEAD(self):
+        self.respond(with_body=False)
+
+    def respond(self, with_body):
+        """Отвечает на запрос согласно поведению сервера."""
+        self.server.enter()
+        try:
+            self._respond(with_body)
+        finally:
+            self.server.leave()
+
+    def _respond(self, with_body):
+        outcome, delay = self.server.draw()
+
+        if outcome == 'reset':
+            self.close_connection = True
+            return
+
+        time.sleep(delay)
+
+        match = REDIRECT_PATH.match(self.path)
+        if match and int(match.group(1)) > 0:
+            location = f'/r{int(match.group(1)) - 1}{match.group(2) or "/"}'
+            self.send_response(302)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if outcome == 'error':
+            status, body = random.choice(ERROR_STATUSES), b'error'
+        else:
+            status, body = 200, self.server.body
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Журнал запросов отключен."""
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    """HTTP-сервер-заглушка, каждое соединение - в своем потоке."""
+
+    daemon_threads = True
+    # Тысячи одновременных подключений не должны упираться в backlog
+    request_queue_size = 1024
+
+    def __init__(self, behaviour, seed=None):
+        super().__init__(('127.0.0.1', 0), StubRequestHandler)
+        self.behaviour = behaviour
+        self.body = b'x' * behaviour.body_bytes
+        self.requests = 0
+        # Запросы, обрабатываемые одновременно, и их максимум
+        self.active = 0
+        self.max_active = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def enter(self):
+        """Учитывает начало обработки запроса."""
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def leave(self):
+        """Учитывает окончание обработки запроса."""
+        with self._lock:
+            self.active -= 1
+
+    def draw(self):
+        """
+        Выбирает исход запроса ('ok', 'error', 'reset', 'timeout')
+        и задержку ответа в секундах.
+        """
+        behaviour = self.behaviour
+        with self._lock:
+            self.requests += 1
+            roll = self._rng.random()
+            if behaviour.latency_sigma:
+                delay = behaviour.latency_ms * self._rng.lognormvariate(0, behaviour.latency_sigma) / 1000
+            else:
+                delay = behaviour.latency_ms / 1000
+
+        if roll < behaviour.reset_rate:
+            return 'reset', 0
+        roll -= behaviour.reset_rate
+        if roll < behaviour.timeout_rate:
+            return 'timeout', behaviour.hang_seconds
+        roll -= behaviour.timeout_rate
+        if roll < behaviour.error_rate:
+            return 'error', delay
+        return 'ok', delay
+
+    def handle_error(self, request, client_address):
+        """Обрывы соединений клиентом (после таймаута) ожидаемы и не выводятся."""
+
+
+class StubServerFarm:
+    """
+    Набор серверов-заглушек в текущем процессе.
+
+    Используется как контекстный менеджер:
+        with StubServerFarm(4, StubBehaviour(latency_ms=20)) as farm:
+            farm.urls  # ['http://127.0.0.1:PORT', ...]
+    """
+
+    def __init__(self, count, behaviour):
+        self.count = count
+        self.behaviour = behaviour
+        self.servers = []
+        self.threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def urls(self):
+        return [server.url for server in self.servers]
+
+    @property
+    def requests(self):
+        return sum(server.requests for server in self.servers)
+
+    def start(self):
+        """Запускает серверы, каждый в своем потоке."""
+        seed = self.behaviour.seed
+        for index in range(self.count):
+            server = StubHTTPServer(self.behaviour, seed=None if seed is None else seed + index)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.servers.append(server)
+            self.threads.append(thread)
+
+    def stop(self):
+        """Останавливает серверы и закрывает их сокеты."""
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+        self.threads = []
+
+
+def portal_path(index, redirects=0):
+    """Возвращает путь портала с заданной длиной цепочки редиректов."""
+    return f'/r{redirects}/portal/{index}'
+
+
+def _serve(count, options, conn):
+    """Точка входа процесса серверов: работает до сообщения от родителя."""
+    with StubServerFarm(count, StubBehaviour(**options)) as farm:
+        conn.send(farm.urls)
+        conn.recv()
+        requests = farm.requests
+
+    usage = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+    conn.send({
+        'requests': requests,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime if usage else None,
+    })
+    conn.close()
+
+
+class FarmProcess:
+    """
+    Серверы-заглушки в отдельном процессе.
+
+    stop() возвращает число обработанных запросов и время CPU
+    процесса серверов.
+    """
+
+    def __init__(self, count, behaviour):
+        parent, child = multiprocessing.Pipe()
+        self.conn = parent
+        self.process = multiprocessing.Process(
+            target=_serve, args=(count, behaviour.as_dict(), child), daemon=True,
+        )
+        self.process.start()
+        self.urls = self.conn.recv()
+
+    def stop(self):
+        """Останавливает серверы и возвращает их статистику."""
+        try:
+            self.conn.send('stop')
+            stats = self.conn.recv()
+        except (EOFError, OSError):
+            stats = {'requests': None, 'cpu_seconds': None}
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+        return stats
@@ -1,3 +1,896 @@
-from django.test import TestCase
+"""
+Тесты приложения порталов.
+"""
 
-# Create your tests here.
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from web_dashboard.db_backend import base as sqlite_backend
+
+from . import http_client
+from .jobs import HANDLERS, MAX_ATTEMPTS, claim_jobs, enqueue, run_job
+from .management.commands.monitor_portals import Command as MonitorCommand
+from .models import (
+    DomainFavicon, Portal, PortalAvailability, PortalAvailabilityDaily, PortalAvailabilityHourly, PortalJob,
+)
+from .monitor import CheckScheduler, HostLimiter, group_by_url, normalize_url, run_checks
+from .retention import compact_segments, incremental_vacuum_enabled, prune_history
+from .rollups import rebuild_portal_rollups
+from .services import (
+    CheckResultWriter, checks_written_key, get_availability_stats, probe_url, prune_shared_favicons,
+    save_check_result, store_favicon, update_portal_favicon,
+)
+from .stream import read_changes, read_cursor, stream_checks
+from .stub_servers import StubBehaviour, StubServerFarm, portal_path
+
+
+class AvailabilityStatsTests(TestCase):
+    """Статистика доступности и эндпоинт portal_availability."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', password='password')
+        cls.portal = Portal.objects.create(user=cls.user, title='Портал', url='https://example.com')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_checks(self, count, days):
+        """Создает count проверок, равномерно распределенных по days дням."""
+        now = timezone.now()
+        step = timedelta(days=days) / count
+        PortalAvailability.objects.bulk_create([
+            PortalAvailability(
+                portal=self.portal,
+                timestamp=now - step * (i + 1),
+                is_available=i % 4 != 0,
+                response_time=100.0 + i % 10 if i % 4 != 0 else None,
+                status_code=200 if i % 4 != 0 else None,
+            )
+            for i in range(count)
+        ])
+        rebuild_portal_rollups(self.portal.id)
+
+    def count_queries(self, days):
+        """Возвращает число SQL-запросов эндпоинта статистики за days дней."""
+        self.client.force_login(self.user)
+        url = reverse('portals:portal_availability', args=[self.portal.id])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'days': days})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_stats_match_raw_checks(self):
+        """Агрегаты дают те же значения, что и подсчет по сырым проверкам."""
+        self.create_checks(200, days=6)
+
+        stats = get_availability_stats(self.portal, days=7)
+        checks = PortalAvailability.objects.filter(portal=self.portal)
+        available = checks.filter(is_available=True).count()
+        times = [c.response_time for c in checks if c.response_time is not None]
+
+        self.assertEqual(stats['checks_count'], 200)
+        self.assertEqual(stats['available_count'], available)
+        self.assertEqual(stats['unavailable_count'], 200 - available)
+        self.assertEqual(stats['uptime_percentage'], round(available / 200 * 100, 1))
+        self.assertEqual(stats['avg_response_time'], round(sum(times) / len(times), 2))
+        self.assertEqual(len(stats['chart_data']), 200)
+
+    def test_stats_use_three_queries(self):
+        """Статистика: агрегатный запрос, запрос скетчей и запрос данных графика."""
+        self.create_checks(50, days=3)
+
+        with self.assertNumQueries(3):
+            get_availability_stats(self.portal, days=7)
+
+    def test_percentiles_match_raw_checks(self):
+        """Перцентили из скетчей совпадают с точными в пределах погрешности."""
+        now = timezone.now()
+        PortalAvailability.objects.bulk_create([
+            PortalAvailability(
+                portal=self.portal,
+                timestamp=now - timedelta(minutes=7 * (i + 1)),
+                is_available=True,
+                response_time=float(10 + (i * 37) % 990),
+                status_code=200,
+            )
+            for i in range(1000)
+        ])
+        rebuild_portal_rollups(self.portal.id)
+
+        stats = get_availability_stats(self.portal, days=7)
+        times = sorted(
+            PortalAvailability.objects.filter(portal=self.portal).values_list('response_time', flat=True)
+        )
+        for point in (50, 90, 95, 99):
+            exact = times[int(point / 100 * (len(times) - 1))]
+            estimate = stats['response_time_percentiles'][f'p{point}']
+            self.assertAlmostEqual(estimate, exact, delta=exact * 0.02)
+
+    def test_endpoint_query_count_is_constant(self):
+        """Число запросов не зависит ни от количества проверок, ни от периода."""
+        self.create_checks(20, days=2)
+        baseline = self.count_queries(days=7)
+
+        self.create_checks(500, days=60)
+        self.assertEqual(self.count_queries(days=7), baseline)
+        self.assertEqual(self.count_queries(days=365), baseline)
+
+    def test_chart_data_is_bounded(self):
+        """График за длинный период группируется и не превышает max_points."""
+        self.create_checks(500, days=60)
+
+        stats = get_availability_stats(self.portal, days=30, max_points=100)
+        self.assertEqual(stats['resolution'], 'day')
+        self.assertLessEqual(len(stats['chart_data']), 31)
+        self.assertGreaterEqual(
+            sum(point['checks_count'] for point in stats['chart_data']), stats['checks_count']
+        )
+
+        stats = get_availability_stats(self.portal, days=2, resolution='hour')
+        self.assertEqual(stats['resolution'], 'hour')
+        self.assertLessEqual(len(stats['chart_data']), 49)
+
+        stats = get_availability_stats(self.portal, days=60, max_points=5)
+        self.assertLessEqual(len(stats['chart_data']), 5)
+
+    @override_settings(PORTALS_CHART_MAX_POINTS=50)
+    def test_max_points_is_capped(self):
+        """Запрошенное max_points не превышает PORTALS_CHART_MAX_POINTS."""
+        self.create_checks(500, days=30)
+        self.client.force_login(self.user)
+        url = reverse('portals:portal_availability', args=[self.portal.id])
+
+        response = self.client.get(url, {'days': 30, 'resolution': 'raw', 'max_points': 1000000000})
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()['stats']
+        self.assertNotEqual(stats['resolution'], 'raw')
+        self.assertLessEqual(len(stats['chart_data']), 50)
+
+        stats = get_availability_stats(self.portal, days=30, resolution='raw', max_points=1000)
+        self.assertLessEqual(len(stats['chart_data']), 50)
+
+    def test_endpoint_returns_not_modified(self):
+        """Без новых проверок повторный запрос с ETag получает 304."""
+        self.create_checks(20, days=2)
+        self.client.force_login(self.user)
+        url = reverse('portals:portal_availability', args=[self.portal.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response.headers)
+
+        # Сессия, пользователь, портал и последняя проверка - без статистики
+        with self.assertNumQueries(4):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.create_checks(1, days=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class PortalReorderTests(TestCase):
+    """Перестановка порталов через portal_reorder."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.portals = [
+            Portal.objects.create(user=self.user, title=f'Портал {i}', url=f'https://{i}.example.com', position=i)
+            for i in range(4)
+        ]
+        self.client.force_login(self.user)
+
+    def reorder(self, data):
+        return self.client.post(
+            reverse('portals:portal_reorder'), json.dumps(data), content_type='application/json'
+        )
+
+    def order(self):
+        return list(Portal.objects.filter(user=self.user).values_list('id', flat=True))
+
+    def test_full_reorder_and_move(self):
+        """Полный список пишется одним UPDATE, перемещение меняет одну строку."""
+        ids = [portal.id for portal in reversed(self.portals)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.reorder({'portal_ids': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.order(), ids)
+        updates = [q for q in context.captured_queries if q['sql'].startswith('UPDATE "portals_portal"')]
+        self.assertEqual(len(updates), 1)
+
+        response = self.reorder({'portal_id': ids[3], 'after_id': ids[0], 'before_id': ids[1]})
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual(self.order(), [ids[0], ids[3], ids[1], ids[2]])
+
+    def test_foreign_portal_is_rejected(self):
+        """Чужой портал в списке отклоняет всю перестановку."""
+        other = User.objects.create_user(username='other', password='password')
+        foreign = Portal.objects.create(user=other, title='Чужой', url='https://other.example.com')
+        before = self.order()
+
+        response = self.reorder({'portal_ids': [foreign.id] + before})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.order(), before)
+
+    def test_move_after_only_keeps_positions_unique(self):
+        """Перемещение только с after_id встает перед следующим порталом."""
+        ids = [portal.id for portal in self.portals]
+        self.reorder({'portal_ids': ids})
+
+        for data in ({'portal_id': ids[0], 'after_id': ids[1]}, {'portal_id': ids[3], 'after_id': ids[1]}):
+            response = self.reorder(data)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.order(), [ids[1], ids[3], ids[0], ids[2]])
+        positions = list(Portal.objects.filter(user=self.user).values_list('position', flat=True))
+        self.assertEqual(len(set(positions)), len(positions))
+
+    def test_move_with_wrong_neighbours_is_rejected(self):
+        """Соседи не подряд или в обратном порядке - 400 без изменений."""
+        ids = [portal.id for portal in self.portals]
+        for after_id, before_id in ((ids[2], ids[1]), (ids[1], ids[3])):
+            response = self.reorder({'portal_id': ids[0], 'after_id': after_id, 'before_id': before_id})
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('constraint', response.json()['error'])
+        self.assertEqual(self.order(), ids)
+
+
+@override_settings(PORTALS_SEGMENT_STORAGE=True)
+class SegmentStorageTests(TestCase):
+    """Перенос проверок в сжатые сегменты."""
+
+    def test_stats_are_unchanged_after_compaction(self):
+        """После переноса в сегменты статистика и график не меняются."""
+        user = User.objects.create_user(username='user', password='password')
+        portal = Portal.objects.create(user=user, title='Портал', url='https://example.com')
+        now = timezone.now()
+        PortalAvailability.objects.bulk_create([
+            PortalAvailability(
+                portal=portal,
+                timestamp=now - timedelta(minutes=13 * (i + 1)),
+                is_available=i % 5 != 0,
+                response_time=50.0 + i % 17 if i % 5 != 0 else None,
+                status_code=200 if i % 5 != 0 else None,
+            )
+            for i in range(500)
+        ])
+        rebuild_portal_rollups(portal.id)
+        before = get_availability_stats(portal, days=7)
+
+        compacted = compact_segments()
+        self.assertGreater(compacted, 0)
+        self.assertEqual(PortalAvailability.objects.filter(portal=portal).count(), 500 - compacted)
+
+        after = get_availability_stats(portal, days=7)
+        for key in ('checks_count', 'available_count', 'uptime_percentage', 'avg_response_time'):
+            self.assertEqual(after[key], before[key])
+        self.assertEqual(len(after['chart_data']), len(before['chart_data']))
+
+
+class StubServerTests(SimpleTestCase):
+    """Серверы-заглушки бенчмарка монитора."""
+
+    def test_redirect_chain_and_errors(self):
+        """Цепочка редиректов проходится до конца, доля ошибок соблюдается."""
+        with StubServerFarm(1, StubBehaviour(latency_ms=0, latency_sigma=0)) as farm:
+            result = probe_url(farm.urls[0] + portal_path(1, redirects=3))
+            self.assertTrue(result['is_available'])
+            self.assertEqual(result['status_code'], 200)
+            self.assertEqual(farm.requests, 4)
+
+        with StubServerFarm(1, StubBehaviour(latency_ms=0, latency_sigma=0, error_rate=1)) as farm:
+            result = probe_url(farm.urls[0] + portal_path(1))
+            self.assertFalse(result['is_available'])
+            self.assertGreaterEqual(result['status_code'], 500)
+
+    def test_reused_connection_has_no_phase_timings(self):
+        """Фазы нового соединения не достаются следующему запросу через него."""
+        http_client.reset_session()
+        with StubServerFarm(1, StubBehaviour(latency_ms=0, latency_sigma=0)) as farm:
+            self.assertIsNotNone(probe_url(farm.urls[0] + portal_path(1))['connect_time'])
+            http_client.reset_session()
+            http_client.get(farm.urls[0] + '/favicon.ico')
+            result = probe_url(farm.urls[0] + portal_path(1))
+        http_client.reset_session()
+        self.assertIsNone(result['dns_time'])
+        self.assertIsNone(result['connect_time'])
+        self.assertEqual(result['ttfb'], result['response_time'])
+
+    def test_consecutive_probes_reuse_connection(self):
+        """Небольшое тело дочитывается, и следующая проверка идет по тому же соединению."""
+        http_client.reset_session()
+        with StubServerFarm(1, StubBehaviour(latency_ms=0, latency_sigma=0, body_bytes=2048)) as farm:
+            url = farm.urls[0] + portal_path(1)
+            for max_bytes in (0, 1024, 4096):
+                http_client.reset_session()
+                first = probe_url(url, max_bytes=max_bytes)
+                second = probe_url(url, max_bytes=max_bytes)
+                self.assertIsNotNone(first['connect_time'])
+                self.assertIsNone(second['connect_time'], max_bytes)
+                self.assertEqual(second['body_bytes'], min(max_bytes, 2048))
+
+            # Остаток больше PORTALS_PROBE_DRAIN_BYTES не скачивается, соединение закрывается
+            with override_settings(PORTALS_PROBE_DRAIN_BYTES=1024):
+                http_client.reset_session()
+                probe_url(url, max_bytes=0)
+                self.assertIsNotNone(probe_url(url, max_bytes=0)['connect_time'])
+        http_client.reset_session()
+
+
+class RunChecksTests(SimpleTestCase):
+    """Параллельный движок проверок на серверах-заглушках."""
+
+    def setUp(self):
+        http_client.reset_session()
+
+    def tearDown(self):
+        http_client.reset_session()
+
+    def test_per_host_limit_is_never_exceeded(self):
+        """К одному хосту одновременно идет не более per_host запросов."""
+        with StubServerFarm(2, StubBehaviour(latency_ms=30, latency_sigma=0)) as farm:
+            portals = [
+                Portal(id=index + 1, url=farm.urls[index % 2] + portal_path(index, redirects=index % 3))
+                for index in range(24)
+            ]
+            results = list(run_checks(portals, concurrency=12, per_host=2))
+            max_active = [server.max_active for server in farm.servers]
+
+        self.assertEqual(len(results), 24)
+        self.assertTrue(all(result['is_available'] for _, result in results))
+        self.assertEqual(max_active, [2, 2])
+
+    def test_host_limiter_shares_semaphore_per_host(self):
+        """Семафор создается один на хост и ограничен per_host."""
+        limiter = HostLimiter(2)
+        semaphore = limiter.get('a.example.com')
+        self.assertIs(limiter.get('a.example.com'), semaphore)
+        self.assertIsNot(limiter.get('b.example.com'), semaphore)
+        self.assertTrue(semaphore.acquire(blocking=False))
+        self.assertTrue(semaphore.acquire(blocking=False))
+        self.assertFalse(semaphore.acquire(blocking=False))
+
+
+class UrlGroupingTests(TestCase):
+    """Объединение проверок порталов с одинаковым адресом."""
+
+    def test_normalize_url(self):
+        """Эквивалентные адреса приводятся к одному виду, значимые части сохраняются."""
+        self.assertEqual(normalize_url(' HTTP://Example.COM:80 '), 'http://example.com/')
+        self.assertEqual(normalize_url('https://example.com.:443/A?x=1#top'), 'https://example.com/A?x=1')
+        self.assertEqual(normalize_url('http://user:pw@Host.com:8080/p'), 'http://user:pw@host.com:8080/p')
+        self.assertEqual(normalize_url('http://[::1]:80/'), 'http://[::1]/')
+        self.assertEqual(normalize_url('http://host:bad/'), 'http://host:bad/')
+        self.assertNotEqual(normalize_url('http://example.com/a'), normalize_url('http://example.com/A'))
+        self.assertNotEqual(normalize_url('http://example.com/?a=1'), normalize_url('http://example.com/?a=2'))
+
+    def test_group_by_url(self):
+        """Группы сохраняют порядок первого появления адреса."""
+        portals = [
+            Portal(id=1, url='https://b.example.com'),
+            Portal(id=2, url='https://a.example.com/'),
+            Portal(id=3, url='HTTPS://B.example.com:443/#x'),
+        ]
+        groups = group_by_url(portals)
+        self.assertEqual(list(groups), ['https://b.example.com/', 'https://a.example.com/'])
+        self.assertEqual([portal.id for portal in groups['https://b.example.com/']], [1, 3])
+
+    def test_shared_url_probed_once_and_written_to_every_portal(self):
+        """Один запрос на уникальный адрес, строка проверки - у каждого портала."""
+        user = User.objects.create_user(username='user', password='password')
+        http_client.reset_session()
+        with StubServerFarm(1, StubBehaviour(latency_ms=0, latency_sigma=0)) as farm:
+            base = farm.urls[0]
+            urls = [
+                base + portal_path(1),
+                base.upper() + portal_path(1),
+                base + portal_path(1) + '#top',
+                base + portal_path(2),
+            ]
+            portals = [
+                Portal.objects.create(user=user, title=str(index), url=url, position=index)
+                for index, url in enumerate(urls)
+            ]
+            with CheckResultWriter() as writer:
+                for portal, result in run_checks(portals, concurrency=4, per_host=4):
+                    writer.add(portal, result)
+            requests = farm.requests
+        http_client.reset_session()
+
+        self.assertEqual(requests, 2)
+        for portal in portals:
+            self.assertEqual(PortalAvailability.objects.filter(portal=portal, is_available=True).count(), 1)
+
+
+class FaviconTests(TestCase):
+    """Общий кэш favicon по доменам."""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+        self.addCleanup(self.media.cleanup)
+        self.user = User.objects.create_user(username='user', password='password')
+
+    def portal(self, url='https://a.example.com/page'):
+        return Portal.objects.create(user=self.user, title='A', url=url)
+
+    def test_cache_hit_makes_no_requests(self):
+        """Свежая запись домена (и отрицательная) не приводит к сетевым запросам."""
+        _, path = store_favicon(b'icon-a' * 20)
+        DomainFavicon.objects.create(domain='a.example.com', path=path)
+        DomainFavicon.objects.create(domain='b.example.com')
+
+        with mock.patch.object(http_client, 'get') as get:
+            portal = self.portal()
+            self.assertTrue(update_portal_favicon(portal))
+            self.assertFalse(update_portal_favicon(self.portal('https://B.example.com/')))
+        get.assert_not_called()
+        portal.refresh_from_db()
+        self.assertEqual(portal.favicon.name, path)
+
+    def test_refetch_releases_unreferenced_file(self):
+        """После смены иконки домена старый общий файл удаляется, если он больше не нужен."""
+        _, old_path = store_favicon(b'icon-a' * 20)
+        DomainFavicon.objects.create(
+            domain='a.example.com', path=old_path, fetched_at=timezone.now() - timedelta(days=365),
+        )
+        portal = self.portal()
+        portal.favicon.name = old_path
+        portal.save(update_fields=['favicon'])
+
+        with mock.patch('portals.services.fetch_favicon', return_value=ContentFile(b'icon-b' * 20)):
+            self.assertTrue(update_portal_favicon(portal))
+        self.assertNotEqual(portal.favicon.name, old_path)
+        self.assertTrue(default_storage.exists(portal.favicon.name))
+        self.assertFalse(default_storage.exists(old_path))
+
+    def test_refetch_keeps_file_shared_with_other_domain(self):
+        """Общий файл, на который ссылается другой домен, сохраняется."""
+        _, old_path = store_favicon(b'icon-a' * 20)
+        DomainFavicon.objects.create(
+            domain='a.example.com', path=old_path, fetched_at=timezone.now() - timedelta(days=365),
+        )
+        DomainFavicon.objects.create(domain='b.example.com', path=old_path)
+
+        with mock.patch('portals.services.fetch_favicon', return_value=None):
+            self.assertFalse(update_portal_favicon(self.portal()))
+        self.assertTrue(default_storage.exists(old_path))
+
+    def test_prune_shared_favicons(self):
+        """Очистка удаляет только старые файлы без ссылок."""
+        _, kept = store_favicon(b'icon-a' * 20)
+        _, orphan = store_favicon(b'icon-b' * 20)
+        DomainFavicon.objects.create(domain='a.example.com', path=kept)
+
+        self.assertEqual(prune_shared_favicons(), 0)
+        self.assertEqual(prune_shared_favicons(grace=-60), 1)
+        self.assertTrue(default_storage.exists(kept))
+        self.assertFalse(default_storage.exists(orphan))
+
+
+class CheckResultWriterTests(TestCase):
+    """Пакетная запись результатов проверок."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.first = Portal.objects.create(user=self.user, title='A', url='https://a.example.com')
+        self.second = Portal.objects.create(user=self.user, title='B', url='https://b.example.com')
+        self.result = {'is_available': True, 'response_time': 10.0, 'status_code': 200}
+
+    def test_deleted_portal_does_not_drop_batch(self):
+        """Результат удаленного портала отбрасывается, остальные записываются."""
+        writer = CheckResultWriter(batch_size=100, flush_interval=3600)
+        writer.add(self.first, self.result)
+        writer.add(self.second, self.result)
+        self.second.delete()
+
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.pending, [])
+        self.assertEqual(PortalAvailability.objects.filter(portal=self.first).count(), 1)
+
+    def test_failed_flush_keeps_batch(self):
+        """При ошибке транзакции пачка возвращается в очередь."""
+        writer = CheckResultWriter(batch_size=100, flush_interval=3600)
+        writer.add(self.first, self.result)
+        writer.add(self.second, self.result)
+
+        with mock.patch('portals.rollups.apply_checks', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                writer.flush()
+        self.assertEqual(len(writer.pending), 2)
+        self.assertFalse(PortalAvailability.objects.exists())
+
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(PortalAvailability.objects.count(), 2)
+
+
+class CheckSchedulerTests(SimpleTestCase):
+    """Расписание проверок режима демона."""
+
+    def setUp(self):
+        self.now = 0.0
+        self.scheduler = CheckScheduler(jitter=0.1, clock=lambda: self.now)
+        self.portals = [Portal(id=i, url=f'https://{i}.example.com', check_interval=100) for i in range(1, 6)]
+
+    def test_due_order_and_jitter(self):
+        """Порталы отдаются по времени проверки, следующая - через интервал ± jitter."""
+        self.scheduler.sync(self.portals)
+        first = dict(self.scheduler._due)
+        self.assertTrue(all(0 <= due <= 100 for due in first.values()))
+
+        # Часы идут шагами по 0.5 с: каждый портал отдается в свое время,
+        # следующая проверка планируется сразу при выдаче
+        order = []
+        next_due = {}
+        while len(order) < len(self.portals):
+            self.now += 0.5
+            for portal in self.scheduler.pop_due():
+                if portal.id not in next_due:
+                    order.append(portal.id)
+                    next_due[portal.id] = self.scheduler._due[portal.id]
+        self.assertEqual(order, sorted(first, key=first.get))
+        for portal_id, due in next_due.items():
+            self.assertGreaterEqual(due, first[portal_id] + 90)
+            self.assertLessEqual(due, first[portal_id] + 110)
+
+    def test_sync_removes_deleted_portal(self):
+        """Удаленный портал больше не проверяется."""
+        self.scheduler.sync(self.portals)
+        self.scheduler.sync(self.portals[1:])
+        self.now = 1000
+        self.assertNotIn(1, [portal.id for portal in self.scheduler.pop_due()])
+        self.assertEqual(len(self.scheduler), 4)
+
+
+class MonitorCommandTests(TestCase):
+    """Команда monitor_portals."""
+
+    def test_flush_error_does_not_stop_monitor(self):
+        """Ошибка записи выводится, результаты остаются в очереди."""
+        user = User.objects.create_user(username='user', password='password')
+        portal = Portal.objects.create(user=user, title='A', url='https://a.example.com')
+        command = MonitorCommand(stdout=StringIO())
+        writer = CheckResultWriter(batch_size=100, flush_interval=3600)
+        writer.add(portal, {'is_available': True, 'status_code': 200}, flush=False)
+
+        with mock.patch('portals.rollups.apply_checks', side_effect=DatabaseError('locked')):
+            self.assertFalse(command.flush(writer))
+        self.assertIn('Ошибка при записи результатов', command.stdout.getvalue())
+        self.assertEqual(len(writer.pending), 1)
+        self.assertTrue(command.flush(writer))
+        self.assertEqual(PortalAvailability.objects.count(), 1)
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class BenchmarkPortalsTests(TestCase):
+    """Команда benchmark_portals."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        Portal.objects.create(user=user, title='A', url='https://a.example.com')
+
+    def test_service_admin_is_removed(self):
+        """Служебный суперпользователь удаляется после замера."""
+        call_command('benchmark_portals', iterations=1, warmup=0, only=['admin:'], stdout=StringIO())
+        self.assertFalse(User.objects.filter(username='bench_admin').exists())
+
+    def test_existing_admin(self):
+        """Указанный суперпользователь используется и сохраняется."""
+        User.objects.create_superuser(username='root', password='password')
+        call_command(
+            'benchmark_portals', iterations=1, warmup=0, only=['admin:'], admin_username='root', stdout=StringIO(),
+        )
+        self.assertTrue(User.objects.filter(username='root').exists())
+        self.assertFalse(User.objects.filter(username='bench_admin').exists())
+        with self.assertRaises(CommandError):
+            call_command('benchmark_portals', only=['admin:'], admin_username='user', stdout=StringIO())
+
+
+class SeedAvailabilityTests(TestCase):
+    """Команда seed_availability."""
+
+    def test_phases_add_up_to_response_time(self):
+        """Фазы соединения и ожидание первого байта в сумме дают время ответа."""
+        call_command('seed_availability', users=1, portals=2, days=1, stdout=StringIO())
+        checks = PortalAvailability.objects.filter(is_available=True)
+        self.assertTrue(checks.exclude(dns_time=None).exists())
+        for check in checks:
+            setup = (check.dns_time or 0) + (check.connect_time or 0) + (check.tls_time or 0)
+            self.assertGreaterEqual(check.ttfb, 0)
+            self.assertAlmostEqual(setup + check.ttfb, check.response_time, delta=0.02)
+
+
+@override_settings(PORTALS_RAW_RETENTION_DAYS=30, PORTALS_HOURLY_RETENTION_DAYS=180, PORTALS_DAILY_RETENTION_DAYS=0)
+class RetentionTests(TestCase):
+    """Удаление устаревшей истории."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        now = timezone.now()
+        self.portals = [
+            Portal.objects.create(user=user, title=f'P{i}', url=f'https://{i}.example.com') for i in range(3)
+        ]
+        for portal in self.portals:
+            PortalAvailability.objects.bulk_create([
+                PortalAvailability(portal=portal, timestamp=now - timedelta(days=days), is_available=True)
+                for days in (40, 40, 40, 1)
+            ])
+            PortalAvailabilityHourly.objects.create(portal=portal, bucket=now - timedelta(days=200))
+            PortalAvailabilityHourly.objects.create(portal=portal, bucket=now - timedelta(hours=1))
+
+    def test_prune_reaches_all_portals_and_models(self):
+        """Устаревшие строки удаляются у всех порталов, свежие остаются."""
+        deleted = prune_history(chunk_size=2, pause=0)
+        self.assertEqual(deleted['PortalAvailability'], 9)
+        self.assertEqual(deleted['PortalAvailabilityHourly'], 3)
+        self.assertEqual(PortalAvailability.objects.count(), 3)
+        self.assertEqual(PortalAvailabilityHourly.objects.count(), 3)
+
+    def test_budget_is_shared_between_models(self):
+        """При малом бюджете времени каждая модель получает свою порцию."""
+        clock = iter(range(1000))
+        with mock.patch('portals.retention.time.monotonic', lambda: next(clock)):
+            deleted = prune_history(chunk_size=2, pause=0, time_budget=4)
+        self.assertEqual(deleted['PortalAvailability'], 2)
+        self.assertEqual(deleted['PortalAvailabilityHourly'], 2)
+
+    def test_incremental_vacuum_disabled_by_default(self):
+        """Новая база SQLite не в режиме INCREMENTAL - место не возвращается без включения."""
+        self.assertIs(incremental_vacuum_enabled(), False)
+
+
+class StreamTests(TestCase):
+    """Поток результатов проверок (SSE)."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.first = Portal.objects.create(user=self.user, title='A', url='https://a.example.com')
+        self.second = Portal.objects.create(user=self.user, title='B', url='https://b.example.com')
+        self.foreign = Portal.objects.create(user=self.other, title='C', url='https://c.example.com')
+        self.result = {'is_available': True, 'response_time': 10.0, 'status_code': 200}
+
+    def write(self, *portals):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CheckResultWriter(batch_size=100, flush_interval=3600) as writer:
+                for portal in portals:
+                    writer.add(portal, self.result, flush=False)
+
+    def test_marker_is_per_user(self):
+        """Запись проверок обновляет метку только владельца порталов."""
+        self.write(self.foreign)
+        self.assertIsNone(cache.get(checks_written_key(self.user.id)))
+        self.assertIsNotNone(cache.get(checks_written_key(self.other.id)))
+
+    def test_changes_are_read_per_portal(self):
+        """Возвращается сводка только по изменившимся порталам пользователя."""
+        self.write(self.first, self.second)
+        cursor = read_cursor(None)
+        self.write(self.first, self.first, self.foreign)
+
+        last_id, summary = read_changes(self.user, cursor)
+        self.assertEqual(list(summary), [self.first.id])
+        self.assertEqual(last_id, PortalAvailability.objects.filter(portal=self.first).latest('id').id)
+        self.assertEqual(read_changes(self.user, last_id), (last_id, None))
+
+    def test_stale_cursor_is_clamped(self):
+        """Чужой, выдуманный или устаревший курсор не приводит к чтению всей истории."""
+        self.write(self.first, self.second, self.foreign)
+        latest = read_cursor(None)
+        self.assertEqual(read_cursor(latest + 1000), latest)
+
+        last_id, summary = read_changes(self.user, 0)
+        self.assertEqual(last_id, latest)
+        self.assertEqual(set(summary), {self.first.id, self.second.id})
+
+    @override_settings(
+        PORTALS_STREAM_POLL_INTERVAL=0.01, PORTALS_STREAM_DB_POLL_INTERVAL=0,
+        PORTALS_STREAM_MAX_AGE=0.2, PORTALS_STREAM_HEARTBEAT=3600,
+    )
+    def test_idle_stream_polls_db_only_with_local_cache(self):
+        """С общим кэшем поток без новых проверок не обращается к БД."""
+        async def consume():
+            return [event async for event in stream_checks(self.user)]
+
+        for shared, polled in ((True, False), (False, True)):
+            with mock.patch('portals.stream.cache_is_shared', return_value=shared), \
+                    mock.patch('portals.stream.read_cursor', return_value=0), \
+                    mock.patch('portals.stream.read_changes', return_value=(0, None)) as changes:
+                asyncio.run(consume())
+            self.assertEqual(changes.called, polled)
+
+
+class JobQueueTests(TestCase):
+    """Очередь фоновых задач."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.portal = Portal.objects.create(user=self.user, title='A', url='https://a.example.com')
+
+    def fail(self, portal):
+        raise ValueError('сбой')
+
+    def test_enqueue_and_claim(self):
+        """Повторная постановка не дублирует задачи, задачу забирают один раз."""
+        enqueue(self.portal, PortalJob.KIND_FAVICON, PortalJob.KIND_CHECK)
+        enqueue(self.portal, PortalJob.KIND_CHECK)
+        self.assertEqual(PortalJob.objects.count(), 2)
+
+        claimed = claim_jobs(10)
+        self.assertEqual(len(claimed), 2)
+        self.assertTrue(all(job.status == PortalJob.STATUS_RUNNING for job in claimed))
+        self.assertEqual(claim_jobs(10), [])
+
+    def test_retry_then_fail(self):
+        """Ошибка возвращает задачу в очередь с задержкой, после MAX_ATTEMPTS - failed."""
+        enqueue(self.portal, PortalJob.KIND_CHECK)
+        with mock.patch.dict(HANDLERS, {PortalJob.KIND_CHECK: self.fail}):
+            job = claim_jobs(1)[0]
+            self.assertFalse(run_job(job))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.error), (PortalJob.STATUS_PENDING, 1, 'сбой'))
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertEqual(claim_jobs(1), [])
+
+            for _ in range(MAX_ATTEMPTS - 1):
+                run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PortalJob.STATUS_FAILED)
+
+    def test_deleted_portal_finishes_job(self):
+        """Удаление портала во время задачи не приводит к ошибке."""
+        enqueue(self.portal, PortalJob.KIND_CHECK)
+        job = claim_jobs(1)[0]
+
+        def delete_portal(portal):
+            portal.delete()
+            raise ValueError('портал удален')
+
+        with mock.patch.dict(HANDLERS, {PortalJob.KIND_CHECK: delete_portal}):
+            self.assertTrue(run_job(job))
+        self.assertFalse(PortalJob.objects.exists())
+
+
+class RollupTests(TestCase):
+    """Почасовые и суточные агрегаты."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        self.portal = Portal.objects.create(user=user, title='A', url='https://a.example.com')
+
+    def rollups(self):
+        return [
+            list(model.objects.filter(portal=self.portal).order_by('bucket').values(
+                'bucket', 'checks_count', 'available_count', 'response_time_count', 'response_time_sum',
+                'response_time_min', 'response_time_max', 'ttfb_sum', 'ttfb_count', 'response_time_sketch',
+            ))
+            for model in (PortalAvailabilityHourly, PortalAvailabilityDaily)
+        ]
+
+    def test_write_path_matches_rebuild(self):
+        """Агрегаты, обновленные при записи, совпадают с пересчитанными."""
+        with CheckResultWriter(batch_size=4, flush_interval=3600) as writer:
+            for i in range(10):
+                writer.add(self.portal, {
+                    'is_available': i % 3 != 0, 'response_time': 10.0 + i, 'ttfb': 5.0, 'status_code': 200,
+                })
+        save_check_result(self.portal, {'is_available': False, 'status_code': None})
+        written = self.rollups()
+        self.assertEqual(written[0][0]['checks_count'], 11)
+
+        rebuild_portal_rollups(self.portal.id)
+        self.assertEqual(self.rollups(), written)
+
+    def test_rebuild_keeps_partially_pruned_bucket(self):
+        """Пересчет после частичной очистки суток не уменьшает их агрегат."""
+        start = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        PortalAvailability.objects.bulk_create([
+            PortalAvailability(portal=self.portal, timestamp=start + timedelta(minutes=30 * i), is_available=True)
+            for i in range(48)
+        ])
+        rebuild_portal_rollups(self.portal.id)
+        before = self.rollups()
+
+        PortalAvailability.objects.filter(timestamp__lt=start + timedelta(hours=3, minutes=15)).delete()
+        rebuild_portal_rollups(self.portal.id)
+        self.assertEqual(self.rollups(), before)
+
+
+class SqliteBackendTests(SimpleTestCase):
+    """Продакшен-бэкенд SQLite: PRAGMA и повтор запросов при блокировке."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'db.sqlite3')
+        self.wrappers = []
+        sqlite_backend.reset_lock_stats()
+
+    def tearDown(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+        self.tmp.cleanup()
+        sqlite_backend.reset_lock_stats()
+
+    def connect(self, **options):
+        wrapper = sqlite_backend.DatabaseWrapper(
+            {**connection.settings_dict, 'ENGINE': 'web_dashboard.db_backend', 'NAME': self.path, 'OPTIONS': options},
+            alias='lock_test',
+        )
+        self.wrappers.append(wrapper)
+        return wrapper
+
+    def lock(self):
+        """Отдельное соединение, удерживающее блокировку записи."""
+        holder = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        holder.execute('BEGIN IMMEDIATE')
+        return holder
+
+    def test_busy_timeout_follows_timeout(self):
+        """busy_timeout берется из OPTIONS['timeout'], явная PRAGMA важнее."""
+        with self.connect(timeout=20).cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 20000)
+        with self.connect(timeout=20, pragmas={'busy_timeout': 100}).cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 100)
+        with self.connect().cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+
+    def test_retries_until_lock_released(self):
+        """Запрос вне транзакции повторяется, пока блокировка не снята."""
+        wrapper = self.connect(timeout=0.05, lock_retries=10, lock_backoff=0.05)
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+
+        holder = self.lock()
+        threading.Timer(0.2, holder.rollback).start()
+        with wrapper.cursor() as cursor:
+            cursor.execute('INSERT INTO item DEFAULT VALUES')
+        holder.close()
+
+        stats = wrapper.lock_stats()
+        self.assertGreaterEqual(stats['retries'], 1)
+        self.assertEqual(stats['lock_errors'], stats['retries'])
+        self.assertEqual(stats['failures'], 0)
+
+    def test_gives_up_after_retries_and_in_transaction(self):
+        """После lock_retries повторов и внутри транзакции ошибка передается дальше."""
+        wrapper = self.connect(timeout=0.01, lock_retries=2, lock_backoff=0.01)
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+
+        holder = self.lock()
+        try:
+            with self.assertRaises(DatabaseError):
+                with wrapper.cursor() as cursor:
+                    cursor.execute('INSERT INTO item DEFAULT VALUES')
+            self.assertEqual(wrapper.lock_stats()['retries'], 2)
+            self.assertEqual(wrapper.lock_stats()['failures'], 1)
+
+            sqlite_backend.reset_lock_stats()
+            wrapper.set_autocommit(False)
+            with self.assertRaises(DatabaseError):
+                with wrapper.cursor() as cursor:
+                    cursor.execute('INSERT INTO item DEFAULT VALUES')
+            wrapper.rollback()
+            wrapper.set_autocommit(True)
+        finally:
+            holder.close()
+        self.assertEqual(wrapper.lock_stats(), {'lock_errors': 1, 'retries': 0, 'retry_wait': 0.0, 'failures': 1})
@@ -31,6 +31,12 @@ urlpatterns = [
     # Получение статистики доступности (JSON API)
     path('portal/<int:portal_id>/availability/', views.portal_availability, name='portal_availability'),
     
+    # Сводка доступности всех порталов пользователя (JSON API)
+    path('portal/availability/', views.portal_availability_batch, name='portal_availability_batch'),
+    
+    # Поток результатов проверок (Server-Sent Events, ASGI)
+    path('portal/stream/', views.portal_stream, name='portal_stream'),
+    
     # Обновление порядка порталов после drag-and-drop (AJAX POST)
     path('portal/reorder/', views.portal_reorder, name='portal_reorder'),
 ]
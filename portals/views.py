@@ -7,11 +7,18 @@
 # Функции для рендеринга шаблонов и получения объектов
 from django.shortcuts import render, get_object_or_404
 
+# Настройки проекта
+from django.conf import settings
+
 # Декоратор для проверки авторизации пользователя
 from django.contrib.auth.decorators import login_required
 
-# Класс для возврата JSON-ответов
-from django.http import JsonResponse
+# Классы для возврата JSON-ответов и потоковых ответов
+from django.http import JsonResponse, StreamingHttpResponse
+
+# Условные ответы (304 Not Modified) и заголовки кэширования
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 # Декоратор для ограничения HTTP-методов
 from django.views.decorators.http import require_http_methods
@@ -20,10 +27,20 @@ from django.views.decorators.http import require_http_methods
 import json
 
 # Модели порталов и проверок доступности
-from .models import Portal, PortalAvailability
+from .models import Portal, PortalAvailability, PortalJob
 
 # Сервисные функции для работы с порталами
-from .services import fetch_favicon, check_portal_availability, get_availability_stats
+from .services import (
+    CHART_RESOLUTIONS, bump_grid_version, check_portal_availability, get_availability_summary,
+    get_cached_availability_stats, get_grid_version, get_stats_version, move_portal, next_position,
+    release_favicon, reorder_portals,
+)
+
+# Очередь фоновых задач (favicon, первая проверка)
+from .jobs import enqueue
+
+# Поток результатов проверок (SSE)
+from .stream import stream_checks
 
 
 @login_required
@@ -33,10 +50,14 @@ def dashboard(request):
     
     Отображает все порталы текущего пользователя,
     отсортированные по позиции и дате создания.
+    Сетка карточек кэшируется по версии пользователя (get_grid_version),
+    queryset ленивый - при попадании в кэш порталы не запрашиваются.
     """
     portals = Portal.objects.filter(user=request.user).order_by('position', '-created_at')
     return render(request, 'portals/dashboard.html', {
-        'portals': portals
+        'portals': portals,
+        'grid_version': get_grid_version(request.user.id),
+        'grid_cache_ttl': settings.PORTALS_GRID_CACHE_TTL,
     })
 
 
@@ -46,8 +67,11 @@ def portal_create(request):
     """
     Создание нового портала (AJAX-эндпоинт).
     
-    Принимает JSON с данными портала, создает запись в БД,
-    загружает favicon и выполняет первую проверку доступности.
+    Принимает JSON с данными портала и создает запись в БД.
+    Загрузка favicon и первая проверка доступности ставятся
+    в очередь фоновых задач (команда run_jobs), поэтому ответ
+    возвращается сразу; карточка получает иконку и статус
+    через portal_availability_batch по мере выполнения задач.
     
     Возвращает JSON с данными созданного портала.
     """
@@ -59,16 +83,12 @@ def portal_create(request):
             title=data.get('title'),
             url=data.get('url'),
             description=data.get('description', ''),
-            position=Portal.objects.filter(user=request.user).count()
+            position=next_position(request.user)
         )
         
-        # Попытка загрузить favicon с сайта
-        favicon_file = fetch_favicon(portal.url)
-        if favicon_file:
-            portal.favicon.save(f'favicon_{portal.id}.png', favicon_file, save=True)
-        
-        # Первая проверка доступности портала
-        check_portal_availability(portal)
+        # Загрузка favicon и первая проверка выполняются в фоне
+        enqueue(portal, PortalJob.KIND_FAVICON, PortalJob.KIND_CHECK)
+        bump_grid_version(request.user.id)
         
         return JsonResponse({
             'success': True,
@@ -78,7 +98,8 @@ def portal_create(request):
                 'url': portal.url,
                 'description': portal.description,
                 'favicon_url': portal.favicon.url if portal.favicon else None,
-                'position': portal.position
+                'position': portal.position,
+                'pending_jobs': True
             }
         })
     except Exception as e:
@@ -92,7 +113,7 @@ def portal_update(request, portal_id):
     Обновление существующего портала (AJAX-эндпоинт).
     
     Принимает JSON с новыми данными портала.
-    Если URL изменился - загружает новый favicon.
+    Если URL изменился - ставит в очередь загрузку нового favicon.
     
     Возвращает JSON с обновленными данными портала.
     """
@@ -101,19 +122,18 @@ def portal_update(request, portal_id):
     try:
         data = json.loads(request.body)
         
+        url_changed = 'url' in data and data['url'] != portal.url
+        
         portal.title = data.get('title', portal.title)
         portal.url = data.get('url', portal.url)
         portal.description = data.get('description', portal.description)
-        
-        # Если URL изменился, обновляем favicon
-        if 'url' in data and data['url'] != portal.url:
-            portal.url = data['url']
-            favicon_file = fetch_favicon(portal.url)
-            if favicon_file:
-                portal.favicon.save(f'favicon_{portal.id}.png', favicon_file, save=True)
-        
         portal.save()
         
+        # Если URL изменился, обновляем favicon и статус в фоне
+        if url_changed:
+            enqueue(portal, PortalJob.KIND_FAVICON, PortalJob.KIND_CHECK)
+        bump_grid_version(request.user.id)
+        
         return JsonResponse({
             'success': True,
             'portal': {
@@ -121,7 +141,8 @@ def portal_update(request, portal_id):
                 'title': portal.title,
                 'url': portal.url,
                 'description': portal.description,
-                'favicon_url': portal.favicon.url if portal.favicon else None
+                'favicon_url': portal.favicon.url if portal.favicon else None,
+                'pending_jobs': url_changed
             }
         })
     except Exception as e:
@@ -134,20 +155,17 @@ def portal_delete(request, portal_id):
     """
     Удаление портала (AJAX-эндпоинт).
     
-    Удаляет файл favicon и запись портала из БД.
+    Удаляет собственный файл favicon и запись портала из БД.
     Вместе с порталом удаляются все связанные проверки доступности.
     """
     portal = get_object_or_404(Portal, id=portal_id, user=request.user)
     
     try:
-        # Удаляем файл favicon если он существует
-        if portal.favicon:
-            try:
-                portal.favicon.delete(save=False)
-            except Exception:
-                pass  # Игнорируем ошибки удаления файла
+        # Удаляем собственный файл favicon (общие файлы доменов сохраняются)
+        release_favicon(portal)
         
         portal.delete()
+        bump_grid_version(request.user.id)
         return JsonResponse({'success': True})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=400)
@@ -159,17 +177,28 @@ def portal_reorder(request):
     """
     Обновление порядка порталов после drag-and-drop (AJAX-эндпоинт).
     
-    Принимает JSON со списком ID порталов в новом порядке
-    и обновляет поле position для каждого.
+    Принимает JSON в одном из двух видов:
+    - {"portal_ids": [...]} - полный список ID в новом порядке,
+      позиции записываются одним запросом (см. reorder_portals);
+    - {"portal_id": X, "after_id": Y, "before_id": Z} - перемещение
+      одного портала между соседями, обновляется одна строка
+      (см. move_portal); крайний сосед может быть null.
     """
     try:
         data = json.loads(request.body)
-        portal_ids = data.get('portal_ids', [])
         
-        for index, portal_id in enumerate(portal_ids):
-            Portal.objects.filter(id=portal_id, user=request.user).update(position=index)
+        if 'portal_id' in data:
+            updated = move_portal(
+                request.user, data['portal_id'],
+                after_id=data.get('after_id'), before_id=data.get('before_id'),
+            )
+        else:
+            updated = reorder_portals(request.user, data.get('portal_ids', []))
+        bump_grid_version(request.user.id)
         
-        return JsonResponse({'success': True})
+        return JsonResponse({'success': True, 'updated': updated})
+    except Portal.DoesNotExist as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=400)
 
@@ -181,20 +210,103 @@ def portal_availability(request, portal_id):
     
     Возвращает процент доступности, среднее время ответа
     и данные для построения графика за указанный период.
+    Параметры ?resolution=raw|hour|day и ?max_points=N ограничивают
+    детализацию и количество точек графика (не более PORTALS_CHART_MAX_POINTS).
     """
     portal = get_object_or_404(Portal, id=portal_id, user=request.user)
     
-    days = int(request.GET.get('days', 7))
-    stats = get_availability_stats(portal, days=days)
+    try:
+        days = int(request.GET.get('days', 7))
+        max_points = int(request.GET['max_points']) if request.GET.get('max_points') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Некорректные параметры запроса'}, status=400)
+    
+    resolution = request.GET.get('resolution') or None
+    if resolution not in (None, *CHART_RESOLUTIONS) or (max_points is not None and max_points < 1):
+        return JsonResponse({'success': False, 'error': 'Некорректные параметры запроса'}, status=400)
+    if max_points is not None:
+        max_points = min(max_points, settings.PORTALS_CHART_MAX_POINTS)
+    
+    # Версия данных - последняя проверка портала: пока новых проверок
+    # нет, клиент получает 304, а сервер не пересчитывает статистику
+    version = get_stats_version(portal)
+    etag = quote_etag(f'{portal.id}-{version[0]}-{days}-{resolution}-{max_points}')
+    last_modified = int(version[1].timestamp()) if version[1] else None
+    
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        stats = get_cached_availability_stats(
+            portal, version, days=days, resolution=resolution, max_points=max_points,
+        )
+        response = JsonResponse({
+            'success': True,
+            'portal_id': portal.id,
+            'portal_title': portal.title,
+            'stats': stats
+        })
+    
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def portal_availability_batch(request):
+    """
+    Получение сводки доступности всех порталов пользователя (JSON API).
+    
+    Заменяет отдельные запросы portal_availability для каждой карточки:
+    статус, процент доступности и время ответа последней проверки
+    возвращаются для всех порталов (или для списка ?ids=1,2,3) одним ответом.
+    Поля favicon_url и pending_jobs позволяют обновить карточку
+    после выполнения фоновых задач.
+    """
+    try:
+        days = int(request.GET.get('days', 7))
+        ids = request.GET.get('ids')
+        portal_ids = [int(portal_id) for portal_id in ids.split(',') if portal_id] if ids else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Некорректные параметры запроса'}, status=400)
+    
+    summary = get_availability_summary(request.user, portal_ids=portal_ids, days=days)
     
     return JsonResponse({
         'success': True,
-        'portal_id': portal.id,
-        'portal_title': portal.title,
-        'stats': stats
+        'portals': {str(portal_id): data for portal_id, data in summary.items()}
     })
 
 
+async def portal_stream(request):
+    """
+    Поток результатов проверок порталов пользователя (Server-Sent Events).
+    
+    Заменяет периодический опрос portal_availability_batch: после записи
+    новых проверок приходит событие 'checks' с той же сводкой по
+    затронутым порталам. Асинхронное представление рассчитано на
+    ASGI-сервер (uvicorn), где простаивающее соединение не занимает поток.
+    Клиент: new EventSource(url).addEventListener('checks', ...).
+    
+    login_required в Django 5.0 не поддерживает асинхронные
+    представления, поэтому пользователь проверяется через auser().
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Требуется авторизация'}, status=401)
+    
+    try:
+        last_id = int(request.headers['Last-Event-ID']) if request.headers.get('Last-Event-ID') else None
+    except ValueError:
+        last_id = None
+    
+    response = StreamingHttpResponse(stream_checks(user, last_id), content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Отключаем буферизацию ответа в nginx
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 @require_http_methods(["POST"])
 def portal_check_now(request, portal_id):
@@ -0,0 +1,4 @@
+"""
+Бэкенд базы данных SQLite для продакшена.
+Подключается в settings_prod.py через ENGINE = 'web_dashboard.db_backend'.
+"""
@@ -0,0 +1,170 @@
+"""
+Бэкенд SQLite для продакшена на основе стандартного django.db.backends.sqlite3.
+
+При создании соединения включает журнал WAL (читатели не ждут писателя),
+synchronous=NORMAL, busy_timeout (из OPTIONS['timeout']), увеличенный кэш страниц и mmap.
+Запросы вне транзакции, получившие "database is locked", повторяются
+с экспоненциальной задержкой; счетчики ожиданий доступны через
+DatabaseWrapper.lock_stats().
+
+Дополнительные ключи OPTIONS (остальные передаются в sqlite3.connect):
+- pragmas: словарь PRAGMA, дополняющий/заменяющий DEFAULT_PRAGMAS
+- transaction_mode: 'DEFERRED' (по умолчанию), 'IMMEDIATE' или 'EXCLUSIVE' -
+  режим BEGIN для atomic(); IMMEDIATE берет блокировку записи сразу
+  и исключает взаимоблокировку при повышении блокировки
+- lock_retries: число повторов при блокировке (по умолчанию 5)
+- lock_backoff: начальная задержка повтора в секундах (по умолчанию 0.05)
+"""
+
+# Случайный разброс задержек и пауза между повторами
+import random
+import time
+
+# Счетчики блокировок общие для всех потоков процесса
+import threading
+
+# Стандартный бэкенд SQLite и модуль sqlite3, который он использует
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base as sqlite_base
+
+
+# PRAGMA, применяемые к каждому новому соединению. busy_timeout
+# (ожидание блокировки внутри SQLite) берется из OPTIONS['timeout']
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,          # отрицательное значение - размер в КБ (20 МБ)
+    'mmap_size': 134217728,        # 128 МБ отображения файла в память
+    'temp_store': 'MEMORY',
+}
+
+# Таймаут ожидания блокировки sqlite3.connect по умолчанию (сек)
+DEFAULT_TIMEOUT = 5
+
+# Допустимые режимы начала транзакции
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+# Максимальная задержка одного повтора (сек)
+MAX_BACKOFF = 1.0
+
+_stats_lock = threading.Lock()
+_stats = {
+    'lock_errors': 0,    # запросов, получивших "database is locked"
+    'retries': 0,        # выполненных повторов
+    'retry_wait': 0.0,   # суммарное время ожидания между повторами (сек)
+    'failures': 0,       # запросов, не выполненных после всех повторов
+}
+
+
+def is_lock_error(error):
+    """Проверяет, что ошибка SQLite вызвана блокировкой базы."""
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def record(**counters):
+    """Добавляет значения к счетчикам блокировок."""
+    with _stats_lock:
+        for name, value in counters.items():
+            _stats[name] += value
+
+
+def lock_stats():
+    """Возвращает копию счетчиков блокировок процесса."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_lock_stats():
+    """Обнуляет счетчики блокировок процесса."""
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+class RetryingCursorWrapper(sqlite_base.SQLiteCursorWrapper):
+    """
+    Курсор, повторяющий запрос при блокировке базы.
+
+    Повтор выполняется только вне транзакции: внутри транзакции
+    ошибка передается вызывающему коду, потому что повторять
+    нужно всю транзакцию, а не отдельный запрос.
+    """
+
+    lock_retries = 5
+    lock_backoff = 0.05
+
+    def _retry(self, method, *args):
+        delay = self.lock_backoff
+        attempt = 0
+        while True:
+            try:
+                return method(*args)
+            except sqlite_base.Database.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                record(lock_errors=1)
+                if self.connection.in_transaction or attempt >= self.lock_retries:
+                    record(failures=1)
+                    raise
+            attempt += 1
+            wait = min(delay, MAX_BACKOFF) * random.uniform(0.5, 1.5)
+            time.sleep(wait)
+            record(retries=1, retry_wait=wait)
+            delay *= 2
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        # Генератор параметров нельзя прочитать повторно
+        return self._retry(super().executemany, query, list(param_list))
+
+
+class DatabaseWrapper(sqlite_base.DatabaseWrapper):
+    """Соединение SQLite с PRAGMA для продакшена и повтором при блокировке."""
+
+    # Дополнительные ключи OPTIONS, не передаваемые в sqlite3.connect
+    EXTRA_OPTIONS = ('pragmas', 'transaction_mode', 'lock_retries', 'lock_backoff')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+
+        # busy_timeout первым: переключение в WAL уже может ждать блокировку.
+        # Значение - тот же timeout (сек), что sqlite3.connect получает из OPTIONS
+        busy_timeout = int(options.get('timeout', DEFAULT_TIMEOUT) * 1000)
+        self.pragmas = {'busy_timeout': busy_timeout, **DEFAULT_PRAGMAS, **options.get('pragmas', {})}
+        self.transaction_mode = (options.get('transaction_mode') or 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode должен быть одним из {', '.join(TRANSACTION_MODES)}"
+            )
+        self.lock_retries = options.get('lock_retries', RetryingCursorWrapper.lock_retries)
+        self.lock_backoff = options.get('lock_backoff', RetryingCursorWrapper.lock_backoff)
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for name in self.EXTRA_OPTIONS:
+            kwargs.pop(name, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=RetryingCursorWrapper)
+        cursor.lock_retries = self.lock_retries
+        cursor.lock_backoff = self.lock_backoff
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        # Стандартный бэкенд Django 5.0 всегда выполняет BEGIN (DEFERRED)
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
+
+    def lock_stats(self):
+        """Счетчики блокировок процесса (см. модуль lock_stats)."""
+        return lock_stats()
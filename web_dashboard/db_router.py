@@ -0,0 +1,34 @@
+"""
+Маршрутизатор баз данных для продакшена.
+Таблица кэша Django (DatabaseCache) хранится в отдельном файле SQLite
+(база 'cache'), чтобы запись в кэш не ждала блокировку основной базы,
+в которую пишет монитор. Остальные модели остаются в 'default'.
+"""
+
+# Метка приложения модели, которую DatabaseCache передает маршрутизатору
+CACHE_APP_LABEL = 'django_cache'
+
+# Псевдоним базы данных кэша
+CACHE_DATABASE = 'cache'
+
+
+class CacheRouter:
+    """Направляет запросы DatabaseCache в базу 'cache'."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return CACHE_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return CACHE_DATABASE
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == CACHE_APP_LABEL:
+            return db == CACHE_DATABASE
+        # В базе кэша нет таблиц приложений
+        if db == CACHE_DATABASE:
+            return False
+        return None
@@ -110,6 +110,21 @@ DATABASES = {
 }
 
 
+# ============================================================================
+# КЭШ
+# ============================================================================
+
+# Кэш в памяти процесса для разработки; в продакшене используется
+# кэш в отдельной базе SQLite (DatabaseCache), общий для всех воркеров
+# и монитора (см. settings_prod.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'web-dashboard',
+    }
+}
+
+
 # ============================================================================
 # ВАЛИДАЦИЯ ПАРОЛЕЙ
 # ============================================================================
@@ -173,6 +188,85 @@ LOGIN_REDIRECT_URL = 'portals:dashboard'
 LOGOUT_REDIRECT_URL = 'accounts:login'
 
 
+# ============================================================================
+# МОНИТОРИНГ ПОРТАЛОВ
+# ============================================================================
+
+# Максимальный размер пачки результатов проверок для одной транзакции
+PORTALS_WRITE_BATCH_SIZE = 500
+
+# Максимальное время (сек) накопления результатов до записи в БД
+PORTALS_WRITE_FLUSH_INTERVAL = 5
+
+# HTTP-клиент проверок: хостов в пуле, keep-alive соединений на хост
+# и раздельные таймауты подключения и чтения (сек)
+PORTALS_HTTP_POOL_HOSTS = 100
+PORTALS_HTTP_POOL_SIZE = 4
+PORTALS_HTTP_CONNECT_TIMEOUT = 5
+PORTALS_HTTP_READ_TIMEOUT = 10
+
+# Кэш DNS монитора: срок жизни ответа и отрицательного ответа (сек)
+PORTALS_DNS_CACHE_TTL = 300
+PORTALS_DNS_NEGATIVE_TTL = 30
+
+# Проверка доступности: сколько байт тела читать после заголовков
+# (0 - только заголовки) и пробовать ли сначала HEAD с откатом на GET
+PORTALS_PROBE_MAX_BYTES = 0
+PORTALS_PROBE_HEAD_FIRST = False
+
+# Остаток тела ответа не длиннее этого (байт) дочитывается, чтобы
+# соединение вернулось в пул keep-alive; больший - соединение закрывается
+PORTALS_PROBE_DRAIN_BYTES = 65536
+
+# Кэш favicon по доменам: срок жизни найденной иконки (дни)
+# и повторная попытка для доменов без иконки (часы)
+PORTALS_FAVICON_MAX_AGE_DAYS = 30
+PORTALS_FAVICON_MISS_TTL_HOURS = 24
+
+# Максимум точек графика в ответе portal_availability: при большем
+# числе проверок данные группируются по часам или суткам
+PORTALS_CHART_MAX_POINTS = 500
+
+# Сколько секунд хранить в кэше ответ portal_availability; новая
+# проверка портала меняет ключ кэша, поэтому данные не устаревают
+PORTALS_STATS_CACHE_TTL = 60
+
+# Сколько секунд хранить отрендеренную сетку порталов на дашборде;
+# изменения порталов сбрасывают кэш сразу через версию пользователя
+PORTALS_GRID_CACHE_TTL = 86400
+
+# Поток SSE с результатами проверок (portal_stream): как часто
+# проверять метку записи в кэше и опрашивать БД без нее (сек, только
+# с локальным для процесса кэшем, см. stream.cache_is_shared),
+# интервал пустых комментариев, время жизни соединения (сек)
+# и пауза перед переподключением браузера (мс)
+PORTALS_STREAM_POLL_INTERVAL = 2
+PORTALS_STREAM_DB_POLL_INTERVAL = 30
+PORTALS_STREAM_HEARTBEAT = 15
+PORTALS_STREAM_MAX_AGE = 300
+PORTALS_STREAM_RETRY_MS = 3000
+
+# Сроки хранения истории в днях (0 - хранить бессрочно)
+PORTALS_RAW_RETENTION_DAYS = 30       # сырые проверки
+PORTALS_HOURLY_RETENTION_DAYS = 180   # почасовые агрегаты
+PORTALS_DAILY_RETENTION_DAYS = 0      # суточные агрегаты
+
+# Колоночное хранение истории: проверки суток, завершившихся более
+# PORTALS_SEGMENT_DELAY_HOURS часов назад, переносятся при очистке
+# истории в сжатые сегменты, которые хранятся PORTALS_SEGMENT_RETENTION_DAYS
+# дней (0 - бессрочно)
+PORTALS_SEGMENT_STORAGE = False
+PORTALS_SEGMENT_DELAY_HOURS = 24
+PORTALS_SEGMENT_RETENTION_DAYS = 365
+
+# Очистка истории: строк в одной транзакции и пауза между порциями (сек)
+PORTALS_PRUNE_CHUNK_SIZE = 2000
+PORTALS_PRUNE_CHUNK_PAUSE = 0.05
+
+# Сколько свободных страниц SQLite возвращать за один incremental_vacuum
+PORTALS_VACUUM_PAGES = 2000
+
+
 # ============================================================================
 # ПРОЧИЕ НАСТРОЙКИ
 # ============================================================================
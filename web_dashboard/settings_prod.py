@@ -52,11 +52,59 @@ MEDIA_ROOT = '/app/media'
 # БАЗА ДАННЫХ
 # ============================================================================
 
-# Путь к базе данных внутри контейнера (монтируется как volume)
+# Путь к базе данных внутри контейнера (монтируется как volume).
+# Бэкенд web_dashboard.db_backend включает WAL, чтобы чтение в gunicorn
+# не ждало записи монитора, и повторяет запросы при блокировке базы
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'web_dashboard.db_backend',
         'NAME': '/app/data/db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'lock_retries': 5,
+            'lock_backoff': 0.05,
+        },
+    },
+    # Отдельный файл для таблицы кэша (см. web_dashboard/db_router.py)
+    'cache': {
+        'ENGINE': 'web_dashboard.db_backend',
+        'NAME': '/app/data/cache.sqlite3',
+        'OPTIONS': {
+            'timeout': 5,
+            'lock_retries': 3,
+            'lock_backoff': 0.02,
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['web_dashboard.db_router.CacheRouter']
+
+
+# ============================================================================
+# КЭШ
+# ============================================================================
+
+# Кэш в таблице SQLite (база 'cache'): общий для всех воркеров gunicorn,
+# uvicorn и монитора. В отличие от FileBasedCache, DatabaseCache
+# не перечисляет каталог при каждой записи и при превышении MAX_ENTRIES
+# сначала удаляет истекшие записи. Если их недостаточно, удаляется
+# 1/CULL_FREQUENCY оставшихся записей по порядку ключей, в том числе
+# бессрочные версии сетки и метки записи проверок. Это безопасно:
+# пропавшая версия сетки создается заново из времени (устаревший
+# фрагмент не отдается), а пропавшая метка воспринимается потоком SSE
+# как изменение и стоит одного лишнего запроса к БД. MAX_ENTRIES
+# рассчитан на ключи статистики (портал × период × детализация)
+# и фрагменты сетки нескольких тысяч порталов, чтобы до этого не доходило.
+# Таблица создается командой createcachetable --database cache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'portals_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_FREQUENCY': 4,
+        },
     }
 }
 